@@ -0,0 +1,121 @@
+"""Benchmark: concurrent appends to a store, with and without group commit
+
+Starts the given numbers of worker processes, like the workers of gunicorn,
+which all append records to the same JSON Lines store as fast as they can,
+and reports the appends per second once with each record written and synced
+to disk on its own, and once with group commit. Every append waits until its
+record is on disk, so the numbers depend on how long fsync takes on the disk
+holding the store, which can be chosen with --directory. Disks with slower
+fsync than the one at hand, like network volumes, can be simulated with
+--fsync-latency.
+
+Each worker has its own fakeredis server, so Redis does not limit the
+results.
+
+Run with "python -m benchmarks.appends" from the project root.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import multiprocessing
+import os
+import tempfile
+import time
+from functools import partial
+
+import click
+import redis
+from fakeredis import FakeRedis, FakeServer
+
+from fsfe_forms import config, create_app, json_store
+
+
+def _slow_fsync(latency: float, fsync, fd) -> None:
+    fsync(fd)
+    time.sleep(latency)
+
+
+def _worker(directory, batch, window, latency, appends, barrier, results) -> None:
+    config.TESTING = True
+    config.LOCK_DIR = directory
+    config.STORE_GROUP_COMMIT_BATCH = batch
+    config.STORE_GROUP_COMMIT_WINDOW = window
+    redis.Redis = partial(FakeRedis, server=FakeServer())
+    if latency:
+        os.fsync = partial(_slow_fsync, latency, os.fsync)
+    app = create_app()
+    storage = os.path.join(directory, "store.jsonl")
+    with app.app_context():
+        barrier.wait()
+        start = time.perf_counter()
+        for number in range(appends):
+            json_store.log(
+                storage,
+                "FROM",
+                ["TO"],
+                "SUBJECT",
+                "CONTENT",
+                None,
+                {"confirm": f"{os.getpid()}-{number}@example.com"},
+            )
+        results.put((start, time.perf_counter()))
+
+
+def measure(
+    workers: int, appends: int, batch: int, window: float, latency: float, parent
+) -> float:
+    """Appends per second of the given number of concurrent workers"""
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    with tempfile.TemporaryDirectory(dir=parent) as directory:
+        processes = [
+            context.Process(
+                target=_worker,
+                args=(directory, batch, window, latency, appends, barrier, results),
+            )
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        times = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        with open(os.path.join(directory, "store.jsonl")) as f:
+            assert sum(1 for _ in f) == workers * appends
+    start = min(start for start, _ in times)
+    end = max(end for _, end in times)
+    return workers * appends / (end - start)
+
+
+@click.command()
+@click.option("--workers", default="1,2,4,8,16", help="Comma separated counts.")
+@click.option("--appends", default=200, help="Appends per worker.")
+@click.option("--batch", default=32, help="STORE_GROUP_COMMIT_BATCH.")
+@click.option("--window", default=0.002, help="STORE_GROUP_COMMIT_WINDOW.")
+@click.option(
+    "--fsync-latency",
+    "latency",
+    default=0.0,
+    help="Milliseconds to add to each fsync, to simulate a slower disk.",
+)
+@click.option(
+    "--directory",
+    type=click.Path(file_okay=False, exists=True),
+    help="Where to put the store (default: the temporary directory).",
+)
+def main(workers, appends, batch, window, latency, directory):
+    """Measure appends per second for different numbers of workers."""
+    click.echo(f"{'workers':>7} {'single/s':>10} {'group/s':>10} {'speedup':>8}")
+    for count in (int(value) for value in workers.split(",")):
+        single = measure(count, appends, 1, 0, latency / 1000, directory)
+        group = measure(count, appends, batch, window, latency / 1000, directory)
+        click.echo(f"{count:7} {single:10.0f} {group:10.0f} {group / single:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
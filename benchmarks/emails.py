@@ -0,0 +1,81 @@
+"""Microbenchmark: creating email messages from templates
+
+For each template in fsfe_forms/templates, compares rendering the whole
+template and parsing the result as a message with rendering a prepared
+template, which only renders and encodes the parts containing variables.
+
+Run with "python -m benchmarks.emails" from the project root.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import email
+import email.policy
+import timeit
+from pathlib import Path
+
+from flask import render_template
+from jinja2 import meta
+
+from fsfe_forms import config, create_app
+from fsfe_forms.email import _header, _skeleton
+
+
+TEMPLATES = Path(__file__).parent.parent / "fsfe_forms" / "templates"
+
+
+def parse_rendered(template: str, context: dict) -> email.message.Message:
+    """What send_email() used to do for each message"""
+    message = email.message_from_string(
+        render_template(f"{template}.eml", **context), policy=email.policy.render
+    )
+    message.set_charset("utf-8")
+    return message
+
+
+def render_prepared(template: str, context: dict) -> email.message.Message:
+    message = _skeleton(template, None).render(context)
+    message["MIME-Version"] = _header("MIME-Version", "1.0")
+    message["Content-Type"] = _header("Content-Type", 'text/plain; charset="utf-8"')
+    message["Content-Transfer-Encoding"] = _header(
+        "Content-Transfer-Encoding", "quoted-printable"
+    )
+    return message
+
+
+def compare(app, template: str, number: int = 500) -> None:
+    source = (TEMPLATES / f"{template}.eml").read_text()
+    variables = meta.find_undeclared_variables(app.jinja_env.parse(source))
+    context = {}
+    app.update_template_context(context)
+    for variable in variables - context.keys():
+        context[variable] = "Value with Ümlaut"
+    context["confirm"] = "EMAIL@example.com"
+    # Serialize the messages, as sending them does
+    before = timeit.timeit(
+        lambda: parse_rendered(template, context).as_string(), number=number
+    )
+    after = timeit.timeit(
+        lambda: render_prepared(template, context).as_string(), number=number
+    )
+    print(
+        f"{template:24} {before / number * 1e6:8.1f} µs "
+        f"{after / number * 1e6:8.1f} µs {before / after:6.1f}x"
+    )
+
+
+def main() -> None:
+    config.TESTING = True
+    app = create_app()
+    print(f"{'Template':24} {'parsed':>11} {'prepared':>11}")
+    with app.test_request_context():
+        for path in sorted(TEMPLATES.glob("*.eml")):
+            compare(app, path.stem)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""Load test: the whole application under concurrent requests
+
+Serves the application built by create_app() over HTTP, with local stand-ins
+for everything it talks to: fakeredis (or a real Redis server given with
+--redis), an aiosmtpd server which accepts and discards all emails, and a
+fake Community Database answering like the one in forms-fake-fsfe-cd-front.
+Email address verification is skipped, as in the functional tests, because
+it depends on DNS and remote mail servers.
+
+For each store size, the store of the pmpc-sign application is filled with
+that many signatures, and each flow is run with the given number of
+concurrent clients:
+
+- register: new signatures, which are queued and get a confirmation email
+- duplicate: signatures with addresses already in the store
+- confirm: the landing page for confirmation links
+- redeem: confirmations, which are sent to the Community Database and stored
+
+The clients run in separate processes, so they do not compete with the
+server for the interpreter lock. For each flow and store size, the median
+and 99th percentile of the response times and the requests per second are
+reported, and can be saved as JSON and compared with an earlier run:
+
+    python -m benchmarks.load run --output before.json
+    python -m benchmarks.load run --output after.json
+    python -m benchmarks.load compare before.json after.json
+
+The comparison fails if any flow has become slower by more than the given
+tolerance, so it can be used as a regression check.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import logging
+import multiprocessing
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import UTC, datetime
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import click
+import redis
+import requests
+from aiosmtpd.controller import Controller
+from fakeredis import FakeRedis, FakeServer
+from werkzeug.serving import make_server
+
+from fsfe_forms import config, create_app, json_store
+from fsfe_forms.queue import queue_push
+
+
+ROOT = Path(__file__).parent.parent
+FAKE_CD_CONFIG = ROOT / "forms-fake-fsfe-cd-front" / "config"
+APPID = "pmpc-sign"
+
+# Status code expected for each flow
+FLOWS = {"register": 302, "duplicate": 302, "confirm": 200, "redeem": 302}
+
+
+# =============================================================================
+# Stand-ins for the mail server and the Community Database
+# =============================================================================
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SinkHandler:
+    """Accepts all emails and only counts them"""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    async def handle_DATA(self, _server, _session, _envelope):  # noqa: N802
+        self.count += 1
+        return "250 OK"
+
+
+class FakeCDHandler(BaseHTTPRequestHandler):
+    """Answers POST requests with the responses of forms-fake-fsfe-cd-front"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # noqa: N802
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0].strip("/")
+        response = FAKE_CD_CONFIG / path / "POST_200.json"
+        if response.is_file():
+            status, body = 200, response.read_bytes()
+        else:
+            status, body = 404, b"{}"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(server) -> threading.Thread:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+# =============================================================================
+# Setting up the application
+# =============================================================================
+
+
+def _configure(
+    workdir: Path, smtp_port: int, cd_port: int, redis_url, concurrency: int
+) -> None:
+    """Point the configuration to the stand-ins and a temporary store
+
+    The server handles each request in a thread of its own, so the connection
+    pools are made large enough for all concurrent requests.
+    """
+    with open(ROOT / "fsfe_forms" / "applications.json") as f:
+        app_configs = json.load(f)
+    app_configs[APPID]["store"] = str(workdir / "signatures.jsonl")
+    app_config_file = workdir / "applications.json"
+    app_config_file.write_text(json.dumps(app_configs))
+
+    config.TESTING = True
+    config.APP_CONFIG_FILE = str(app_config_file)
+    config.APP_CONFIG_RELOAD_INTERVAL = 0
+    config.LOCK_DIR = str(workdir)
+    config.MAIL_SERVER = "127.0.0.1"
+    config.MAIL_PORT = smtp_port
+    config.MAIL_HELO_HOST = "localhost"
+    config.MAIL_POOL_SIZE = concurrency
+    config.FSFE_CD_URL = f"http://127.0.0.1:{cd_port}/"
+    config.FSFE_CD_POOL_SIZE = concurrency
+    config.RATELIMIT_DEFAULT = None
+    if redis_url:
+        connection = redis.Redis.from_url(redis_url).connection_pool
+        config.REDIS_HOST = connection.connection_kwargs["host"]
+        config.REDIS_PORT = connection.connection_kwargs["port"]
+        config.REDIS_PASSWORD = connection.connection_kwargs.get("password")
+    else:
+        redis.Redis = partial(FakeRedis, server=FakeServer())
+
+
+def _signature(email: str) -> dict:
+    return {
+        "appid": APPID,
+        "name": "THE NAME",
+        "confirm": email,
+        "lang": "en",
+        "permissionPriv": "yes",
+        "permissionPub": "yes",
+    }
+
+
+def _fill_store(app, size: int) -> None:
+    """Replace the store with one containing the given number of signatures"""
+    storage = app.app_configs[APPID].store
+    with open(storage, "w") as f:
+        f.writelines(
+            json_store._serialize(
+                {
+                    "timestamp": time.time(),
+                    "from": "",
+                    "to": [""],
+                    "subject": "",
+                    "content": "",
+                    "reply-to": "",
+                    "include_vars": _signature(f"signer{i}@example.com"),
+                }
+            )
+            for i in range(size)
+        )
+    with app.app_context(), json_store.lock_store(storage):
+        json_store.build_index(storage)
+
+
+def _requests(app, flow: str, size: int, count: int) -> list[tuple[str, dict]]:
+    """Paths and query parameters of the requests for a flow"""
+    if flow == "register":
+        return [
+            ("/email", _signature(f"new{size}-{i}@example.com")) for i in range(count)
+        ]
+    if flow == "duplicate":
+        return [
+            ("/email", _signature(f"signer{i % max(size, 1)}@example.com"))
+            for i in range(count)
+        ]
+    # Confirmations need pending registrations
+    path = "/confirm" if flow == "confirm" else "/redeem"
+    with app.test_request_context():
+        return [
+            (path, {"id": str(queue_push(_signature(f"pending{i}@example.com")))})
+            for i in range(count)
+        ]
+
+
+# =============================================================================
+# Running the load
+# =============================================================================
+
+
+def _client(base_url: str, items: list[tuple[str, dict]]) -> list[tuple[float, int]]:
+    """Send requests one after another, returning their times and statuses"""
+    results = []
+    with requests.Session() as session:
+        for path, params in items:
+            start = time.perf_counter()
+            response = session.get(
+                base_url + path, params=params, allow_redirects=False
+            )
+            results.append((time.perf_counter() - start, response.status_code))
+    return results
+
+
+def _run_flow(pool, base_url: str, items: list, concurrency: int, expected: int):
+    chunks = [items[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    results = [
+        result
+        for chunk in pool.map(partial(_client, base_url), chunks)
+        for result in chunk
+    ]
+    wall = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(results),
+        "errors": sum(status != expected for _, status in results),
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "rps": round(len(results) / wall, 1),
+    }
+
+
+def _parse_sizes(_ctx, _param, value) -> list[int]:
+    try:
+        return [int(size) for size in value.split(",")]
+    except ValueError as error:
+        raise click.BadParameter("must be a comma separated list of numbers") from error
+
+
+@click.group()
+def cli():
+    """Load test of the FSFE Form Server."""
+
+
+@cli.command("run")
+@click.option(
+    "--sizes",
+    default="1000,10000,100000",
+    callback=_parse_sizes,
+    help="Comma separated store sizes, for example 1000,1000000.",
+)
+@click.option("--requests", "count", default=500, help="Requests per flow.")
+@click.option("--concurrency", default=8, help="Number of concurrent clients.")
+@click.option("--warmup", default=20, help="Unmeasured requests before each flow.")
+@click.option("--flows", default=",".join(FLOWS), help="Comma separated flows.")
+@click.option(
+    "--redis",
+    "redis_url",
+    help="URL of a Redis server to use instead of fakeredis. The databases "
+    "configured for fsfe-forms are flushed!",
+)
+@click.option("--output", type=click.Path(dir_okay=False), help="Save as JSON.")
+def run_command(sizes, count, concurrency, warmup, flows, redis_url, output):
+    """Run the flows against each store size."""
+    flows = flows.split(",")
+    for flow in flows:
+        if flow not in FLOWS:
+            raise click.BadParameter(f"unknown flow {flow}", param_hint="--flows")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        sink = SinkHandler()
+        smtp = Controller(sink, hostname="127.0.0.1", port=_free_port())
+        smtp.start()
+        fake_cd = ThreadingHTTPServer(("127.0.0.1", 0), FakeCDHandler)
+        _serve(fake_cd)
+        _configure(
+            Path(workdir), smtp.port, fake_cd.server_port, redis_url, concurrency
+        )
+
+        app = create_app()
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        app.logger.setLevel(logging.WARNING)
+        if redis_url:
+            for db in (app.queue_db, app.store_db, app.cache_db):
+                db.flushdb()
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        _serve(server)
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        results = []
+        click.echo(
+            f"{'flow':10} {'store':>9} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} "
+            f"{'errors':>6}"
+        )
+        # Spawned processes do not inherit the threads of the stand-ins
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(concurrency) as pool:
+            for size in sizes:
+                _fill_store(app, size)
+                for flow in flows:
+                    items = _requests(app, flow, size, warmup + count)
+                    if warmup:
+                        _run_flow(pool, base_url, items[:warmup], concurrency, 0)
+                    result = _run_flow(
+                        pool, base_url, items[warmup:], concurrency, FLOWS[flow]
+                    )
+                    result = {"flow": flow, "store_size": size, **result}
+                    results.append(result)
+                    click.echo(
+                        f"{flow:10} {size:9} {result['p50_ms']:9.2f} "
+                        f"{result['p99_ms']:9.2f} {result['rps']:8.1f} "
+                        f"{result['errors']:6}"
+                    )
+
+        server.shutdown()
+        fake_cd.shutdown()
+        smtp.stop()
+        click.echo(f"{sink.count} emails sent")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(
+                {
+                    "date": datetime.now(UTC).isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "redis": redis_url or "fakeredis",
+                    "concurrency": concurrency,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+@cli.command("compare")
+@click.argument("before", type=click.File())
+@click.argument("after", type=click.File())
+@click.option(
+    "--tolerance",
+    default=0.1,
+    help="Allowed relative slowdown of p99 and requests per second.",
+)
+def compare_command(before, after, tolerance):
+    """Compare two saved runs, failing if AFTER is slower than BEFORE."""
+    old = {(r["flow"], r["store_size"]): r for r in json.load(before)["results"]}
+    regressions = 0
+    click.echo(f"{'flow':10} {'store':>9} {'p99 ms':>19} {'req/s':>17}")
+    for result in json.load(after)["results"]:
+        key = (result["flow"], result["store_size"])
+        if key not in old:
+            continue
+        p99 = result["p99_ms"] / old[key]["p99_ms"] - 1
+        rps = result["rps"] / old[key]["rps"] - 1
+        worse = p99 > tolerance or rps < -tolerance
+        regressions += worse
+        click.echo(
+            f"{key[0]:10} {key[1]:9} {old[key]['p99_ms']:8.2f} → "
+            f"{result['p99_ms']:8.2f} {old[key]['rps']:7.1f} → "
+            f"{result['rps']:7.1f} {p99:+7.0%} {rps:+7.0%}"
+            + ("  REGRESSION" if worse else "")
+        )
+    if regressions:
+        click.echo(f"{regressions} regressions")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
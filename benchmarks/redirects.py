@@ -0,0 +1,50 @@
+"""Microbenchmark: rendering redirect addresses
+
+Compares rendering the redirect address of a step from its source on every
+request with the compiled templates and plain strings kept in the compiled
+application configuration.
+
+Run with "python -m benchmarks.redirects" from the project root.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import timeit
+from os import path
+
+from flask import render_template_string
+
+from fsfe_forms import config, create_app
+
+
+PARAMS = {"appid": "pmpc-sign", "lang": "en", "project": "PROJECT"}
+
+
+def compare(source: str, step, number: int = 2000) -> None:
+    per_request = timeit.timeit(
+        lambda: render_template_string(source, **PARAMS), number=number
+    )
+    cached = timeit.timeit(lambda: step.redirect_url(PARAMS), number=number)
+    print(source)
+    print(f"  render_template_string: {per_request / number * 1e6:8.2f} µs")
+    print(f"  compiled configuration: {cached / number * 1e6:8.2f} µs")
+
+
+def main() -> None:
+    config.TESTING = True
+    app = create_app()
+    with open(path.join(path.dirname(config.__file__), "applications.json")) as f:
+        raw = json.load(f)
+
+    with app.test_request_context():
+        for appid, step in (("pmpc-sign", "register"), ("contact", "register")):
+            compare(raw[appid][step]["redirect"], getattr(app.app_configs[appid], step))
+
+
+if __name__ == "__main__":
+    main()
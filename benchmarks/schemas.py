@@ -0,0 +1,45 @@
+"""Microbenchmark: validation with prebuilt vs. per-request schemas
+
+Run with "python -m benchmarks.schemas" from the project root.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import timeit
+
+from fsfe_forms import config, create_app
+from fsfe_forms.applications import build_schema
+
+
+PARAMS = {
+    "appid": "pmpc-sign",
+    "name": "THE NAME",
+    "confirm": "EMAIL@example.com",
+    "lang": "en",
+    "permissionPriv": "yes",
+    "permissionPub": "yes",
+}
+
+
+def main() -> None:
+    config.TESTING = True
+    app = create_app()
+    parameters = app.app_configs["pmpc-sign"].parameters
+    schema = app.app_configs["pmpc-sign"].schema
+    number = 2000
+
+    per_request = timeit.timeit(
+        lambda: build_schema(parameters, True).validate(PARAMS), number=number
+    )
+    prebuilt = timeit.timeit(lambda: schema.validate(PARAMS), number=number)
+
+    print(f"Schema built per request: {per_request / number * 1e6:8.1f} µs")
+    print(f"Prebuilt schema:          {prebuilt / number * 1e6:8.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
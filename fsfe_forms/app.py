@@ -7,22 +7,50 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import json
 import logging
 import logging.handlers
-from os import path
 
 import redis
 from flask import Flask
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from flask.cli import FlaskGroup
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from fsfe_forms import config
+from fsfe_forms import (
+    cd_sync,
+    config,
+    export,
+    json_store,
+    mailer,
+    profiling,
+    queue,
+    stats,
+    verification,
+)
+from fsfe_forms.applications import init_applications
+from fsfe_forms.cd import init_cd
+from fsfe_forms.cd_sync import init_cd_sync
 from fsfe_forms.email import init_email
+from fsfe_forms.json_store import init_json_store
+from fsfe_forms.mailer import init_mailer
+from fsfe_forms.metrics import init_metrics, metrics
+from fsfe_forms.profiling import init_profiling
+from fsfe_forms.queue import init_queue
+from fsfe_forms.ratelimit import init_ratelimit, limit_per_app
+from fsfe_forms.stats import init_stats
+from fsfe_forms.verification import init_verification
 from fsfe_forms.views import confirm, email, index, redeem
 
 
+def _connect_redis(app, db: int) -> redis.Redis:
+    """Connect to a database on the configured Redis server"""
+    return redis.Redis(
+        host=app.config["REDIS_HOST"],
+        port=app.config["REDIS_PORT"],
+        password=app.config["REDIS_PASSWORD"],
+        db=db,
+    )
+
+
 def create_app():
     """Main application factory"""
     app = Flask(__name__.split(".")[0])
@@ -34,6 +62,9 @@ def create_app():
     # Read configuration
     app.config.from_object(config)
 
+    # Optionally, profile sampled and slow requests
+    init_profiling(app)
+
     # Configure the root logger
     logging.basicConfig(
         format="[%(asctime)s] (%(name)s) %(levelname)s: %(message)s",
@@ -56,28 +87,64 @@ def create_app():
         handler.setLevel(logging.ERROR)
         logging.getLogger().addHandler(handler)
 
-    # Initialize Flask-Limiter
-    app.limiter = Limiter(get_remote_address, app=app)
-
     # Initialize our own email module
     init_email(app)
 
+    # Initialize the connection pool for the FSFE Community Database
+    init_cd(app)
+
     # Initialize Redis store for double opt-in queue
-    app.queue_db = redis.Redis(
-        host=app.config["REDIS_HOST"],
-        port=app.config["REDIS_PORT"],
-        password=app.config["REDIS_PASSWORD"],
-        db=app.config["REDIS_QUEUE_DB"],
-    )
+    app.queue_db = _connect_redis(app, app.config["REDIS_QUEUE_DB"])
+    init_queue(app)
+    init_mailer(app)
+    init_cd_sync(app)
+
+    # Initialize Redis store for the indexes of the JSON stores
+    app.store_db = _connect_redis(app, app.config["REDIS_STORE_DB"])
+
+    # Initialize Redis store and local cache for email verification results
+    app.cache_db = _connect_redis(app, app.config["REDIS_CACHE_DB"])
+    init_verification(app)
 
     # Load application configurations
-    with open(path.join(path.dirname(__file__), "applications.json")) as f:
-        app.app_configs = json.load(f)
+    init_applications(app)
+
+    # Repair stores left incomplete by a crash
+    init_json_store(app)
+
+    # Initialize Flask-Limiter
+    init_ratelimit(app)
+
+    # Count requests per application and outcome
+    init_metrics(app)
+
+    # Initialize the cache for the statistics of the stores
+    init_stats(app)
 
     # Register views
     app.add_url_rule(rule="/", view_func=index)
-    app.add_url_rule(rule="/email", view_func=email, methods=["GET", "POST"])
+    app.add_url_rule(
+        rule="/email", view_func=limit_per_app(app, email), methods=["GET", "POST"]
+    )
     app.add_url_rule(rule="/confirm", view_func=confirm)
     app.add_url_rule(rule="/redeem", view_func=redeem)
+    app.add_url_rule(rule="/metrics", view_func=app.limiter.exempt(metrics))
+    app.add_url_rule(rule="/stats/<appid>", view_func=app.limiter.exempt(stats.stats))
+    app.add_url_rule(rule="/export/<appid>", view_func=export.export)
+
+    # Register command line tools
+    app.cli.add_command(cd_sync.cli)
+    app.cli.add_command(export.export_command)
+    app.cli.add_command(json_store.cli)
+    app.cli.add_command(mailer.cli)
+    app.cli.add_command(profiling.cli)
+    app.cli.add_command(queue.cli)
+    app.cli.add_command(stats.cli)
+    app.cli.add_command(verification.cli)
 
     return app
+
+
+# Entry point for the "fsfe-forms" command line tool, which offers the same
+# commands as "flask" does with FLASK_APP pointing to this application
+cli = FlaskGroup(create_app=create_app)
@@ -0,0 +1,291 @@
+"""Configuration of the applications
+
+The configuration of all applications is read from applications.json and
+compiled into AppConfig objects once: parameters are turned into validation
+schemas, redirect addresses into Jinja templates, and all email templates are
+checked to exist. Any error in the file is reported right away instead of
+when the first request for the application comes in.
+
+The file is checked for changes at most every APP_CONFIG_RELOAD_INTERVAL
+seconds, and reloaded without restarting the server. The new configuration
+replaces the old one as a whole, and only if it compiles without errors;
+otherwise, the old configuration stays in use.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+from flask import current_app
+from jinja2 import Environment, Template, TemplateError
+from limits import parse_many
+from marshmallow import Schema
+from marshmallow.fields import Boolean, Email, String
+from marshmallow.validate import Equal, Length, Regexp
+
+
+class AppConfigError(Exception):
+    def __init__(self, message):
+        self.message = f"Error in application configuration: {message}"
+        super().__init__(self.message)
+
+
+@dataclass(frozen=True)
+class Step:
+    """What to do on registration, confirmation, or a duplicate
+
+    redirect is either a compiled template, or a plain string if the address
+    contains no template syntax, which is then used as it is.
+    """
+
+    email: str | None
+    redirect: Template | str
+
+    def redirect_url(self, params: dict) -> str:
+        """The address to redirect the user's browser to"""
+        if isinstance(self.redirect, str):
+            return self.redirect
+        return self.redirect.render(**params)
+
+
+@dataclass(frozen=True)
+class AppConfig:
+    """Compiled configuration of a single application"""
+
+    appid: str
+    parameters: dict[str, list[str]]
+    schema: Schema
+    register: Step
+    confirm: Step | None = None
+    duplicate: Step | None = None
+    store: str | None = None
+    cd: dict[str, str] | None = None
+    ratelimit: str | None = None
+    stats: bool = False
+
+
+def build_schema(parameters: dict, confirm: bool) -> Schema:
+    """Build a Marshmallow Schema from the parameters of an application"""
+    fields = {
+        "appid": String(required=True),
+        "lang": String(validate=Regexp(r"^[a-z]{2}$"), load_default=None),
+    }
+    if confirm:
+        # Do syntax check
+        fields["confirm"] = Email(required=True)
+
+    for name, options in parameters.items():
+        field_class = String
+        validate = []
+        required = False
+        for opt in options:
+            match opt:
+                case "boolean":
+                    field_class = Boolean
+                case "email":
+                    field_class = Email
+                case "forbidden":
+                    validate.append(Length(equal=0))
+                case "mandatory":
+                    field_class = Boolean
+                    required = True
+                    validate.append(Equal(True, error="Mandatory."))
+                case "required":
+                    required = True
+                case "single-line":
+                    validate.append(Regexp(r"^[^\r\n]*$"))
+                case _:
+                    raise AppConfigError(f"Invalid option {opt} for parameter {name}")
+        kwargs = {"required": required, "validate": validate}
+        if not required:
+            kwargs["load_default"] = None
+        fields[name] = field_class(**kwargs)
+    return Schema.from_dict(fields)()
+
+
+_KEYS = {
+    "parameters",
+    "register",
+    "confirm",
+    "duplicate",
+    "store",
+    "cd",
+    "ratelimit",
+    "stats",
+}
+
+# Types of the values of the keys, as decoded from JSON
+_TYPES = {
+    "parameters": (dict, "an object"),
+    "register": (dict, "an object"),
+    "confirm": (dict, "an object"),
+    "duplicate": (dict, "an object"),
+    "store": (str, "a string"),
+    "cd": (dict, "an object"),
+    "ratelimit": (str, "a string"),
+}
+
+
+@lru_cache(maxsize=256)
+def _compile_redirect(env: Environment, source: str) -> Template | str:
+    """Compile a redirect address, unless it is a plain string
+
+    Compiled templates are cached by their source, so the same address used
+    by several applications, or kept across reloads, is compiled only once.
+    """
+    if not any(marker in source for marker in ("{{", "{%", "{#")):
+        return source
+    return env.from_string(source)
+
+
+def _compile_step(appid: str, name: str, raw: dict, env: Environment) -> Step:
+    if "redirect" not in raw:
+        raise AppConfigError(f"No redirect for {name} in {appid}")
+    if not isinstance(raw["redirect"], str):
+        raise AppConfigError(f"redirect for {name} must be a string in {appid}")
+    email = raw.get("email")
+    if email is not None and not isinstance(email, str):
+        raise AppConfigError(f"email for {name} must be a string in {appid}")
+    try:
+        if email is not None:
+            env.get_template(f"{email}.eml")
+        redirect = _compile_redirect(env, raw["redirect"])
+    except TemplateError as error:
+        msg = f"Invalid template for {name} in {appid}: {error}"
+        raise AppConfigError(msg) from error
+    return Step(email=email, redirect=redirect)
+
+
+def compile_app_config(appid: str, raw: dict, env: Environment) -> AppConfig:
+    """Check and compile the configuration of a single application
+
+    Email templates are looked up and redirect addresses compiled in the
+    given Jinja environment.
+    """
+    if not isinstance(raw, dict):
+        raise AppConfigError(f"{appid} must be an object")
+    unknown = set(raw) - _KEYS
+    if unknown:
+        raise AppConfigError(f"Unknown keys {', '.join(sorted(unknown))} in {appid}")
+    for key in ("parameters", "register"):
+        if key not in raw:
+            raise AppConfigError(f"No {key} in {appid}")
+    for key, (kind, description) in _TYPES.items():
+        if key in raw and not isinstance(raw[key], kind):
+            raise AppConfigError(f"{key} must be {description} in {appid}")
+    for name, options in raw["parameters"].items():
+        if not isinstance(options, list):
+            raise AppConfigError(f"Options of {name} must be a list in {appid}")
+    if "confirm" in raw and "store" not in raw:
+        raise AppConfigError(f"No store for confirmed registrations in {appid}")
+    if "duplicate" in raw and "confirm" not in raw:
+        raise AppConfigError(f"Duplicate check without confirmation in {appid}")
+    if "stats" in raw and not isinstance(raw["stats"], bool):
+        raise AppConfigError(f"stats must be true or false in {appid}")
+    if raw.get("stats") and "store" not in raw:
+        raise AppConfigError(f"No store for stats in {appid}")
+    if "ratelimit" in raw:
+        try:
+            parse_many(raw["ratelimit"])
+        except ValueError as error:
+            msg = f"Invalid ratelimit for {appid}: {error}"
+            raise AppConfigError(msg) from error
+    steps = {
+        name: _compile_step(appid, name, raw[name], env)
+        for name in ("register", "confirm", "duplicate")
+        if name in raw
+    }
+    return AppConfig(
+        appid=appid,
+        parameters=raw["parameters"],
+        schema=build_schema(raw["parameters"], "confirm" in raw),
+        store=raw.get("store"),
+        cd=raw.get("cd"),
+        ratelimit=raw.get("ratelimit"),
+        stats=raw.get("stats", False),
+        **steps,
+    )
+
+
+def load_app_configs(filename: str, env: Environment) -> dict[str, AppConfig]:
+    """Read and compile the configuration of all applications"""
+    try:
+        with open(filename) as f:
+            raw = json.load(f)
+    except ValueError as error:
+        raise AppConfigError(f"Invalid JSON in {filename}: {error}") from error
+    if not isinstance(raw, dict):
+        raise AppConfigError(f"{filename} must contain an object")
+    return {
+        appid: compile_app_config(appid, app_config, env)
+        for appid, app_config in raw.items()
+    }
+
+
+def _file_version(filename: str) -> tuple:
+    """Something which changes whenever the file is replaced or modified"""
+    stat = os.stat(filename)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def init_applications(app) -> None:
+    """Initialize the module
+
+    Loads the configuration of all applications, and arranges for it to be
+    reloaded when the file changes.
+    """
+    filename = app.config["APP_CONFIG_FILE"] or os.path.join(
+        os.path.dirname(__file__), "applications.json"
+    )
+    app.app_configs_file = filename
+    app.app_configs_version = _file_version(filename)
+    app.app_configs = load_app_configs(filename, app.jinja_env)
+    app.app_configs_checked = time.monotonic()
+    app.app_configs_lock = threading.Lock()
+    if app.config["APP_CONFIG_RELOAD_INTERVAL"] > 0:
+        app.before_request(_reload_before_request)
+
+
+def _reload_before_request() -> None:
+    reload_if_changed()
+
+
+def reload_if_changed() -> bool:
+    """Reload the configuration if the file has changed
+
+    Checks at most every APP_CONFIG_RELOAD_INTERVAL seconds. Returns whether
+    a new configuration has been loaded.
+    """
+    app = current_app._get_current_object()
+    now = time.monotonic()
+    if now - app.app_configs_checked < app.config["APP_CONFIG_RELOAD_INTERVAL"]:
+        return False
+    # Only one thread checks; the others go on with the current configuration
+    if not app.app_configs_lock.acquire(blocking=False):
+        return False
+    try:
+        app.app_configs_checked = now
+        try:
+            version = _file_version(app.app_configs_file)
+            if version == app.app_configs_version:
+                return False
+            # Set in advance, so a broken file is only reported once
+            app.app_configs_version = version
+            app_configs = load_app_configs(app.app_configs_file, app.jinja_env)
+        except (OSError, AppConfigError) as error:
+            app.logger.error("Keeping old application configuration: %s", error)
+            return False
+        app.app_configs = app_configs
+        app.logger.info("Reloaded application configuration")
+        return True
+    finally:
+        app.app_configs_lock.release()
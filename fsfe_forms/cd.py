@@ -1,4 +1,8 @@
-"""Interaction with the FSFE Community Database"""
+"""Interaction with the FSFE Community Database
+
+All requests go through a requests session per worker process, so the
+connections to the Community Database are kept alive and reused.
+"""
 
 # This file is part of the FSFE Form Server.
 #
@@ -10,11 +14,56 @@ from datetime import date
 from hashlib import sha256
 
 from flask import current_app
-from requests import post
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fsfe_forms import metrics
+
+
+def init_cd(app) -> None:
+    """Initialize the module"""
+    # Connection attempts are retried, because nothing has been sent yet at
+    # that point. A request is retried once if the connection breaks after
+    # sending it, which happens when the Community Database closes a kept
+    # alive connection just as it is reused. Both requests are idempotent:
+    # subscribing an address again updates the existing registration, and
+    # confirming it again changes nothing. Error responses are never retried.
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=app.config["FSFE_CD_POOL_SIZE"],
+        max_retries=Retry(
+            total=3,
+            connect=2,
+            read=1,
+            status=0,
+            other=0,
+            allowed_methods=frozenset({"POST"}),
+        ),
+    )
+    app.cd_session = Session()
+    app.cd_session.mount("http://", adapter)
+    app.cd_session.mount("https://", adapter)
 
 
-def subscribe(config, params):
-    """Subscribe an email address in the FSFE Community Database"""
+def _post(path: str, **kwargs):
+    """Send a POST request to the FSFE Community Database"""
+    return current_app.cd_session.post(
+        url=current_app.config["FSFE_CD_URL"] + path,
+        timeout=(
+            current_app.config["FSFE_CD_CONNECT_TIMEOUT"],
+            current_app.config["FSFE_CD_READ_TIMEOUT"],
+        ),
+        **kwargs,
+    )
+
+
+def subscribe(config, params, today: date | None = None):
+    """Subscribe an email address in the FSFE Community Database
+
+    "<date>" in the configuration is replaced by today, which defaults to the
+    current date.
+    """
 
     subscribe_params = {
         "referrer": "campaign:" + params["appid"],
@@ -28,7 +77,9 @@ def subscribe(config, params):
     # step. Otherwise, they would not be updated on existing registrations in
     # the Community Database.
     for key, value in config.items():
-        value: str = str(date.today()) if value == "<date>" else params.get(value)
+        value: str = (
+            str(today or date.today()) if value == "<date>" else params.get(value)
+        )
 
         if not value:
             continue
@@ -41,11 +92,8 @@ def subscribe(config, params):
 
     # First step: POST registration data to FSFE Community Database.
 
-    response = post(
-        url=current_app.config["FSFE_CD_URL"] + "subscribe-api",
-        timeout=current_app.config["FSFE_CD_TIMEOUT"],
-        data=subscribe_params,
-    )
+    with metrics.timed("cd_subscribe"):
+        response = _post("subscribe-api", data=subscribe_params)
     if not response.ok:
         # In case of an error, fsfe-cd returns a HTML page with a
         # human-readable error description, which we just forward unchanged to
@@ -68,12 +116,8 @@ def subscribe(config, params):
     # parameter is in the form data.
     confirm_params["person"] = person_id
     confirm_params["signature"] = signature
-    response = post(
-        url=current_app.config["FSFE_CD_URL"] + "command/confirm",
-        timeout=current_app.config["FSFE_CD_TIMEOUT"],
-        params=confirm_params,
-        data={"go": "1"},
-    )
+    with metrics.timed("cd_confirm"):
+        response = _post("command/confirm", params=confirm_params, data={"go": "1"})
     if not response.ok:
         # In case of an error, fsfe-cd returns a HTML page with a
         # human-readable error description, which we just forward unchanged to
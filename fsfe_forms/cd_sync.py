@@ -0,0 +1,431 @@
+"""Deferred synchronization with the FSFE Community Database
+
+With FSFE_CD_DELIVERY set to "deferred", redeem() does not call the Community
+Database itself, but appends a job to a queue in Redis and returns right
+away. One or more "fsfe-forms-cd-sync" processes take the jobs from there and
+subscribe the email addresses.
+
+Jobs which fail because the Community Database is unreachable or answers with
+a server error are retried with an exponentially growing delay, and moved to
+a dead-letter list after FSFE_CD_QUEUE_MAX_ATTEMPTS attempts. Jobs which the
+Community Database refuses (client errors) go to the dead-letter list right
+away, as retrying them would not help, and so do jobs which fail with an
+unexpected error.
+
+After FSFE_CD_BREAKER_THRESHOLD failures in a row, a circuit breaker opens,
+and all workers stop calling the Community Database for
+FSFE_CD_BREAKER_COOLDOWN seconds. After that, a single failing job opens the
+breaker again, while a successful one closes it.
+
+As with the mail outbox, a job is kept in a processing list of the worker
+while it is handled, and put back into the queue when a worker of the same
+name starts again.
+
+Registrations stored before the Community Database was configured for an
+application, or while it was unreachable, can be pushed to it afterwards with
+"fsfe-forms cd-sync backfill".
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import signal
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait,
+)
+from datetime import date
+from hashlib import sha256
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from requests import RequestException
+
+from fsfe_forms import json_store
+from fsfe_forms.applications import reload_if_changed
+from fsfe_forms.cd import subscribe
+from fsfe_forms.mailer import RELEASE_SCRIPT
+
+
+QUEUE_KEY = "cd:queue"
+RETRY_KEY = "cd:retry"
+DEAD_KEY = "cd:dead"
+FAILURES_KEY = "cd:breaker:failures"
+OPEN_KEY = "cd:breaker:open"
+
+
+def init_cd_sync(app) -> None:
+    """Initialize the module"""
+    if app.config["FSFE_CD_DELIVERY"] not in ("sync", "deferred"):
+        raise ValueError('FSFE_CD_DELIVERY must be "sync" or "deferred"')
+    app.cd_release_script = app.queue_db.register_script(RELEASE_SCRIPT)
+
+
+def _processing_key(name: str) -> str:
+    return f"cd:processing:{name}"
+
+
+def enqueue(appid: str, params: dict) -> None:
+    """Append a subscription to the queue
+
+    The current date is stored with the job, so "<date>" values refer to the
+    day of the confirmation, not to the day the job is processed.
+    """
+    entry = {
+        "appid": appid,
+        "params": params,
+        "date": date.today().isoformat(),
+        "attempts": 0,
+    }
+    current_app.queue_db.lpush(QUEUE_KEY, json.dumps(entry))
+
+
+# -----------------------------------------------------------------------------
+# Circuit breaker
+# -----------------------------------------------------------------------------
+
+
+def breaker_open() -> bool:
+    """Whether calls to the Community Database are currently suspended"""
+    return bool(current_app.queue_db.exists(OPEN_KEY))
+
+
+def _record_success() -> None:
+    current_app.queue_db.delete(FAILURES_KEY)
+
+
+def _record_failure() -> None:
+    # The failure count is only reset by a success, so after the cooldown a
+    # single failure is enough to open the breaker again
+    failures = current_app.queue_db.incr(FAILURES_KEY)
+    if failures >= current_app.config["FSFE_CD_BREAKER_THRESHOLD"]:
+        cooldown = current_app.config["FSFE_CD_BREAKER_COOLDOWN"]
+        if current_app.queue_db.set(OPEN_KEY, failures, ex=cooldown, nx=True):
+            current_app.logger.error(
+                "Community Database failed %d times in a row, "
+                "suspending calls for %d s",
+                failures,
+                cooldown,
+            )
+
+
+# -----------------------------------------------------------------------------
+# Processing of jobs
+# -----------------------------------------------------------------------------
+
+
+def _release_retries() -> None:
+    """Move jobs whose retry delay has passed back into the queue"""
+    current_app.cd_release_script(keys=[RETRY_KEY, QUEUE_KEY], args=[time.time()])
+
+
+def _sync(entry: bytes) -> None:
+    """Process a single job, scheduling a retry on failure"""
+    data = json.loads(entry)
+    params = data["params"]
+    app_config = current_app.app_configs.get(data["appid"])
+    if app_config is None or not app_config.cd:
+        current_app.logger.error(
+            "Dropping job for %s, which has no cd configuration", data["appid"]
+        )
+        current_app.queue_db.lpush(DEAD_KEY, json.dumps(data))
+        return
+    try:
+        response = subscribe(
+            app_config.cd, params, today=date.fromisoformat(data["date"])
+        )
+    except (RequestException, ValueError) as error:
+        response = str(error), None
+    if response is None:
+        _record_success()
+        current_app.logger.info("Subscribed %s", params["confirm"])
+        return
+
+    text, status = response
+    data["attempts"] += 1
+    if status is not None and status < 500:
+        # The Community Database refused the data, and will do so again
+        _record_success()
+        current_app.logger.error(
+            "Community Database refused %s with status %d: %s",
+            params["confirm"],
+            status,
+            text,
+        )
+        current_app.queue_db.lpush(DEAD_KEY, json.dumps(data))
+        return
+
+    _record_failure()
+    if data["attempts"] >= current_app.config["FSFE_CD_QUEUE_MAX_ATTEMPTS"]:
+        current_app.logger.error("Giving up on %s: %s", params["confirm"], text)
+        current_app.queue_db.lpush(DEAD_KEY, json.dumps(data))
+    else:
+        delay = current_app.config["FSFE_CD_QUEUE_RETRY_DELAY"] * 2 ** (
+            data["attempts"] - 1
+        )
+        current_app.logger.warning(
+            "Subscribing %s failed, retrying in %d s: %s",
+            params["confirm"],
+            delay,
+            text,
+        )
+        current_app.queue_db.zadd(RETRY_KEY, {json.dumps(data): time.time() + delay})
+
+
+def sync_batch(name: str, timeout: int = 0) -> int:
+    """Take a batch of jobs from the queue and process them
+
+    Waits up to timeout seconds for the first job (0 means not to wait), and
+    stops early when the circuit breaker opens. Returns the number of jobs
+    processed.
+    """
+    db = current_app.queue_db
+    processing = _processing_key(name)
+    _release_retries()
+    count = 0
+    while count < current_app.config["FSFE_CD_QUEUE_BATCH"] and not breaker_open():
+        if count == 0 and timeout:
+            entry = db.blmove(QUEUE_KEY, processing, timeout, "RIGHT", "LEFT")
+        else:
+            entry = db.lmove(QUEUE_KEY, processing, "RIGHT", "LEFT")
+        if entry is None:
+            break
+        try:
+            _sync(entry)
+        except Exception:
+            # Retrying would only fail again, and stop the worker each time
+            current_app.logger.exception(
+                "Moving job which failed unexpectedly to %s", DEAD_KEY
+            )
+            db.lpush(DEAD_KEY, entry)
+        db.lrem(processing, 1, entry)
+        count += 1
+    return count
+
+
+def recover(name: str) -> int:
+    """Put jobs left over by a dead worker back into the queue"""
+    count = 0
+    while current_app.queue_db.lmove(_processing_key(name), QUEUE_KEY, "LEFT", "RIGHT"):
+        count += 1
+    return count
+
+
+def run(name: str) -> None:
+    """Keep processing jobs until receiving SIGTERM or SIGINT"""
+    stopping = False
+
+    def stop(signum, frame):  # noqa: ARG001
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    recovered = recover(name)
+    if recovered:
+        current_app.logger.info("Recovered %d jobs", recovered)
+    current_app.logger.info("Community Database sync %s started", name)
+    while not stopping:
+        reload_if_changed()
+        if breaker_open():
+            time.sleep(1)
+        else:
+            sync_batch(name, timeout=1)
+    current_app.logger.info("Community Database sync %s stopped", name)
+
+
+# =============================================================================
+# Backfill of stored registrations
+# =============================================================================
+
+
+def _record_id(record: dict) -> str:
+    """Identifier of a stored record for the checkpoint file"""
+    key = f"{record['timestamp']}:{record['include_vars']['confirm']}"
+    return sha256(key.encode("utf-8")).hexdigest()
+
+
+def _read_checkpoint(checkpoint: str) -> set[str]:
+    try:
+        with open(checkpoint) as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def _pending_records(storage: str, done: set[str]) -> Iterator[dict]:
+    # A snapshot, so rotations and writes during the backfill do not matter
+    for record in json_store.snapshot_log(storage):
+        if record.get("include_vars", {}).get("confirm") and (
+            _record_id(record) not in done
+        ):
+            yield record
+
+
+def backfill(
+    appid: str, checkpoint: str, workers: int = 4, rate: float = 5.0
+) -> tuple[int, int]:
+    """Subscribe all registrations of an application's store
+
+    The store is read record by record and the registrations are sent to the
+    Community Database by up to workers threads, starting at most rate
+    registrations per second. The IDs of successfully synced records are
+    appended to the checkpoint file, and records listed there are skipped, so
+    an interrupted run can be resumed. "<date>" values are taken from the
+    timestamp of each record. Returns the number of synced and failed records.
+    """
+    app = current_app._get_current_object()
+    app_config = app.app_configs[appid]
+    done = _read_checkpoint(checkpoint)
+    checkpoint_lock = threading.Lock()
+    synced = failed = 0
+
+    def sync(record: dict) -> bool:
+        params = record["include_vars"]
+        today = date.fromtimestamp(record["timestamp"])
+        with app.app_context():
+            try:
+                response = subscribe(app_config.cd, params, today=today)
+            except (RequestException, ValueError) as error:
+                response = str(error), None
+            except Exception:
+                # Counted as failed like the others, so the run goes on
+                app.logger.exception("Syncing %s failed", params["confirm"])
+                return False
+            if response is not None:
+                app.logger.warning("Syncing %s failed: %s", params["confirm"], response)
+                return False
+        with checkpoint_lock, open(checkpoint, "a") as f:
+            f.write(_record_id(record) + "\n")
+        return True
+
+    def collect(futures: set, return_when) -> set:
+        nonlocal synced, failed
+        finished, pending = wait(futures, return_when=return_when)
+        for future in finished:
+            if future.result():
+                synced += 1
+            else:
+                failed += 1
+        return pending
+
+    interval = 1 / rate if rate > 0 else 0
+    next_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: set = set()
+        for record in _pending_records(app_config.store, done):
+            # Keep only a limited number of records in memory
+            if len(futures) >= 2 * workers:
+                futures = collect(futures, FIRST_COMPLETED)
+            time.sleep(max(0, next_start - time.monotonic()))
+            next_start = max(next_start, time.monotonic()) + interval
+            futures.add(executor.submit(sync, record))
+        collect(futures, ALL_COMPLETED)
+    return synced, failed
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+cli = AppGroup("cd-sync", help="Deferred synchronization with the Community Database.")
+
+
+@cli.command("run")
+@click.option(
+    "--name",
+    default=socket.gethostname,
+    help="Worker name, unique among all running workers (default: hostname).",
+)
+def run_command(name):
+    """Process jobs from the queue until stopped."""
+    run(name)
+
+
+@cli.command("status")
+def status_command():
+    """Show the number of waiting jobs and the state of the circuit breaker."""
+    db = current_app.queue_db
+    click.echo(f"Queued:   {db.llen(QUEUE_KEY)}")
+    click.echo(f"Retrying: {db.zcard(RETRY_KEY)}")
+    click.echo(f"Dead:     {db.llen(DEAD_KEY)}")
+    if breaker_open():
+        click.echo(f"Breaker:  open for another {db.ttl(OPEN_KEY)} s")
+    else:
+        click.echo(f"Breaker:  closed ({int(db.get(FAILURES_KEY) or 0)} failures)")
+
+
+@cli.command("replay-dead")
+def replay_dead_command():
+    """Move all jobs from the dead-letter list back into the queue."""
+    db = current_app.queue_db
+    count = 0
+    for _ in range(db.llen(DEAD_KEY)):
+        entry = db.rpop(DEAD_KEY)
+        if entry is None:
+            break
+        try:
+            data = json.loads(entry)
+        except ValueError:
+            # Could never be processed, so it stays
+            db.lpush(DEAD_KEY, entry)
+            continue
+        data["attempts"] = 0
+        db.lpush(QUEUE_KEY, json.dumps(data))
+        count += 1
+    click.echo(f"Replayed {count} jobs")
+
+
+@cli.command("reset-breaker")
+def reset_breaker_command():
+    """Close the circuit breaker, resuming calls to the Community Database."""
+    current_app.queue_db.delete(OPEN_KEY, FAILURES_KEY)
+    click.echo("Circuit breaker closed")
+
+
+@cli.command("backfill")
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="File recording the synced records (default: STORE.cd-backfill).",
+)
+@click.option("--workers", default=4, show_default=True, help="Parallel requests.")
+@click.option(
+    "--rate", default=5.0, show_default=True, help="Maximum requests per second."
+)
+@click.argument("appid")
+def backfill_command(appid, checkpoint, workers, rate):
+    """Subscribe all stored registrations of APPID in the Community Database.
+
+    Records synced by a previous run with the same checkpoint file are
+    skipped.
+    """
+    app_config = current_app.app_configs.get(appid)
+    if app_config is None or not app_config.cd or not app_config.store:
+        raise click.ClickException(f"{appid} has no cd configuration and store")
+    if checkpoint is None:
+        checkpoint = app_config.store + ".cd-backfill"
+    synced, failed = backfill(appid, checkpoint, workers, rate)
+    click.echo(f"Synced {synced} records, {failed} failed")
+    if failed:
+        raise click.ClickException("Some records failed, run again to retry them")
+
+
+def main() -> None:
+    """Entry point for the "fsfe-forms-cd-sync" worker process"""
+    from fsfe_forms.app import create_app
+
+    with create_app().app_context():
+        run_command.main(prog_name="fsfe-forms-cd-sync")
@@ -12,6 +12,8 @@ from os import environ
 
 # Parameters for Flask-Limiter
 RATELIMIT_DEFAULT = environ.get("RATELIMIT_DEFAULT")
+RATELIMIT_STORAGE_URI = environ.get("RATELIMIT_STORAGE_URI")  # None = use Redis
+RATELIMIT_STRATEGY = environ.get("RATELIMIT_STRATEGY", "fixed-window")
 
 # Parameters for sending out all kinds of emails
 MAIL_SERVER = environ.get("MAIL_SERVER", "localhost")
@@ -19,6 +21,15 @@ MAIL_HELO_HOST = environ.get("MAIL_HELO_HOST")  # None = let smtplib decide
 MAIL_PORT: int = int(environ.get("MAIL_PORT", "25"))
 MAIL_USERNAME = environ.get("MAIL_USERNAME")
 MAIL_PASSWORD = environ.get("MAIL_PASSWORD")
+MAIL_POOL_SIZE: int = int(environ.get("MAIL_POOL_SIZE", "2"))
+MAIL_POOL_MAX_IDLE: int = int(environ.get("MAIL_POOL_MAX_IDLE", "60"))
+MAIL_POOL_MAX_MESSAGES: int = int(environ.get("MAIL_POOL_MAX_MESSAGES", "100"))
+
+# Parameters for delivering emails through the outbox ("sync" or "outbox")
+MAIL_DELIVERY = environ.get("MAIL_DELIVERY", "sync")
+MAIL_OUTBOX_BATCH: int = int(environ.get("MAIL_OUTBOX_BATCH", "20"))
+MAIL_OUTBOX_MAX_ATTEMPTS: int = int(environ.get("MAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+MAIL_OUTBOX_RETRY_DELAY: int = int(environ.get("MAIL_OUTBOX_RETRY_DELAY", "60"))
 
 # Parameters for forwarding log messages by email
 LOG_EMAIL_FROM = environ.get("LOG_EMAIL_FROM")
@@ -29,14 +40,65 @@ REDIS_HOST = environ.get("REDIS_HOST", "forms-redis")
 REDIS_PORT: int = int(environ.get("REDIS_PORT", "6379"))
 REDIS_PASSWORD = environ.get("REDIS_PASSWORD", None)
 REDIS_QUEUE_DB: int = int(environ.get("REDIS_QUEUE_DB", "0"))
+REDIS_STORE_DB: int = int(environ.get("REDIS_STORE_DB", "1"))
+REDIS_CACHE_DB: int = int(environ.get("REDIS_CACHE_DB", "2"))
+REDIS_RATELIMIT_DB: int = int(environ.get("REDIS_RATELIMIT_DB", "3"))
 
 # Parameters for the connection to the FSFE Community Database
 FSFE_CD_URL = environ.get("FSFE_CD_URL", "http://localhost:8089/")
 FSFE_CD_TIMEOUT: int = int(environ.get("FSFE_CD_TIMEOUT", "3"))
+FSFE_CD_CONNECT_TIMEOUT: float = float(
+    environ.get("FSFE_CD_CONNECT_TIMEOUT", FSFE_CD_TIMEOUT)
+)
+FSFE_CD_READ_TIMEOUT: float = float(
+    environ.get("FSFE_CD_READ_TIMEOUT", FSFE_CD_TIMEOUT)
+)
+FSFE_CD_POOL_SIZE: int = int(environ.get("FSFE_CD_POOL_SIZE", "4"))
 FSFE_CD_PASSPHRASE = environ.get("FSFE_CD_PASSPHRASE", "cmd_passphrase")
+FSFE_CD_DELIVERY = environ.get("FSFE_CD_DELIVERY", "sync")
+FSFE_CD_QUEUE_BATCH: int = int(environ.get("FSFE_CD_QUEUE_BATCH", "20"))
+FSFE_CD_QUEUE_MAX_ATTEMPTS: int = int(environ.get("FSFE_CD_QUEUE_MAX_ATTEMPTS", "10"))
+FSFE_CD_QUEUE_RETRY_DELAY: int = int(environ.get("FSFE_CD_QUEUE_RETRY_DELAY", "60"))
+FSFE_CD_BREAKER_THRESHOLD: int = int(environ.get("FSFE_CD_BREAKER_THRESHOLD", "5"))
+FSFE_CD_BREAKER_COOLDOWN: int = int(environ.get("FSFE_CD_BREAKER_COOLDOWN", "300"))
+
+# Configuration of the applications, None = applications.json in the package,
+# and the interval in seconds for checking it for changes (0 = never)
+APP_CONFIG_FILE = environ.get("APP_CONFIG_FILE")
+APP_CONFIG_RELOAD_INTERVAL: float = float(
+    environ.get("APP_CONFIG_RELOAD_INTERVAL", "5")
+)
+
+# Profiling of requests: the fraction of requests to profile, the duration in
+# seconds above which requests are profiled (0 = none), where to keep the
+# profiles, and how many
+PROFILE_SAMPLE_RATE: float = float(environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_THRESHOLD: float = float(environ.get("PROFILE_SLOW_THRESHOLD", "0"))
+PROFILE_DIR = environ.get("PROFILE_DIR", "/tmp/forms-profiles")
+PROFILE_KEEP: int = int(environ.get("PROFILE_KEEP", "100"))
+
+# Seconds for which each worker caches the answers of /stats/<appid>
+STATS_CACHE_TTL: int = int(environ.get("STATS_CACHE_TTL", "60"))
 
-# Filename for a temporary lockfile
-LOCK_FILENAME = environ.get("LOCK_FILENAME", "/tmp/forms.lock")
+# Token required for exporting stores at /export/<appid>, None = no exports
+EXPORT_TOKEN = environ.get("EXPORT_TOKEN")
+
+# Rotation of JSON Lines stores into compressed segments: the size in bytes
+# and the age in seconds of the oldest record at which the active segment is
+# closed (0 = never)
+STORE_SEGMENT_MAX_BYTES: int = int(environ.get("STORE_SEGMENT_MAX_BYTES", "0"))
+STORE_SEGMENT_MAX_AGE: float = float(environ.get("STORE_SEGMENT_MAX_AGE", "0"))
+
+# Group commit of concurrent writes to a store: the maximum number of records
+# written together (1 = no group commit), and the maximum number of seconds to
+# wait for more
+STORE_GROUP_COMMIT_BATCH: int = int(environ.get("STORE_GROUP_COMMIT_BATCH", "1"))
+STORE_GROUP_COMMIT_WINDOW: float = float(
+    environ.get("STORE_GROUP_COMMIT_WINDOW", "0.002")
+)
+
+# Directory for the lockfiles of the JSON stores
+LOCK_DIR = environ.get("LOCK_DIR", "/tmp")
 
 # Expiration time for double opt-in confirmation
 # (None means no expiration)
@@ -45,3 +107,14 @@ CONFIRMATION_EXPIRATION_SECS: int = 86400
 # Parameters for email address validation
 VALIDATE_EMAIL_HELO = environ.get("VALIDATE_EMAIL_HELO", "localhost")
 VALIDATE_EMAIL_FROM = environ.get("VALIDATE_EMAIL_FROM")
+EMAIL_VERIFY_DEADLINE: float = float(environ.get("EMAIL_VERIFY_DEADLINE", "5"))
+EMAIL_VERIFY_WORKERS: int = int(environ.get("EMAIL_VERIFY_WORKERS", "8"))
+EMAIL_VERIFY_PARALLEL_PROBES: int = int(
+    environ.get("EMAIL_VERIFY_PARALLEL_PROBES", "3")
+)
+
+# Parameters for caching email address validation results
+EMAIL_CACHE_POSITIVE_TTL: int = int(environ.get("EMAIL_CACHE_POSITIVE_TTL", "604800"))
+EMAIL_CACHE_NEGATIVE_TTL: int = int(environ.get("EMAIL_CACHE_NEGATIVE_TTL", "3600"))
+EMAIL_CACHE_LOCAL_TTL: int = int(environ.get("EMAIL_CACHE_LOCAL_TTL", "300"))
+EMAIL_CACHE_LOCAL_SIZE: int = int(environ.get("EMAIL_CACHE_LOCAL_SIZE", "1000"))
@@ -9,22 +9,134 @@
 
 import email
 import email.charset
+import email.headerregistry
+import email.message
 import email.policy
 import email.utils
+import re
 import smtplib
+import threading
+import time
 from contextlib import suppress
+from functools import cache
+from itertools import groupby
 
-from flask import current_app, render_template
+from flask import current_app
+from jinja2 import Environment, Template
+
+from fsfe_forms import mailer, metrics
+
+
+class SMTPPool:
+    """Pool of reusable connections to the mail server
+
+    Every worker process has its own pool. Idle connections are checked with a
+    NOOP command before being reused, and closed when they have been idle for
+    too long or have been used for too many messages.
+    """
+
+    def __init__(self, config) -> None:
+        self.config = config
+        self.idle: list[tuple[smtplib.SMTP, float, int]] = []
+        self.lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(
+            host=self.config["MAIL_SERVER"],
+            port=self.config["MAIL_PORT"],
+            local_hostname=self.config["MAIL_HELO_HOST"],
+        )
+        if self.config["MAIL_USERNAME"]:
+            smtp.login(
+                user=self.config["MAIL_USERNAME"],
+                password=self.config["MAIL_PASSWORD"],
+            )
+        return smtp
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP) -> None:
+        with suppress(smtplib.SMTPException, OSError):
+            smtp.quit()
+        smtp.close()
+
+    def _checkout(self) -> tuple[smtplib.SMTP, int]:
+        """Get a healthy idle connection, or open a new one"""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                smtp, last_used, sent = self.idle.pop()
+            if time.monotonic() - last_used > self.config["MAIL_POOL_MAX_IDLE"]:
+                self._close(smtp)
+                continue
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp, sent
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(smtp)
+        return self._connect(), 0
+
+    def _checkin(self, smtp: smtplib.SMTP, sent: int) -> None:
+        """Return a connection to the pool, or close it if it is used up"""
+        with self.lock:
+            if (
+                sent < self.config["MAIL_POOL_MAX_MESSAGES"]
+                and len(self.idle) < self.config["MAIL_POOL_SIZE"]
+            ):
+                self.idle.append((smtp, time.monotonic(), sent))
+                return
+        self._close(smtp)
+
+    def send(self, message) -> None:
+        """Send a message over a pooled connection
+
+        If the connection breaks down, the message is sent once more over a
+        fresh connection. Connections on which sending fails are closed
+        rather than returned to the pool.
+        """
+        with metrics.timed("smtp_connect"):
+            smtp, sent = self._checkout()
+        try:
+            try:
+                self._send(smtp, message)
+            except OSError as error:
+                # Errors reported by the mail server would only happen again
+                if isinstance(error, smtplib.SMTPException) and not isinstance(
+                    error, smtplib.SMTPServerDisconnected
+                ):
+                    raise
+                self._close(smtp)
+                with metrics.timed("smtp_connect"):
+                    smtp, sent = self._connect(), 0
+                self._send(smtp, message)
+        except BaseException:
+            self._close(smtp)
+            raise
+        self._checkin(smtp, sent + 1)
+
+    @staticmethod
+    def _send(smtp: smtplib.SMTP, message) -> None:
+        with metrics.timed("smtp_send"), suppress(smtplib.SMTPRecipientsRefused):
+            smtp.send_message(message)
 
 
 def init_email(app) -> None:
     """Initialize the module"""
 
+    # Set up the pool of connections to the mail server
+    app.smtp_pool = SMTPPool(app.config)
+
+    # Cache of prepared templates, by template name and language
+    app.email_skeletons = {}
+
     # Change default transfer-encoding for utf-8 to 'quoted-printable'
     email.charset.add_charset("utf-8", email.charset.QP, email.charset.QP)
 
     # Set up a policy for rendering templates into an email message
-    email.policy.render = email.policy.default.clone(refold_source="all")
+    email.policy.render = email.policy.default.clone(
+        refold_source="all", header_factory=_HeaderRegistry()
+    )
 
     # Make 'format_email' function available to templates
     @app.context_processor
@@ -35,42 +147,151 @@ def init_email(app) -> None:
         return {"format_email": format_email}
 
 
+class _HeaderRegistry(email.headerregistry.HeaderRegistry):
+    """Header registry which creates each header class only once
+
+    The standard registry creates a new class for every single header.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.classes: dict[str, type] = {}
+
+    def __getitem__(self, name):
+        key = name.lower()
+        if key not in self.classes:
+            self.classes[key] = super().__getitem__(name)
+        return self.classes[key]
+
+
+@cache
+def _header(name: str, value: str) -> email.headerregistry.BaseHeader:
+    """Parse a constant header once, so it can be added to many messages"""
+    return email.policy.render.header_factory(name, value)
+
+
+# Markers of Jinja2 template syntax
+_SYNTAX = ("{{", "{%", "{#")
+
+
+def _compile_header(env: Environment, name: str, value: str):
+    """Compile a header value, or parse it if it contains no template syntax"""
+    if any(marker in value for marker in _SYNTAX):
+        return env.from_string(value)
+    return _header(name, value)
+
+
+class EmailSkeleton:
+    """Email template, prepared for quickly rendering many messages
+
+    The template is split into its headers and its body once. Header values
+    and body lines without template syntax are kept as they are, and the
+    static body lines are encoded to quoted-printable right away, so for each
+    message only the parts containing variables need to be rendered and
+    encoded. The result is the same as rendering the whole template, parsing
+    it as a message, and setting its charset to UTF-8.
+    """
+
+    def __init__(self, env: Environment, source: str) -> None:
+        # Created here, so it picks up the encoding set up by init_email()
+        self.charset = email.charset.Charset("utf-8")
+
+        head, _, body = source.partition("\n\n")
+        # Continuation lines belong to the header before them
+        self.headers: list[tuple[str, Template | email.headerregistry.BaseHeader]]
+        self.headers = []
+        for line in re.split(r"\n(?=[^ \t])", head):
+            name, _, value = line.partition(":")
+            name = name.strip()
+            self.headers.append((name, _compile_header(env, name, value.strip())))
+
+        # Each part of the body is either encoded text, or a template and the
+        # newline Jinja2 removes from its end, which has to be added back
+        self.body: list[str | tuple[Template, str]] = []
+        if "{%" in body or "{#" in body:
+            # Blocks and comments may span lines, so keep the body in one piece
+            self.body.append((env.from_string(body), ""))
+            return
+        # Like a Jinja2 template, the body as a whole loses a trailing newline
+        lines = body.removesuffix("\n").splitlines(keepends=True)
+        for static, group in groupby(lines, key=lambda line: "{{" not in line):
+            text = "".join(group)
+            if static:
+                self.body.append(self.charset.body_encode(text))
+            else:
+                newline = "\n" if text.endswith("\n") else ""
+                self.body.append((env.from_string(text), newline))
+
+    def render(self, context: dict) -> email.message.EmailMessage:
+        """Create a message from the template with the given variables"""
+        message = email.message.EmailMessage(policy=email.policy.render)
+        for name, value in self.headers:
+            if isinstance(value, Template):
+                value = value.render(context)
+            message[name] = value
+        parts = []
+        for part in self.body:
+            if isinstance(part, str):
+                parts.append(part)
+            else:
+                template, newline = part
+                text = template.render(context) + newline
+                parts.append(self.charset.body_encode(text))
+        message.set_payload("".join(parts))
+        return message
+
+
+def _skeleton(template: str, lang: str | None) -> EmailSkeleton:
+    """Look up the prepared template, preparing it on first use"""
+    key = (template, lang)
+    skeleton = current_app.email_skeletons.get(key)
+    if skeleton is None:
+        # Same order as render_template() would try the names in
+        names = [f"{template}.eml"] + ([f"{template}.{lang}.eml"] if lang else [])
+        # Unlike templates from files, templates from strings are autoescaped
+        # by Flask, which is not wanted for emails
+        env = current_app.jinja_env.overlay(autoescape=False)
+        source, _, _ = env.loader.get_source(env, env.select_template(names).name)
+        skeleton = EmailSkeleton(env, source)
+        # Templates may be edited while debugging
+        if not current_app.debug:
+            current_app.email_skeletons[key] = skeleton
+    return skeleton
+
+
 def send_email(template: str, lang: str | None = None, **kwargs):
     """Send out an email"""
 
-    # Compile list of template filenames to look for
-    templates: list = [f"{template}.eml"] + ([f"{template}.{lang}.eml"] if lang else [])
-
     # Prepare message from template
-    message = email.message_from_string(
-        render_template(templates, **kwargs), policy=email.policy.render
-    )
+    with metrics.timed("email_render"):
+        context = dict(kwargs)
+        current_app.update_template_context(context)
+        message = _skeleton(template, lang).render(context)
 
     # Add some standard headers
     if "From" in message:
-        message["Sender"] = "FSFE form server <contact@fsfe.org>"
+        message["Sender"] = _header("Sender", "FSFE form server <contact@fsfe.org>")
     else:
-        message["From"] = "Free Software Foundation Europe <contact@fsfe.org>"
+        message["From"] = _header(
+            "From", "Free Software Foundation Europe <contact@fsfe.org>"
+        )
     message["Date"] = email.utils.localtime()
     message["Message-ID"] = email.utils.make_msgid(
         domain=current_app.config["MAIL_HELO_HOST"]
     )
 
-    # Tell the library which character set to use on serialization
-    message.set_charset("utf-8")
+    # The body is encoded already, so just declare the character set and
+    # encoding, in the same way message.set_charset("utf-8") would
+    message["MIME-Version"] = _header("MIME-Version", "1.0")
+    message["Content-Type"] = _header("Content-Type", 'text/plain; charset="utf-8"')
+    message["Content-Transfer-Encoding"] = _header(
+        "Content-Transfer-Encoding", "quoted-printable"
+    )
 
-    # Send out the message
-    with smtplib.SMTP(
-        host=current_app.config["MAIL_SERVER"],
-        port=current_app.config["MAIL_PORT"],
-        local_hostname=current_app.config["MAIL_HELO_HOST"],
-    ) as smtp:
-        if current_app.config["MAIL_USERNAME"]:
-            smtp.login(
-                user=current_app.config["MAIL_USERNAME"],
-                password=current_app.config["MAIL_PASSWORD"],
-            )
-        with suppress(smtplib.SMTPRecipientsRefused):
-            smtp.send_message(message)
+    # Send out the message, or leave that to the mailer worker
+    if current_app.config["MAIL_DELIVERY"] == "outbox":
+        mailer.enqueue(message)
+    else:
+        current_app.smtp_pool.send(message)
 
     return message
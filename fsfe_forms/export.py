@@ -0,0 +1,248 @@
+"""Export of stored registrations as CSV or NDJSON
+
+Records are read from the store, filtered, and written out one by one, so
+exporting takes constant memory however large the store is. Writes to the
+store can go on during an export of a JSON Lines store; records written in
+the meantime are not part of the export.
+
+Records can be filtered by the time they were stored, by the values of
+parameters, and by boolean parameters like permissionPub being true. Only
+the chosen parameters (columns) are exported, along with the time the
+record was stored.
+
+Exports are available with "fsfe-forms export", and at /export/<appid> for
+requests with the token set in EXPORT_TOKEN.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import csv
+import hmac
+import io
+import json
+from collections.abc import Iterable, Iterator
+from datetime import UTC, datetime
+
+import click
+from flask import Response, abort, current_app, request, stream_with_context
+from flask.cli import with_appcontext
+from marshmallow.fields import DateTime, List, String
+from marshmallow.validate import OneOf
+from webargs.flaskparser import parser
+
+from fsfe_forms import json_store
+from fsfe_forms.applications import AppConfig
+from fsfe_forms.stats import is_true
+
+
+FORMATS = ("csv", "ndjson")
+
+# Spreadsheets run cell values starting with these characters as formulas
+_FORMULA_START = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _timestamp(moment: datetime | None) -> float | None:
+    """Convert a time to a timestamp, taking naive times as UTC"""
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    return moment.timestamp()
+
+
+def default_columns(app_config: AppConfig) -> list[str]:
+    """The parameters of an application, including the email address"""
+    columns = list(app_config.parameters)
+    if app_config.confirm and "confirm" not in columns:
+        columns.insert(0, "confirm")
+    return columns
+
+
+def export_rows(
+    storage: str,
+    columns: list[str] | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    fields: dict[str, str] | None = None,
+    flags: Iterable[str] = (),
+) -> Iterator[dict]:
+    """Iterate over the matching records of a store, as rows to export
+
+    Records are included if they were stored at or after since and before
+    until, have the given values in fields, and are true in all flags. Each
+    row contains the time the record was stored, and either the given
+    columns or all parameters.
+    """
+    start, end = _timestamp(since), _timestamp(until)
+    fields = fields or {}
+    for record in json_store.snapshot_log(storage):
+        timestamp = record.get("timestamp", 0)
+        if (start is not None and timestamp < start) or (
+            end is not None and timestamp >= end
+        ):
+            continue
+        include_vars = record.get("include_vars") or {}
+        if any(include_vars.get(name) != value for name, value in fields.items()):
+            continue
+        if not all(is_true(include_vars.get(flag)) for flag in flags):
+            continue
+        row = {"timestamp": datetime.fromtimestamp(timestamp, UTC).isoformat()}
+        if columns is None:
+            row.update(include_vars)
+        else:
+            row.update((column, include_vars.get(column)) for column in columns)
+        yield row
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    value = str(value)
+    if value.startswith(_FORMULA_START):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows: Iterable[dict], columns: list[str]) -> Iterator[str]:
+    """Format rows as CSV, one line at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values) -> str:
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(["timestamp", *columns])
+    for row in rows:
+        yield line([row["timestamp"], *(_cell(row.get(c)) for c in columns)])
+
+
+def ndjson_lines(rows: Iterable[dict]) -> Iterator[str]:
+    """Format rows as newline delimited JSON, one line at a time"""
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def export_lines(
+    app_config: AppConfig, output_format: str, columns: list[str] | None, **filters
+) -> Iterator[str]:
+    """Export the store of an application in the given format"""
+    if output_format == "csv":
+        columns = columns or default_columns(app_config)
+        return csv_lines(export_rows(app_config.store, columns, **filters), columns)
+    return ndjson_lines(export_rows(app_config.store, columns, **filters))
+
+
+# =============================================================================
+# Export endpoint
+# =============================================================================
+
+export_parameters = {
+    "format": String(validate=OneOf(FORMATS), load_default="csv"),
+    "since": DateTime(load_default=None),
+    "until": DateTime(load_default=None),
+    "field": List(String(), load_default=list),
+    "flag": List(String(), load_default=list),
+    "column": List(String(), load_default=list),
+}
+
+
+def _authorize() -> None:
+    token = current_app.config["EXPORT_TOKEN"]
+    if not token:
+        abort(404)
+    auth = request.authorization
+    if (
+        auth is None
+        or auth.type != "bearer"
+        or not hmac.compare_digest((auth.token or "").encode(), token.encode())
+    ):
+        abort(401)
+
+
+def _parse_fields(fields: Iterable[str]) -> dict[str, str]:
+    """Split NAME=VALUE filters"""
+    parsed = {}
+    for field in fields:
+        name, sep, value = field.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid field filter {field}, must be NAME=VALUE")
+        parsed[name] = value
+    return parsed
+
+
+def export(appid):
+    """Export endpoint, streaming the store of an application"""
+    _authorize()
+    kwargs = parser.parse(export_parameters, location="query")
+    app_config = current_app.app_configs.get(appid)
+    if app_config is None or not app_config.store:
+        abort(404, f'No store for "{appid}"')
+    try:
+        fields = _parse_fields(kwargs["field"])
+    except ValueError as error:
+        abort(422, str(error))
+    output_format = kwargs["format"]
+    lines = export_lines(
+        app_config,
+        output_format,
+        kwargs["column"] or None,
+        since=kwargs["since"],
+        until=kwargs["until"],
+        fields=fields,
+        flags=kwargs["flag"],
+    )
+    return Response(
+        stream_with_context(lines),
+        mimetype="text/csv" if output_format == "csv" else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{appid}.{output_format}"'
+        },
+    )
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+
+@click.command("export")
+@click.argument("appid")
+@click.option("--format", "output_format", type=click.Choice(FORMATS), default="csv")
+@click.option("--since", type=click.DateTime(), help="Stored at or after (UTC).")
+@click.option("--until", type=click.DateTime(), help="Stored before (UTC).")
+@click.option(
+    "--field", multiple=True, help="Only records with NAME=VALUE (repeatable)."
+)
+@click.option(
+    "--flag", multiple=True, help="Only records where NAME is true (repeatable)."
+)
+@click.option("--columns", help="Comma separated parameters to export (default: all).")
+@click.option("--output", type=click.File("w"), default="-", help="Output file.")
+@with_appcontext
+def export_command(appid, output_format, since, until, field, flag, columns, output):
+    """Export the stored registrations of APPID."""
+    app_config = current_app.app_configs.get(appid)
+    if app_config is None or not app_config.store:
+        raise click.ClickException(f"No store for {appid}")
+    try:
+        fields = _parse_fields(field)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--field") from error
+    for line in export_lines(
+        app_config,
+        output_format,
+        columns.split(",") if columns else None,
+        since=since,
+        until=until,
+        fields=fields,
+        flags=flag,
+    ):
+        output.write(line)
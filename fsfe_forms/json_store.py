@@ -1,4 +1,30 @@
-"""Storage of (confirmed) request data in a JSON file"""
+"""Storage of (confirmed) request data in a JSON file
+
+A store is either a JSON Lines file (filename ending in ".jsonl") with one
+record per line, to which each write appends a single line, or a legacy JSON
+file containing an array of all records, which has to be rewritten completely
+on each write. Legacy stores can be converted with "fsfe-forms store migrate".
+JSON Lines stores can be split into compressed segments, see segments.py.
+
+Writes are crash safe: legacy stores are written to a temporary file which
+then replaces the store, and appends to JSON Lines stores which fail are
+undone. If a worker dies in the middle of an append, recover() removes the
+incomplete record at the end of the store, which only needs to read the end
+of the file. This happens when the workers start and before each append.
+
+With STORE_GROUP_COMMIT_BATCH above 1, concurrent writes to the same store
+are gathered and written with a single fsync, see _group_commit(). Each call
+of log() still only returns once its record is on disk.
+
+For each store, an index of the (hashed) email addresses in the "confirm"
+field is kept in Redis, so duplicate registrations can be detected without
+reading the store. The index is updated on each write and rebuilt from the
+store whenever it is missing.
+
+Each store has its own lock, which is held exclusively by writers and shared
+by readers. The time spent waiting for and holding the locks is recorded per
+store in the metrics, see metrics.observe_lock().
+"""
 
 # This file is part of the FSFE Form Server.
 #
@@ -7,12 +33,26 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import io
 import json
 import os
+import threading
 import time
+import uuid
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import ExitStack, contextmanager, suppress
+from hashlib import sha256
 
-from filelock import FileLock
+import click
+from filelock import ReadWriteLock, Timeout
 from flask import current_app
+from flask.cli import AppGroup
+
+from fsfe_forms import metrics, segments, stats
+
+
+class GroupCommitError(Exception):
+    """The batch containing a record could not be written by its leader"""
 
 
 def log(storage, send_from, send_to, subject, content, reply_to, include_vars) -> None:
@@ -29,23 +69,751 @@ def log(storage, send_from, send_to, subject, content, reply_to, include_vars) -
     if not os.path.exists(os.path.dirname(storage)):
         os.makedirs(os.path.dirname(storage))
 
-    with FileLock(current_app.config["LOCK_FILENAME"]):
-        logs = _read_log(storage) + [add]
-        with open(storage, "w") as f:
-            f.write(json.dumps(logs))
+    with metrics.timed("store_log"):
+        if current_app.config["STORE_GROUP_COMMIT_BATCH"] > 1:
+            rotated = _group_commit(storage, add)
+        else:
+            with lock_store(storage, exclusive=True):
+                rotated = _write(storage, [add])
+                _update_index(storage, [add])
+
+    # Compress the closed segment without keeping this request waiting
+    if rotated:
+        threading.Thread(
+            target=_compress_in_background,
+            args=(current_app._get_current_object(), storage),
+            daemon=True,
+        ).start()
+
+
+def init_json_store(app) -> None:
+    """Initialize the module
+
+    Repairs the stores of all applications left incomplete by a crash.
+    """
+    with app.app_context():
+        for storage in _configured_stores(()):
+            # The active segment may be missing after a rotation
+            if not os.path.isdir(os.path.dirname(storage)):
+                continue
+            try:
+                with lock_store(storage, exclusive=True):
+                    recover(storage)
+            except (OSError, ValueError):
+                app.logger.exception("Recovery of %s failed", storage)
 
 
 def find(storage: str, email: str) -> bool:
-    with FileLock(current_app.config["LOCK_FILENAME"]):
-        for entry in _read_log(storage):
-            if entry.get("include_vars", {}).get("confirm") == email:
-                return True
+    """Check whether an email address is contained in a store"""
+    key = _index_key(storage)
+    with metrics.timed("store_find"):
+        if not current_app.store_db.sismember(key, _INDEX_SENTINEL):
+            current_app.logger.info("Building missing index for %s", storage)
+            with lock_store(storage):
+                build_index(storage)
+        return bool(current_app.store_db.sismember(key, _hash_email(email)))
+
+
+def read_log(storage) -> Iterator[dict]:
+    """Iterate over all records of a store
+
+    Records are read one by one, so memory usage does not depend on the size
+    of the store. The caller must hold (at least) a shared lock on the store,
+    otherwise snapshot_log() is the one to use.
+    """
+    if _is_jsonl(storage):
+        for path in segments.segment_files(storage):
+            with segments.open_segment(path) as f:
+                yield from _read_lines(f)
+    if not os.path.exists(storage):
+        return
+    with open(storage, "rb") as f:
+        if _is_jsonl(storage):
+            yield from _read_lines(f)
+        else:
+            yield from _read_array(io.TextIOWrapper(f))
+
+
+def snapshot_log(
+    storage, when_taken: Callable[[], object] | None = None
+) -> Iterator[dict]:
+    """Iterate over the records of a store without blocking writes for long
+
+    For JSON Lines stores, only the records already complete when the
+    iteration starts are read, which only needs the lock for a moment, so
+    writes can go on while a large store is being read. Legacy stores are
+    rewritten in place, so they stay locked until the iteration ends.
+    when_taken is called while the lock is held, so it sees the state of
+    the index and statistics matching the records read.
+    """
+    if not _is_jsonl(storage):
+        with lock_store(storage):
+            if when_taken:
+                when_taken()
+            yield from read_log(storage)
+        return
+    with ExitStack() as stack:
+        with lock_store(storage):
+            if when_taken:
+                when_taken()
+            closed = segments.segment_files(storage)
+            # Opened under the lock, so a rotation in the meantime does not
+            # matter
+            active = (
+                stack.enter_context(open(storage, "rb"))
+                if os.path.exists(storage)
+                else None
+            )
+            end = os.fstat(active.fileno()).st_size if active else 0
+        for path in closed:
+            with segments.open_segment(path) as f:
+                yield from _read_lines(f)
+        offset = 0
+        for line in active or ():
+            offset += len(line)
+            if offset > end:
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def recover(storage) -> int:
+    """Remove an incomplete record from the end of a store
+
+    Only the end of the store is read, so this takes the same time however
+    large the store is. The removed bytes are kept in a file next to the
+    store, <store>.<time>.torn. Legacy stores are replaced as a whole on each
+    write, so they cannot end in an incomplete record; ValueError is raised
+    if one does anyway, since it cannot be repaired without reading it all.
+    Closed segments missing from the manifest of a JSON Lines store, after a
+    crash during rotation, are added back. Returns the number of bytes
+    removed. The caller must hold the exclusive lock on the store.
+    """
+    if _is_jsonl(storage):
+        for name in segments.adopt(storage):
+            current_app.logger.warning("Added segment %s to the manifest", name)
+    if not os.path.exists(storage):
+        return 0
+    with open(storage, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if not _is_jsonl(storage):
+            f.seek(max(0, size - 64))
+            if size and not f.read().rstrip().endswith(b"]"):
+                raise ValueError(f"{storage} does not end with a complete array")
+            return 0
+        end = _intact_end(f, size)
+        if end == size:
+            return 0
+        f.seek(end)
+        torn = f"{storage}.{time.time_ns()}.torn"
+        with open(torn, "wb") as fragment:
+            fragment.write(f.read())
+            fragment.flush()
+            os.fsync(fragment.fileno())
+        f.truncate(end)
+        f.flush()
+        os.fsync(f.fileno())
+    current_app.logger.warning(
+        "Removed incomplete record of %d bytes from %s, kept in %s",
+        size - end,
+        storage,
+        torn,
+    )
+    return size - end
+
+
+def migrate(source: str, destination: str) -> int:
+    """Convert a legacy JSON array store into a JSON Lines store
+
+    The destination is written to a temporary file first and only renamed to
+    its final name after it has been completely written to disk. Returns the
+    number of records converted.
+    """
+    count = 0
+    temp = destination + ".tmp"
+    with lock_store(source), open(temp, "w") as f:
+        for record in read_log(source):
+            f.write(_serialize(record))
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, destination)
+    return count
+
+
+def build_index(storage) -> int:
+    """(Re)build the email address index of a store from its content
+
+    The new index is assembled under a temporary key and then atomically
+    replaces the old one, so concurrent lookups never see a partial index.
+    The caller must hold (at least) a shared lock on the store, so no writes
+    happen in the meantime. Returns the number of entries.
+    """
+    key = _index_key(storage)
+    temp = f"{key}:building:{uuid.uuid4().hex}"
+    db = current_app.store_db
+    db.delete(temp)
+    db.sadd(temp, _INDEX_SENTINEL)
+    hashes = _index_entries(storage)
+    for chunk in _chunked(sorted(hashes), 1000):
+        db.sadd(temp, *chunk)
+    db.rename(temp, key)
+    return len(hashes)
+
+
+def verify_index(storage) -> tuple[set[str], set[str]]:
+    """Compare the email address index of a store with its content
+
+    Returns the hashes missing from the index and the hashes in the index
+    which do not belong to any record of the store.
+    """
+    with lock_store(storage):
+        expected = _index_entries(storage)
+        actual = {
+            member.decode()
+            for member in current_app.store_db.sscan_iter(_index_key(storage))
+        }
+    actual.discard(_INDEX_SENTINEL)
+    return expected - actual, actual - expected
+
+
+@contextmanager
+def lock_store(
+    storage, exclusive: bool = False, blocking: bool = True
+) -> Iterator[None]:
+    """Lock a store, either shared for reading or exclusively for writing
+
+    If not blocking, filelock.Timeout is raised if the lock is held by others.
+    The times spent waiting for and holding the lock are recorded once it is
+    released, also if the code holding it failed, but not if the lock was
+    not acquired.
+    """
+    lock_file = _shared_path(storage, ".lock")
+    # A separate instance per acquisition, because the shared instances of
+    # filelock refuse write locks from more than one thread
+    rwlock = ReadWriteLock(lock_file, is_singleton=False)
+    start = time.monotonic()
+    try:
+        with (
+            rwlock.write_lock(blocking=blocking)
+            if exclusive
+            else rwlock.read_lock(blocking=blocking)
+        ):
+            acquired = time.monotonic()
+            try:
+                yield
+            finally:
+                hold = time.monotonic() - acquired
+                _record_lock_stats(storage, acquired - start, hold)
+    finally:
+        rwlock.close()
+
+
+def _shared_path(storage, suffix: str) -> str:
+    """A file belonging to a store in the directory shared by all workers"""
+    return os.path.join(
+        current_app.config["LOCK_DIR"],
+        "forms-" + storage.strip("/").replace("/", "_") + suffix,
+    )
+
+
+def _record_lock_stats(storage, wait: float, hold: float) -> None:
+    metrics.observe_lock(storage, wait, hold)
+    current_app.logger.debug(
+        "Lock on %s: waited %.3f s, held %.3f s", storage, wait, hold
+    )
+
+
+# Marker member of an index set, signalling that the index has been built
+_INDEX_SENTINEL = "built"
+
+
+def _index_key(storage) -> str:
+    return f"index:{storage}"
+
+
+def _hash_email(email: str) -> str:
+    """Normalize and hash an email address for storage in the index"""
+    return sha256(email.strip().lower().encode("utf-8")).hexdigest()
+
+
+def _index_entries(storage) -> set[str]:
+    return {
+        _hash_email(record["include_vars"]["confirm"])
+        for record in read_log(storage)
+        if record.get("include_vars", {}).get("confirm")
+    }
+
+
+def _chunked(items: list, size: int) -> Iterable[list]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _is_jsonl(storage) -> bool:
+    return storage.endswith(".jsonl")
+
+
+def _serialize(record: dict) -> str:
+    return json.dumps(record) + "\n"
+
+
+def _read_lines(f) -> Iterator[dict]:
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _intact_end(f, size: int, chunk_size: int = 65536) -> int:
+    """The size of a JSON Lines file without incomplete records at its end
+
+    Lines are checked from the end until one is a complete record, reading
+    more of the file only while the lines do not fit into what was read.
+    """
+    window = chunk_size
+    while True:
+        start = max(0, size - window)
+        f.seek(start)
+        data = f.read(size - start)
+        end = len(data)
+        while (newline := data.rfind(b"\n", 0, end)) != -1:
+            line_start = data.rfind(b"\n", 0, newline) + 1
+            if line_start == 0 and start > 0:
+                break  # The line starts before what was read
+            line = data[line_start:newline]
+            if not line.strip() or _is_record(line):
+                return start + newline + 1
+            end = newline
+        else:
+            if start == 0:
+                return 0
+        window *= 2
+
+
+def _is_record(line: bytes) -> bool:
+    try:
+        return isinstance(json.loads(line), dict)
+    except ValueError:
         return False
 
 
-def _read_log(storage) -> list:
-    rval: list = []
-    if os.path.exists(storage):
-        with open(storage) as f:
-            rval = json.loads(f.read())
-    return rval
+def _torn(storage) -> bool:
+    """Whether a JSON Lines store does not end with a complete line"""
+    try:
+        size = os.path.getsize(storage)
+    except FileNotFoundError:
+        return False
+    if not size:
+        return False
+    with open(storage, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) != b"\n"
+
+
+def _read_array(f, chunk_size: int = 65536) -> Iterator[dict]:
+    """Decode the elements of a JSON array one by one from a file"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # What comes next: "[", a value or "]", a value, or "," or "]"
+    expected = "start"
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            buffer = f.read(chunk_size)
+            if buffer:
+                continue
+            if expected == "start":
+                return  # An empty file contains no records
+            raise ValueError("Unexpected end of JSON array")
+        if expected == "start":
+            if buffer[0] != "[":
+                raise ValueError("Store does not contain a JSON array")
+            buffer = buffer[1:]
+            expected = "value or end"
+        elif buffer[0] == "]" and expected != "value":
+            return
+        elif expected == "separator":
+            if buffer[0] != ",":
+                raise ValueError("Expected ',' between records")
+            buffer = buffer[1:]
+            expected = "value"
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # The value may continue beyond the buffer
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer += chunk
+                continue
+            yield value
+            buffer = buffer[end:]
+            expected = "separator"
+
+
+def _write(storage, records: list[dict]) -> bool:
+    """Add records to a store, returning whether a segment was closed
+
+    The caller must hold the exclusive lock on the store.
+    """
+    if not _is_jsonl(storage):
+        _replace(storage, json.dumps([*read_log(storage), *records]))
+        return False
+    if _torn(storage):
+        recover(storage)
+    rotated = _rotate_if_due(storage)
+    _append(storage, records)
+    return rotated
+
+
+def _update_index(storage, records: list[dict], written: list[dict] = ()) -> None:
+    """Add records to the index and statistics in a single round trip
+
+    Records which were written before are only added to the index, since
+    adding them again is harmless there, but not to the statistics, which
+    may count them already.
+    """
+    pipe = current_app.store_db.pipeline(transaction=False)
+    for record in [*records, *written]:
+        include_vars = record["include_vars"]
+        if "confirm" in include_vars:
+            pipe.sadd(_index_key(storage), _hash_email(include_vars["confirm"]))
+    for record in records:
+        stats.count(pipe, record["include_vars"])
+    pipe.execute()
+
+
+def _group_commit(storage, record: dict) -> bool:
+    """Add a record to a store together with those of concurrent writers
+
+    The record is first put into a spool directory shared by all workers.
+    Whichever writer gets the lock next becomes the leader: it waits up to
+    STORE_GROUP_COMMIT_WINDOW seconds for up to STORE_GROUP_COMMIT_BATCH
+    records to arrive, writes them all with a single fsync, and only then
+    removes them from the spool. Meanwhile, the other writers watch the spool
+    instead of queueing for the lock, only trying to become the leader now and
+    then in case there is none, and return as soon as their records are
+    gone from it, which means they are on disk and in the index. If writing
+    the batch or updating the index fails, the leader marks all records of
+    the batch as failed, and their writers raise GroupCommitError. The
+    records may still have reached the store then, but not the index, which
+    "fsfe-forms store verify-index --repair" fixes. Records of writers which
+    died while waiting are still written by the next leader.
+
+    Each spooled record gets an "id". If a leader dies after writing a batch
+    but before removing it from the spool, the next leader finds the batch
+    at the end of the store by these ids and does not write it again.
+    Returns whether a segment was closed.
+    """
+    spool = _shared_path(storage, ".pending")
+    os.makedirs(spool, exist_ok=True)
+    record = {**record, "id": uuid.uuid4().hex}
+    name = os.path.join(spool, f"{time.time_ns():020d}-{record['id']}.json")
+    with open(name + ".tmp", "w") as f:
+        f.write(json.dumps(record))
+    os.replace(name + ".tmp", name)
+
+    # Until the record is written, by this writer or by another one. Only
+    # checking for the record is cheap, trying the lock is not.
+    rotated = False
+    delay = _POLL_INTERVAL
+    next_try = time.monotonic()
+    while os.path.exists(name):
+        if time.monotonic() < next_try:
+            time.sleep(delay)
+            delay = min(2 * delay, _MAX_POLL_INTERVAL)
+            continue
+        try:
+            with lock_store(storage, exclusive=True, blocking=False):
+                rotated = _write_spooled(storage, spool, name) or rotated
+        except Timeout:
+            next_try = time.monotonic() + _LOCK_RETRY_INTERVAL
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(name + ".failed")
+            raise
+    if os.path.exists(name + ".failed"):
+        os.remove(name + ".failed")
+        raise GroupCommitError(f"Writing the batch with {name} to {storage} failed")
+    return rotated
+
+
+def _write_spooled(storage, spool: str, name: str) -> bool:
+    """Write batches of spooled records until the given one is written
+
+    The caller must hold the exclusive lock on the store. Returns whether a
+    segment was closed.
+    """
+    rotated = False
+    # More than one batch may be waiting, so this may take more than one
+    while os.path.exists(name):
+        names = _gather(spool)
+        records = []
+        for pending in names:
+            with open(pending) as f:
+                records.append(json.loads(f.read()))
+        # Left over by a leader which died before removing them
+        ids = _last_ids(storage, len(records)) - {None}
+        written = [record for record in records if record.get("id") in ids]
+        records = [record for record in records if record.get("id") not in ids]
+        try:
+            if records:
+                rotated = _write(storage, records) or rotated
+            _update_index(storage, records, written)
+        except BaseException:
+            # Every writer of the batch fails, see _group_commit()
+            for pending in names:
+                os.replace(pending, pending + ".failed")
+            raise
+        for pending in names:
+            os.remove(pending)
+        current_app.logger.debug("Wrote %d records to %s", len(names), storage)
+    return rotated
+
+
+def _last_ids(storage, count: int, chunk_size: int = 65536) -> set[str]:
+    """The ids of the last count records of a store
+
+    Only the end of JSON Lines stores is read, and an incomplete record at
+    the end, which the next write removes, is ignored.
+    """
+    if not _is_jsonl(storage):
+        return {record.get("id") for record in list(read_log(storage))[-count:]}
+    try:
+        with open(storage, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            window = chunk_size
+            while True:
+                start = max(0, size - window)
+                f.seek(start)
+                # The first line may start before what was read
+                lines = f.read(size - start).splitlines()[1 if start else 0 :]
+                if len(lines) > count or not start:
+                    break
+                window *= 2
+    except FileNotFoundError:
+        return set()
+    records = [json.loads(line) for line in lines if _is_record(line)]
+    return {record.get("id") for record in records[-count:]}
+
+
+def _gather(spool: str) -> list[str]:
+    """Wait for records to arrive in a spool directory, returning the oldest
+
+    A writer which is alone does not wait, since no others are likely to
+    arrive in time.
+    """
+    batch = current_app.config["STORE_GROUP_COMMIT_BATCH"]
+    deadline = time.monotonic() + current_app.config["STORE_GROUP_COMMIT_WINDOW"]
+    while True:
+        names = sorted(entry for entry in os.listdir(spool) if entry.endswith(".json"))
+        if len(names) == 1 or len(names) >= batch or time.monotonic() >= deadline:
+            break
+        time.sleep(_GATHER_INTERVAL)
+    return [os.path.join(spool, entry) for entry in names[:batch]]
+
+
+# Seconds between checks for more records while gathering a batch, between
+# checks of waiting writers whether their record has been written (doubling
+# up to the maximum), and between their tries to become the leader
+_GATHER_INTERVAL = 0.0005
+_POLL_INTERVAL = 0.0005
+_MAX_POLL_INTERVAL = 0.008
+_LOCK_RETRY_INTERVAL = 0.02
+
+
+def _rotate_if_due(storage) -> bool:
+    """Close the active segment of a store if it is due
+
+    The caller must hold the exclusive lock on the store.
+    """
+    max_bytes = current_app.config["STORE_SEGMENT_MAX_BYTES"]
+    max_age = current_app.config["STORE_SEGMENT_MAX_AGE"]
+    if not (max_bytes or max_age) or not segments.due(storage, max_bytes, max_age):
+        return False
+    path = segments.rotate(storage)
+    current_app.logger.info("Closed segment %s", path)
+    return True
+
+
+def compress_segments(storage) -> int:
+    """Compress the closed segments of a store which are not compressed yet
+
+    Compression happens without the lock, so reads and writes can go on in
+    the meantime. Returns the number of segments compressed.
+    """
+    count = 0
+    for path in segments.uncompressed(storage):
+        try:
+            info = segments.compress(path)
+        except FileNotFoundError:
+            continue  # Compressed by another worker in the meantime
+        with lock_store(storage, exclusive=True):
+            segments.finish_compression(storage, path, info)
+        current_app.logger.info(
+            "Compressed segment %s: %d records", path, info["records"]
+        )
+        count += 1
+    return count
+
+
+def _compress_in_background(app, storage) -> None:
+    with app.app_context():
+        try:
+            compress_segments(storage)
+        except OSError:
+            # Left for the next rotation or "fsfe-forms store rotate"
+            app.logger.exception("Compressing the segments of %s failed", storage)
+
+
+def _append(storage, records: list[dict]) -> None:
+    """Append records to a JSON Lines store and flush them to disk
+
+    If this fails, the store is truncated to its previous size, so it does
+    not end in part of the records.
+    """
+    with open(storage, "a") as f:
+        start = f.tell()
+        try:
+            f.write("".join(_serialize(record) for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(start)
+            raise
+
+
+def _replace(storage, content: str) -> None:
+    """Replace a store with new content, which is on disk once this returns
+
+    The content is written to a temporary file first, so a crash leaves
+    either the old or the new content in place.
+    """
+    temp = f"{storage}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, storage)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(temp)
+        raise
+    # Make the new directory entry durable as well
+    segments.fsync_directory(storage)
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+cli = AppGroup("store", help="Maintenance of the JSON stores.")
+
+
+@cli.command("migrate")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.argument("destination", type=click.Path(dir_okay=False), required=False)
+def migrate_command(source, destination):
+    """Convert the legacy JSON store SOURCE into JSON Lines format.
+
+    DESTINATION defaults to SOURCE with the extension replaced by ".jsonl".
+    """
+    if _is_jsonl(source):
+        raise click.ClickException(f"{source} already is a JSON Lines store")
+    if destination is None:
+        destination = os.path.splitext(source)[0] + ".jsonl"
+    if not _is_jsonl(destination):
+        raise click.ClickException(f"{destination} must end in .jsonl")
+    if os.path.exists(destination):
+        raise click.ClickException(f"{destination} already exists")
+    count = migrate(source, destination)
+    click.echo(f"Converted {count} records from {source} to {destination}")
+
+
+def _configured_stores(stores) -> list[str]:
+    """Return the given stores, or all stores if none were given"""
+    return list(stores) or sorted(
+        {
+            app_config.store
+            for app_config in current_app.app_configs.values()
+            if app_config.store
+        }
+    )
+
+
+@cli.command("reindex")
+@click.argument("stores", nargs=-1)
+def reindex_command(stores):
+    """Rebuild the email address index of STORES (default: all stores)."""
+    for storage in _configured_stores(stores):
+        with lock_store(storage):
+            count = build_index(storage)
+        click.echo(f"{storage}: indexed {count} email addresses")
+
+
+@cli.command("verify-index")
+@click.option("--repair", is_flag=True, help="Rebuild indexes found to be wrong.")
+@click.argument("stores", nargs=-1)
+def verify_index_command(stores, repair):
+    """Check the email address index of STORES (default: all stores)."""
+    failed = False
+    for storage in _configured_stores(stores):
+        missing, extra = verify_index(storage)
+        if not (missing or extra):
+            click.echo(f"{storage}: OK")
+            continue
+        click.echo(f"{storage}: {len(missing)} missing, {len(extra)} extra entries")
+        if repair:
+            with lock_store(storage):
+                build_index(storage)
+            click.echo(f"{storage}: rebuilt")
+        else:
+            failed = True
+    if failed:
+        raise click.ClickException("Index verification failed")
+
+
+@cli.command("rotate")
+@click.option("--force", is_flag=True, help="Close the active segment even if not due.")
+@click.argument("stores", nargs=-1)
+def rotate_command(stores, force):
+    """Rotate and compress the segments of STORES (default: all JSON Lines stores).
+
+    The active segment is closed if it is due according to
+    STORE_SEGMENT_MAX_BYTES and STORE_SEGMENT_MAX_AGE, or with --force if it
+    is not empty.
+    """
+    for storage in _configured_stores(stores):
+        if not _is_jsonl(storage):
+            if stores:
+                raise click.ClickException(f"{storage} is not a JSON Lines store")
+            continue
+        with lock_store(storage, exclusive=True):
+            if force and os.path.exists(storage) and os.path.getsize(storage):
+                click.echo(f"{storage}: closed {segments.rotate(storage)}")
+            elif _rotate_if_due(storage):
+                click.echo(f"{storage}: closed active segment")
+        count = compress_segments(storage)
+        click.echo(f"{storage}: compressed {count} segments")
+
+
+@cli.command("recover")
+@click.argument("stores", nargs=-1)
+def recover_command(stores):
+    """Remove incomplete records from the end of STORES (default: all stores)."""
+    failed = False
+    for storage in _configured_stores(stores):
+        try:
+            with lock_store(storage, exclusive=True):
+                removed = recover(storage)
+        except ValueError as error:
+            click.echo(f"{storage}: {error}")
+            failed = True
+            continue
+        click.echo(
+            f"{storage}: removed {removed} bytes" if removed else f"{storage}: OK"
+        )
+    if failed:
+        raise click.ClickException("Recovery failed")
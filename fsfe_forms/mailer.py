@@ -0,0 +1,213 @@
+"""Background delivery of queued emails
+
+With MAIL_DELIVERY set to "outbox", send_email() only renders the message
+and appends it to an outbox in Redis. One or more "fsfe-forms-mailer"
+processes take the messages from there and send them out in batches.
+Messages which fail are retried with an exponentially growing delay, and
+moved to a dead-letter list after MAIL_OUTBOX_MAX_ATTEMPTS attempts. Messages
+which fail with an unexpected error are moved there right away.
+
+While a worker sends a message, the message is kept in a processing list of
+that worker, so it is not lost if the worker dies; it is put back into the
+outbox when a worker of the same name starts again.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import email
+import email.policy
+import json
+import signal
+import smtplib
+import socket
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+
+OUTBOX_KEY = "mail:outbox"
+RETRY_KEY = "mail:retry"
+DEAD_KEY = "mail:dead"
+
+# Move all entries of a sorted set (KEYS[1]) with a score up to ARGV[1] to the
+# head of a list (KEYS[2]) atomically, so no entry is lost or moved twice if a
+# worker dies or another one releases entries at the same time. Returns the
+# number of entries moved.
+RELEASE_SCRIPT = """
+local entries = redis.call("ZRANGEBYSCORE", KEYS[1], 0, ARGV[1])
+for _, entry in ipairs(entries) do
+    redis.call("ZREM", KEYS[1], entry)
+    redis.call("LPUSH", KEYS[2], entry)
+end
+return #entries
+"""
+
+
+def init_mailer(app) -> None:
+    """Initialize the module"""
+    app.mail_release_script = app.queue_db.register_script(RELEASE_SCRIPT)
+
+
+def _processing_key(name: str) -> str:
+    return f"mail:processing:{name}"
+
+
+def enqueue(message) -> None:
+    """Append a message to the outbox"""
+    entry = {"message": message.as_string(), "attempts": 0}
+    current_app.queue_db.lpush(OUTBOX_KEY, json.dumps(entry))
+
+
+def _release_retries() -> None:
+    """Move messages whose retry delay has passed back into the outbox"""
+    current_app.mail_release_script(keys=[RETRY_KEY, OUTBOX_KEY], args=[time.time()])
+
+
+def _deliver(entry: bytes) -> None:
+    """Send out a single message, scheduling a retry on failure"""
+    data = json.loads(entry)
+    message = email.message_from_string(data["message"], policy=email.policy.default)
+    try:
+        current_app.smtp_pool.send(message)
+    except (smtplib.SMTPException, OSError) as error:
+        data["attempts"] += 1
+        if data["attempts"] >= current_app.config["MAIL_OUTBOX_MAX_ATTEMPTS"]:
+            current_app.logger.error(
+                "Giving up on message %s: %s", message["Message-ID"], error
+            )
+            current_app.queue_db.lpush(DEAD_KEY, json.dumps(data))
+        else:
+            delay = current_app.config["MAIL_OUTBOX_RETRY_DELAY"] * 2 ** (
+                data["attempts"] - 1
+            )
+            current_app.logger.warning(
+                "Sending message %s failed, retrying in %d s: %s",
+                message["Message-ID"],
+                delay,
+                error,
+            )
+            current_app.queue_db.zadd(
+                RETRY_KEY, {json.dumps(data): time.time() + delay}
+            )
+
+
+def deliver_batch(name: str, timeout: int = 0) -> int:
+    """Take a batch of messages from the outbox and send them out
+
+    Waits up to timeout seconds for the first message (0 means not to wait).
+    Returns the number of messages processed.
+    """
+    db = current_app.queue_db
+    processing = _processing_key(name)
+    _release_retries()
+    count = 0
+    while count < current_app.config["MAIL_OUTBOX_BATCH"]:
+        if count == 0 and timeout:
+            entry = db.blmove(OUTBOX_KEY, processing, timeout, "RIGHT", "LEFT")
+        else:
+            entry = db.lmove(OUTBOX_KEY, processing, "RIGHT", "LEFT")
+        if entry is None:
+            break
+        try:
+            _deliver(entry)
+        except Exception:
+            # Retrying would only fail again, and stop the worker each time
+            current_app.logger.exception(
+                "Moving message which failed unexpectedly to %s", DEAD_KEY
+            )
+            db.lpush(DEAD_KEY, entry)
+        db.lrem(processing, 1, entry)
+        count += 1
+    return count
+
+
+def recover(name: str) -> int:
+    """Put messages left over by a dead worker back into the outbox"""
+    count = 0
+    while current_app.queue_db.lmove(
+        _processing_key(name), OUTBOX_KEY, "LEFT", "RIGHT"
+    ):
+        count += 1
+    return count
+
+
+def run(name: str) -> None:
+    """Keep delivering messages until receiving SIGTERM or SIGINT"""
+    stopping = False
+
+    def stop(signum, frame):  # noqa: ARG001
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    recovered = recover(name)
+    if recovered:
+        current_app.logger.info("Recovered %d messages", recovered)
+    current_app.logger.info("Mailer %s started", name)
+    while not stopping:
+        deliver_batch(name, timeout=1)
+    current_app.logger.info("Mailer %s stopped", name)
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+cli = AppGroup("mailer", help="Delivery of queued emails.")
+
+
+@cli.command("run")
+@click.option(
+    "--name",
+    default=socket.gethostname,
+    help="Worker name, unique among all running workers (default: hostname).",
+)
+def run_command(name):
+    """Deliver emails from the outbox until stopped."""
+    run(name)
+
+
+@cli.command("status")
+def status_command():
+    """Show the number of messages waiting in the outbox."""
+    db = current_app.queue_db
+    click.echo(f"Outbox:   {db.llen(OUTBOX_KEY)}")
+    click.echo(f"Retrying: {db.zcard(RETRY_KEY)}")
+    click.echo(f"Dead:     {db.llen(DEAD_KEY)}")
+
+
+@cli.command("requeue-dead")
+def requeue_dead_command():
+    """Move all messages from the dead-letter list back into the outbox."""
+    db = current_app.queue_db
+    count = 0
+    for _ in range(db.llen(DEAD_KEY)):
+        entry = db.rpop(DEAD_KEY)
+        if entry is None:
+            break
+        try:
+            data = json.loads(entry)
+        except ValueError:
+            # Could never be sent, so it stays
+            db.lpush(DEAD_KEY, entry)
+            continue
+        data["attempts"] = 0
+        db.lpush(OUTBOX_KEY, json.dumps(data))
+        count += 1
+    click.echo(f"Requeued {count} messages")
+
+
+def main() -> None:
+    """Entry point for the "fsfe-forms-mailer" worker process"""
+    from fsfe_forms.app import create_app
+
+    with create_app().app_context():
+        run_command.main(prog_name="fsfe-forms-mailer")
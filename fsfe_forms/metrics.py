@@ -0,0 +1,154 @@
+"""Prometheus metrics
+
+The time spent in each stage of processing a registration is recorded in a
+histogram, labelled with the stage, and so is the time spent waiting for and
+holding the lock of each store, labelled with the store. The result of each
+request to /email and /redeem is counted per application and outcome. All
+of them are exposed at /metrics in the Prometheus text format.
+
+Each worker process records its own metrics. When the environment variable
+PROMETHEUS_MULTIPROC_DIR points to a directory, the workers write their
+metrics to files in that directory instead, and /metrics adds up the metrics
+of all workers. The directory must exist and be emptied before the server
+starts.
+
+The stage timings and the application of a request are also left in its WSGI
+environment, where the profiler picks them up.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+# Most stages take milliseconds, but verification and SMTP may take seconds
+_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+STAGE_SECONDS = Histogram(
+    "fsfe_forms_stage_seconds",
+    "Time spent in each stage of processing a request",
+    ["stage"],
+    buckets=_BUCKETS,
+)
+
+STORE_LOCK_SECONDS = Histogram(
+    "fsfe_forms_store_lock_seconds",
+    "Time spent waiting for (wait) and holding (hold) the lock of each store",
+    ["store", "phase"],
+    buckets=_BUCKETS,
+)
+
+REQUESTS = Counter(
+    "fsfe_forms_requests",
+    "Requests per endpoint, application and outcome",
+    ["endpoint", "appid", "outcome"],
+)
+
+# Endpoints whose requests are counted
+_COUNTED = {"email", "redeem"}
+
+# Keys in the WSGI environment for the stage timings and the application
+STAGES_KEY = "fsfe_forms.stages"
+APPID_KEY = "fsfe_forms.appid"
+
+
+def init_metrics(app) -> None:
+    """Initialize the module"""
+    app.after_request(_count_request)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the time spent in the block as the given stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def observe(stage: str, seconds: float) -> None:
+    """Record the time spent in a stage which has been measured elsewhere"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if has_request_context():
+        request.environ.setdefault(STAGES_KEY, []).append((stage, seconds))
+
+
+def observe_lock(storage: str, wait: float, hold: float) -> None:
+    """Record the time spent waiting for and holding the lock of a store"""
+    STORE_LOCK_SECONDS.labels(storage, "wait").observe(wait)
+    STORE_LOCK_SECONDS.labels(storage, "hold").observe(hold)
+    observe("store_lock_wait", wait)
+    observe("store_lock_hold", hold)
+
+
+def outcome(appid: str, result: str) -> None:
+    """Set the outcome of the current request, counted once it is finished"""
+    g.metrics_appid = appid
+    g.metrics_outcome = result
+
+
+def _count_request(response):
+    if request.endpoint not in _COUNTED:
+        return response
+    appid = g.pop("metrics_appid", None)
+    if appid is None:
+        # Only label known applications, so arbitrary appids in requests do
+        # not create new time series
+        appid = request.values.get("appid", "")
+        if appid not in current_app.app_configs:
+            appid = ""
+    result = g.pop("metrics_outcome", None)
+    if result is None:
+        if response.status_code == 429:
+            result = "ratelimited"
+        elif response.status_code >= 400:
+            result = "error"
+        else:
+            result = "ok"
+    REQUESTS.labels(request.endpoint, appid, result).inc()
+    request.environ[APPID_KEY] = appid
+    return response
+
+
+def metrics():
+    """Metrics endpoint in the Prometheus text format"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), 200, {"Content-Type": CONTENT_TYPE_LATEST}
@@ -0,0 +1,177 @@
+"""Profiling of sampled and slow requests
+
+When enabled, a WSGI middleware runs requests under cProfile: a random
+fraction of PROFILE_SAMPLE_RATE of all requests, and, if PROFILE_SLOW_THRESHOLD
+is set, every request, of which only those taking longer than the threshold
+are kept. Profiling every request slows it down, so the threshold is meant to
+be set only while hunting down slow requests.
+
+Each profile is written to PROFILE_DIR, together with the path, the
+application and the stage timings of the request, but not its parameters,
+which may contain personal data. Only the latest PROFILE_KEEP profiles are
+kept. Only one request per worker process is profiled at a time, because
+Python does not allow several profilers to run at once.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import suppress
+from datetime import UTC, datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from fsfe_forms.metrics import APPID_KEY, STAGES_KEY
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling sampled and slow requests"""
+
+    def __init__(self, wsgi_app, app) -> None:
+        self.wsgi_app = wsgi_app
+        self.logger = app.logger
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.threshold = app.config["PROFILE_SLOW_THRESHOLD"]
+        self.directory = app.config["PROFILE_DIR"]
+        self.keep = app.config["PROFILE_KEEP"]
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        sampled = random.random() < self.sample_rate
+        if not (sampled or self.threshold) or not self.lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        status = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split()[0]))
+            return start_response(status_line, headers, exc_info)
+
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                return self.wsgi_app(environ, _start_response)
+            finally:
+                profile.disable()
+        finally:
+            duration = time.perf_counter() - start
+            self.lock.release()
+            if sampled or duration >= self.threshold:
+                self._save(profile, environ, status, duration, sampled)
+
+    def _save(self, profile, environ, status, duration, sampled) -> None:
+        name = f"{time.time_ns()}-{os.getpid()}"
+        info = {
+            "time": datetime.now(UTC).isoformat(timespec="seconds"),
+            "method": environ.get("REQUEST_METHOD"),
+            "path": environ.get("PATH_INFO"),
+            "status": status[0] if status else None,
+            "duration": duration,
+            "reason": "sampled" if sampled else "slow",
+            "appid": environ.get(APPID_KEY),
+            "stages": environ.get(STAGES_KEY, []),
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            profile.dump_stats(path + ".prof.tmp")
+            os.replace(path + ".prof.tmp", path + ".prof")
+            # The info is written last, so listed profiles are complete
+            with open(path + ".json.tmp", "w") as f:
+                json.dump(info, f)
+            os.replace(path + ".json.tmp", path + ".json")
+            names = list_profiles(self.directory)
+            for old in names[: max(len(names) - self.keep, 0)]:
+                _remove(self.directory, old)
+        except OSError as error:
+            self.logger.warning("Could not save profile: %s", error)
+
+
+def init_profiling(app) -> None:
+    """Initialize the module
+
+    Wraps the WSGI application in the profiler, if profiling is enabled.
+    """
+    if app.config["PROFILE_SAMPLE_RATE"] > 0 or app.config["PROFILE_SLOW_THRESHOLD"]:
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, app)
+
+
+def list_profiles(directory: str) -> list[str]:
+    """Names of the saved profiles, oldest first"""
+    try:
+        files = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        (name.removesuffix(".json") for name in files if name.endswith(".json")),
+        key=lambda name: int(name.split("-")[0]),
+    )
+
+
+def load_profile(directory: str, name: str) -> dict:
+    """The info saved with a profile"""
+    with open(os.path.join(directory, name + ".json")) as f:
+        return json.load(f)
+
+
+def _remove(directory: str, name: str) -> None:
+    for suffix in (".json", ".prof"):
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, name + suffix))
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+cli = AppGroup("profiles", help="Profiles of sampled and slow requests.")
+
+
+@cli.command("list")
+def list_command():
+    """List the saved profiles, oldest first."""
+    directory = current_app.config["PROFILE_DIR"]
+    for name in list_profiles(directory):
+        info = load_profile(directory, name)
+        click.echo(
+            f"{name}  {info['time']}  {info['duration'] * 1000:8.1f} ms  "
+            f"{info['status']}  {info['method']} {info['path']}  "
+            f"{info['appid'] or '-'}  ({info['reason']})"
+        )
+
+
+@cli.command("dump")
+@click.argument("name")
+@click.option("--sort", default="cumulative", help="Sort order of pstats.")
+@click.option("--limit", default=30, help="Number of functions to show.")
+def dump_command(name, sort, limit):
+    """Show the profile NAME, with the stage timings of the request."""
+    directory = current_app.config["PROFILE_DIR"]
+    try:
+        info = load_profile(directory, name)
+    except FileNotFoundError as error:
+        raise click.ClickException(f"No profile {name}") from error
+    click.echo(
+        f"{info['method']} {info['path']} ({info['status']}), "
+        f"{info['duration'] * 1000:.1f} ms, appid: {info['appid'] or '-'}"
+    )
+    for stage, seconds in info["stages"]:
+        click.echo(f"  {stage:20} {seconds * 1000:8.1f} ms")
+    stream = io.StringIO()
+    stats = pstats.Stats(os.path.join(directory, name + ".prof"), stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    click.echo(stream.getvalue())
@@ -1,4 +1,11 @@
-"""Queue of registrations pending double opt-in"""
+"""Queue of registrations pending double opt-in
+
+Each pending registration is stored in Redis under its (hex) ID. In addition,
+an index key per application and email address points to the ID of the
+pending registration, so a repeated registration can find and reuse it
+without looking at all other pending registrations. Both pushing and popping
+are atomic operations taking a single round trip to Redis.
+"""
 
 # This file is part of the FSFE Form Server.
 #
@@ -8,51 +15,125 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import json
+import re
 import uuid
 
+import click
 from flask import abort, current_app
+from flask.cli import AppGroup
 
+from fsfe_forms import metrics
+
+
+# Store a registration atomically in a single round trip. If the index key
+# (KEYS[1]) points to a pending registration, that one is updated with the new
+# data (ARGV[1]) and keeps its remaining lifetime. Otherwise, the registration
+# is stored under the new ID (KEYS[2]) with a lifetime of ARGV[2] seconds (0
+# for no expiration), and the index key is pointed to it. Returns the ID used.
+_PUSH_SCRIPT = """
+local existing = redis.call("GET", KEYS[1])
+if existing and redis.call("EXISTS", existing) == 1 then
+    redis.call("SET", existing, ARGV[1], "KEEPTTL")
+    return existing
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call("SET", KEYS[2], ARGV[1], "EX", ARGV[2])
+    redis.call("SET", KEYS[1], KEYS[2], "EX", ARGV[2])
+else
+    redis.call("SET", KEYS[2], ARGV[1])
+    redis.call("SET", KEYS[1], KEYS[2])
+end
+return KEYS[2]
+"""
 
-def _get(the_id: uuid.UUID) -> dict:
-    """Helper function to read a dictionary from Redis"""
-    data = current_app.queue_db.get(the_id.hex)
-    if data is None:
-        abort(404, "No such pending confirmation ID")
-    return json.loads(data.decode("utf-8"))
 
+def init_queue(app) -> None:
+    """Initialize the module"""
+    app.queue_push_script = app.queue_db.register_script(_PUSH_SCRIPT)
 
-def _set(the_id: uuid.UUID, data: dict, ttl: int) -> None:
-    """Helper function to write a dictionary to Redis"""
-    current_app.queue_db.set(the_id.hex, json.dumps(data).encode("utf-8"), ttl)
+
+def _index_key(data: dict) -> str:
+    """Key of the index entry for the application and email address"""
+    return f"pending:{data['appid']}:{data['confirm'].strip().lower()}"
+
+
+def _ttl(key: str) -> int | None:
+    """Remaining lifetime of a key in seconds, None if it does not expire
+
+    Returns 0 if the key does not exist (anymore).
+    """
+    ttl = current_app.queue_db.ttl(key)
+    if ttl == -1:
+        return None
+    return max(ttl, 0)
 
 
 def queue_push(data: dict) -> uuid.UUID:
-    """Push a new registration to the queue"""
-
-    # Check for an unconfirmed previous registration, and if found, update and
-    # reuse that one
-    for existing_id in [
-        uuid.UUID(key.decode()) for key in current_app.queue_db.keys()  # noqa: SIM118
-    ]:
-        old_data = _get(existing_id)
-        if (
-            old_data["appid"] == data["appid"]
-            and old_data["confirm"] == data["confirm"]
-        ):
-            _set(existing_id, data, current_app.queue_db.ttl(existing_id.hex))
-            current_app.logger.info("UUID reused: %s", existing_id)
-            return existing_id
-
-    # None found, so generate a new id
-    the_id = uuid.uuid4()
-    _set(the_id, data, current_app.config["CONFIRMATION_EXPIRATION_SECS"])
-    current_app.logger.info("UUID created: %s", the_id)
-    return the_id
+    """Push a new registration to the queue
+
+    If there is an unconfirmed previous registration for the same application
+    and email address, it is updated and reused.
+    """
+    new_id = uuid.uuid4()
+    with metrics.timed("queue_push"):
+        used_id = uuid.UUID(
+            current_app.queue_push_script(
+                keys=[_index_key(data), new_id.hex],
+                args=[
+                    json.dumps(data).encode("utf-8"),
+                    current_app.config["CONFIRMATION_EXPIRATION_SECS"] or 0,
+                ],
+            ).decode()
+        )
+    if used_id == new_id:
+        current_app.logger.info("UUID created: %s", used_id)
+    else:
+        current_app.logger.info("UUID reused: %s", used_id)
+    return used_id
 
 
 def queue_pop(the_id: uuid.UUID) -> dict:
-    """Pop a registration from the queue"""
-    rval: dict = _get(the_id)
-    current_app.queue_db.delete(the_id.hex)
+    """Pop a registration from the queue
+
+    Reading and deleting happen in a single atomic command, so each
+    registration can only be popped once, even by concurrent requests. The
+    index key is left to expire; queue_push ignores it once the registration
+    it points to is gone.
+    """
+    with metrics.timed("queue_pop"):
+        data = current_app.queue_db.getdel(the_id.hex)
+    if data is None:
+        abort(404, "No such pending confirmation ID")
     current_app.logger.info("UUID deleted: %s", the_id)
-    return rval
+    return json.loads(data.decode("utf-8"))
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+cli = AppGroup("queue", help="Maintenance of the double opt-in queue.")
+
+# Keys of pending registrations are plain hex UUIDs
+_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+@cli.command("reindex")
+def reindex_command():
+    """Create missing index entries for pending registrations.
+
+    This is needed once for registrations queued before the index existed.
+    """
+    created = 0
+    for key in current_app.queue_db.scan_iter(count=1000):
+        if not _ID_PATTERN.match(key.decode()):
+            continue
+        data = current_app.queue_db.get(key)
+        ttl = _ttl(key)
+        if data is None or ttl == 0:
+            continue
+        index_key = _index_key(json.loads(data.decode("utf-8")))
+        # Never overwrite index entries created by queue_push in the meantime
+        if current_app.queue_db.set(index_key, key, ex=ttl, nx=True):
+            created += 1
+    click.echo(f"Created {created} index entries")
@@ -0,0 +1,71 @@
+"""Rate limiting of requests
+
+Flask-Limiter keeps its counters in Redis, so all worker processes share
+them and RATELIMIT_DEFAULT applies to the whole server, not to each worker.
+
+In addition to the default limit, each application can have its own limit,
+set with the "ratelimit" key in applications.json. Registrations are counted
+separately per application, so a flood of requests for one application does
+not use up the limit of the others.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from collections.abc import Callable
+from urllib.parse import quote
+
+from flask import current_app, request
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+
+
+def _storage_uri(app) -> str:
+    """URI of the Redis database for the rate limit counters"""
+    password = app.config["REDIS_PASSWORD"]
+    credentials = f":{quote(password, safe='')}@" if password else ""
+    return (
+        f"redis://{credentials}{app.config['REDIS_HOST']}:"
+        f"{app.config['REDIS_PORT']}/{app.config['REDIS_RATELIMIT_DB']}"
+    )
+
+
+def init_ratelimit(app) -> None:
+    """Initialize the module
+
+    Must be called after the application configurations have been loaded,
+    which also checks their rate limits.
+    """
+    if not app.config["RATELIMIT_STORAGE_URI"]:
+        app.config["RATELIMIT_STORAGE_URI"] = (
+            "memory://" if app.testing else _storage_uri(app)
+        )
+    app.limiter = Limiter(get_remote_address, app=app)
+
+
+def _appid() -> str:
+    """Application of the current request, empty if unknown"""
+    appid = request.values.get("appid", "")
+    return appid if appid in current_app.app_configs else ""
+
+
+def _app_key() -> str:
+    return f"{_appid()}/{get_remote_address()}"
+
+
+def _app_limit() -> str:
+    app_config = current_app.app_configs.get(_appid())
+    ratelimit = app_config.ratelimit if app_config else None
+    return ratelimit or current_app.config["RATELIMIT_DEFAULT"] or ""
+
+
+def limit_per_app(app, view: Callable) -> Callable:
+    """Apply the rate limit of the requested application to a view
+
+    The limit replaces RATELIMIT_DEFAULT for this view, and is counted per
+    remote address and application.
+    """
+    return app.limiter.limit(_app_limit, key_func=_app_key)(view)
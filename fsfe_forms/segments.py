@@ -0,0 +1,210 @@
+"""Segments of JSON Lines stores
+
+A JSON Lines store can be split into segments by time or size. The file named
+in applications.json is the active segment, to which new records are
+appended. Once it is larger than STORE_SEGMENT_MAX_BYTES, or its first record
+is older than STORE_SEGMENT_MAX_AGE seconds, it is closed: renamed to
+<name>.<number>.jsonl, and then compressed with gzip to
+<name>.<number>.jsonl.gz. Closed segments never change again, so backups only
+need to copy each of them once. Removing closed segments, for example to
+archive old ones elsewhere, is not supported: the store is read from all
+segments in the manifest, and reading fails if one of them is missing.
+
+The closed segments of a store are listed, oldest first, in a small JSON
+file next to it, <store>.manifest, along with the number of records and the
+time range of each compressed segment.
+
+A closed segment is renamed before it is added to the manifest, so after a
+crash in between, it is missing from the manifest; adopt() adds such
+segments back.
+
+The functions in this module do not lock the store; the callers in json_store
+do that.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import gzip
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import suppress
+from typing import BinaryIO
+
+
+def manifest_path(storage: str) -> str:
+    return storage + ".manifest"
+
+
+def load_manifest(storage: str) -> dict:
+    """The manifest of a store, empty if the store has no closed segments"""
+    try:
+        with open(manifest_path(storage)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"segments": []}
+
+
+def _save_manifest(storage: str, manifest: dict) -> None:
+    temp = f"{manifest_path(storage)}.{uuid.uuid4().hex}.tmp"
+    with open(temp, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, manifest_path(storage))
+    fsync_directory(storage)
+
+
+def fsync_directory(path: str) -> None:
+    """Make renames and removals in the directory of a file durable"""
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _stem(storage: str) -> str:
+    return os.path.basename(storage).removesuffix(".jsonl")
+
+
+def segment_files(storage: str) -> list[str]:
+    """The closed segments of a store, oldest first, without .gz suffix"""
+    directory = os.path.dirname(storage)
+    return [
+        os.path.join(directory, entry["name"])
+        for entry in load_manifest(storage)["segments"]
+    ]
+
+
+def open_segment(path: str) -> BinaryIO:
+    """Open a closed segment, whether it has been compressed yet or not"""
+    try:
+        return gzip.open(path + ".gz", "rb")
+    except FileNotFoundError:
+        pass
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        # Compressed in the meantime
+        return gzip.open(path + ".gz", "rb")
+
+
+def due(storage: str, max_bytes: int, max_age: float) -> bool:
+    """Whether the active segment of a store should be closed"""
+    try:
+        size = os.path.getsize(storage)
+    except FileNotFoundError:
+        return False
+    if size == 0:
+        return False
+    if max_bytes and size >= max_bytes:
+        return True
+    if max_age:
+        with open(storage, "rb") as f:
+            first = json.loads(f.readline())
+        return time.time() - first.get("timestamp", 0) >= max_age
+    return False
+
+
+def adopt(storage: str) -> list[str]:
+    """Add closed segments missing from the manifest, returning their names
+
+    The caller must hold the exclusive lock on the store.
+    """
+    manifest = load_manifest(storage)
+    listed = {entry["name"] for entry in manifest["segments"]}
+    found = _found(storage)
+    orphans = sorted(set(found) - listed, key=found.get)
+    if orphans:
+        manifest["segments"].extend(
+            {"name": name, "closed": time.time()} for name in orphans
+        )
+        _save_manifest(storage, manifest)
+    return orphans
+
+
+def _found(storage: str) -> dict[str, int]:
+    """The closed segments of a store on disk, by name without .gz suffix"""
+    pattern = re.compile(re.escape(_stem(storage)) + r"\.(\d{5,})\.jsonl(?:\.gz)?$")
+    found = {}
+    for entry in os.listdir(os.path.dirname(storage) or "."):
+        match = pattern.match(entry)
+        if match:
+            found[entry.removesuffix(".gz")] = int(match.group(1))
+    return found
+
+
+def _number(name: str) -> int:
+    return int(name.removesuffix(".jsonl").rsplit(".", 1)[1])
+
+
+def rotate(storage: str) -> str:
+    """Close the active segment of a store, returning its new filename
+
+    The new segment gets the next number after the highest one in the
+    manifest or on disk, so no existing segment is ever overwritten.
+
+    The caller must hold the exclusive lock on the store.
+    """
+    adopt(storage)
+    manifest = load_manifest(storage)
+    numbers = [_number(entry["name"]) for entry in manifest["segments"]]
+    number = max([*numbers, *_found(storage).values()], default=0) + 1
+    name = f"{_stem(storage)}.{number:05d}.jsonl"
+    path = os.path.join(os.path.dirname(storage), name)
+    os.replace(storage, path)
+    manifest["segments"].append({"name": name, "closed": time.time()})
+    _save_manifest(storage, manifest)
+    return path
+
+
+def uncompressed(storage: str) -> list[str]:
+    """The closed segments of a store which have not been compressed yet"""
+    return [path for path in segment_files(storage) if os.path.exists(path)]
+
+
+def compress(path: str) -> dict:
+    """Compress a closed segment, returning what to note in the manifest
+
+    The uncompressed segment is left in place, so readers can go on using
+    it; finish_compression() removes it.
+    """
+    info = {"records": 0, "first": None, "last": None}
+    temp = f"{path}.{uuid.uuid4().hex}.gz.tmp"
+    with open(path, "rb") as src, open(temp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                dst.write(line)
+                timestamp = json.loads(line).get("timestamp")
+                info["records"] += 1
+                info["first"] = info["first"] or timestamp
+                info["last"] = timestamp
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temp, path + ".gz")
+    info["size"] = os.path.getsize(path + ".gz")
+    return info
+
+
+def finish_compression(storage: str, path: str, info: dict) -> None:
+    """Note a compressed segment in the manifest and remove the original
+
+    The caller must hold the exclusive lock on the store.
+    """
+    manifest = load_manifest(storage)
+    for entry in manifest["segments"]:
+        if entry["name"] == os.path.basename(path):
+            entry.update(info)
+    _save_manifest(storage, manifest)
+    with suppress(FileNotFoundError):
+        os.remove(path)
+    fsync_directory(storage)
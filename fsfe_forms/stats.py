@@ -0,0 +1,186 @@
+"""Live statistics of the stored registrations
+
+For each application, counters of the stored registrations are kept in a
+Redis hash: the total, those with permission to be shown publicly
+(permissionPub), and those per country and language. They are incremented
+together with each write to the store, so reading them takes constant time
+however large the store is. "fsfe-forms stats reconcile" recomputes them from
+the stores, which is needed once for registrations stored before the counters
+existed.
+
+The counters are only kept for applications with "stats" enabled in
+applications.json, and available at /stats/<appid>. Each worker caches the answer for
+STATS_CACHE_TTL seconds, so even heavy traffic from campaign pages only
+reaches Redis once in a while.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import re
+import uuid
+from collections import Counter
+
+import click
+from flask import abort, current_app, jsonify
+from flask.cli import AppGroup
+from marshmallow.fields import Boolean
+
+from fsfe_forms import json_store
+from fsfe_forms.verification import LocalCache
+
+
+_COUNTRY = re.compile(r"^[A-Z]{2}$")
+_LANG = re.compile(r"^[a-z]{2}$")
+
+
+def init_stats(app) -> None:
+    """Initialize the module"""
+    app.stats_cache = LocalCache(size=256)
+
+
+def _key(appid: str) -> str:
+    return f"stats:{appid}"
+
+
+def is_true(value) -> bool:
+    """Whether a parameter is true in the way the boolean validation accepts"""
+    if isinstance(value, str):
+        value = value.lower()
+    try:
+        return value in Boolean.truthy
+    except TypeError:
+        return False
+
+
+def _fields(include_vars: dict) -> list[str]:
+    """The counters to increment for a registration"""
+    fields = ["total"]
+    if is_true(include_vars.get("permissionPub")):
+        fields.append("public")
+    country = str(include_vars.get("country") or "").strip().upper()
+    if country:
+        # Free text is counted as a whole, so it cannot create new counters
+        fields.append(f"country:{country if _COUNTRY.match(country) else 'other'}")
+    lang = include_vars.get("lang")
+    if lang and _LANG.match(lang):
+        fields.append(f"lang:{lang}")
+    return fields
+
+
+def count(pipe, include_vars: dict) -> None:
+    """Add the increments of the counters for a registration to a pipeline
+
+    Only registrations of applications with "stats" enabled are counted. The
+    caller must hold the exclusive lock on the store, so the counters change
+    together with the store.
+    """
+    app_config = current_app.app_configs.get(include_vars.get("appid"))
+    if app_config is None or not app_config.stats:
+        return
+    for field in _fields(include_vars):
+        pipe.hincrby(_key(include_vars["appid"]), field)
+
+
+def _counters(appid: str) -> dict[str, int]:
+    return {
+        field.decode(): int(value)
+        for field, value in current_app.store_db.hgetall(_key(appid)).items()
+    }
+
+
+def get_stats(appid: str) -> dict:
+    """The counters of an application"""
+    counters = _counters(appid)
+    return {
+        "appid": appid,
+        "total": counters.get("total", 0),
+        "public": counters.get("public", 0),
+        "countries": {
+            field.removeprefix("country:"): value
+            for field, value in sorted(counters.items())
+            if field.startswith("country:")
+        },
+        "languages": {
+            field.removeprefix("lang:"): value
+            for field, value in sorted(counters.items())
+            if field.startswith("lang:")
+        },
+    }
+
+
+def reconcile(appid: str, storage: str) -> dict:
+    """Recompute the counters of an application from its store
+
+    The store is read from a snapshot, so registrations can go on meanwhile.
+    Their increments are added to the recomputed counters, which are then
+    assembled under a temporary key and atomically replace the old ones,
+    while the store is locked against writes for a moment.
+    """
+    counters: Counter[str] = Counter()
+    db = current_app.store_db
+    temp = f"{_key(appid)}:building:{uuid.uuid4().hex}"
+    before: Counter[str] = Counter()
+
+    def when_taken() -> None:
+        before.update(_counters(appid))
+
+    for record in json_store.snapshot_log(storage, when_taken):
+        include_vars = record.get("include_vars") or {}
+        if include_vars.get("appid") == appid:
+            counters.update(_fields(include_vars))
+    with json_store.lock_store(storage, exclusive=True):
+        # Counted since the snapshot was taken
+        counters.update(_counters(appid))
+        counters.subtract(before)
+        counters = +counters
+        if counters:
+            db.hset(temp, mapping=counters)
+            db.rename(temp, _key(appid))
+        else:
+            db.delete(_key(appid))
+    return dict(counters)
+
+
+def stats(appid):
+    """Statistics endpoint"""
+    app_config = current_app.app_configs.get(appid)
+    if app_config is None or not app_config.stats:
+        abort(404, f'No statistics for "{appid}"')
+    found, body = current_app.stats_cache.get(appid)
+    if not found:
+        body = get_stats(appid)
+        current_app.stats_cache.set(appid, body, current_app.config["STATS_CACHE_TTL"])
+    response = jsonify(body)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config["STATS_CACHE_TTL"]
+    # Campaign pages fetch the statistics from their own domains
+    response.access_control_allow_origin = "*"
+    return response
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+cli = AppGroup("stats", help="Statistics of the stored registrations.")
+
+
+@cli.command("reconcile")
+@click.argument("appids", nargs=-1)
+def reconcile_command(appids):
+    """Recompute the counters of APPIDS (default: all with stats enabled)."""
+    app_configs = current_app.app_configs
+    for appid in appids or sorted(app_configs):
+        app_config = app_configs.get(appid)
+        if app_config is None:
+            raise click.ClickException(f"No application {appid}")
+        if not app_config.stats:
+            if appids:
+                raise click.ClickException(f"No statistics for {appid}")
+            continue
+        counters = reconcile(appid, app_config.store)
+        click.echo(f"{appid}: {counters.get('total', 0)} registrations")
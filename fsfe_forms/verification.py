@@ -0,0 +1,300 @@
+"""Verification of email addresses with cached results
+
+Verifying an email address means looking up the MX records of its domain and
+asking one of the mail servers whether it accepts the address. Both steps
+are slow, so their results are cached: the MX records per domain, and the
+verdict per address. Each cache has two tiers, a small one in the memory of
+the worker process and a larger one in Redis shared by all workers.
+
+Positive results (MX records found, address accepted) are kept for
+EMAIL_CACHE_POSITIVE_TTL seconds, negative ones for EMAIL_CACHE_NEGATIVE_TTL
+seconds. Failures which are likely to go away quickly, like timeouts, are
+not cached at all.
+
+The lookups run in a thread pool of the worker process, so the whole
+verification can be given up after EMAIL_VERIFY_DEADLINE seconds, however
+slow the remote servers are. Several mail servers of a domain are asked in
+parallel, and the first clear answer counts.
+"""
+
+# This file is part of the FSFE Form Server.
+#
+# SPDX-FileCopyrightText: 2026 FSFE e.V. <contact@fsfe.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import sha256
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from validate_email.dns_check import dns_check
+from validate_email.domainlist_check import domainlist_check
+from validate_email.email_address import EmailAddress
+from validate_email.exceptions import (
+    AddressNotDeliverableError,
+    DNSError,
+    DNSTimeoutError,
+    EmailValidationError,
+    NoNameserverError,
+    NoValidMXError,
+    SMTPTemporaryError,
+)
+from validate_email.regex_check import regex_check
+from validate_email.smtp_check import smtp_check
+
+
+STATS_KEY = "verify:stats"
+
+
+class LocalCache:
+    """Least recently used cache with expiring entries"""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[bool, object]:
+        """Return whether the key was found, and its value"""
+        with self.lock:
+            if key not in self.entries:
+                return False, None
+            expires, value = self.entries[key]
+            if expires < time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value, ttl: float) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+def init_verification(app) -> None:
+    """Initialize the module"""
+    if app.config["EMAIL_VERIFY_PARALLEL_PROBES"] < 1:
+        raise ValueError("EMAIL_VERIFY_PARALLEL_PROBES must be at least 1")
+    app.verification_cache = LocalCache(app.config["EMAIL_CACHE_LOCAL_SIZE"])
+    app.verification_executor = ThreadPoolExecutor(
+        max_workers=app.config["EMAIL_VERIFY_WORKERS"],
+        thread_name_prefix="verification",
+    )
+
+
+def _cached(kind: str, key: str, compute: Callable[[], tuple[object, int]]):
+    """Look up a value in both cache tiers, or compute and cache it
+
+    compute() returns the value and the number of seconds to cache it, where
+    0 means not to cache it at all.
+    """
+    cache_key = f"verify:{kind}:{key}"
+    found, value = current_app.verification_cache.get(cache_key)
+    if found:
+        _count(kind, "local_hit")
+        return value
+
+    cached = current_app.cache_db.get(cache_key)
+    if cached is not None:
+        _count(kind, "redis_hit")
+        value = json.loads(cached)
+        _set_local(cache_key, value, current_app.cache_db.ttl(cache_key))
+        return value
+
+    _count(kind, "miss")
+    value, ttl = compute()
+    if ttl:
+        current_app.cache_db.set(cache_key, json.dumps(value), ex=ttl)
+        _set_local(cache_key, value, ttl)
+    return value
+
+
+def _set_local(cache_key: str, value, ttl: int) -> None:
+    # Entries are kept locally for a limited time only, so purging the Redis
+    # cache takes effect in all workers soon
+    ttl = min(ttl, current_app.config["EMAIL_CACHE_LOCAL_TTL"])
+    if ttl > 0:
+        current_app.verification_cache.set(cache_key, value, ttl)
+
+
+def _count(kind: str, outcome: str) -> None:
+    current_app.cache_db.hincrby(STATS_KEY, f"{kind}:{outcome}")
+
+
+def _hash_address(address: str) -> str:
+    return sha256(address.strip().lower().encode("utf-8")).hexdigest()
+
+
+def _remaining(deadline: float) -> float:
+    """Seconds left until the deadline"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError
+    return remaining
+
+
+def _lookup_mx(address: EmailAddress, deadline: float) -> tuple[list[str] | None, int]:
+    """Look up the mail servers for an address, None if there are none"""
+    timeout = _remaining(deadline)
+    future = current_app.verification_executor.submit(dns_check, address, timeout)
+    try:
+        return (
+            future.result(timeout=timeout),
+            current_app.config["EMAIL_CACHE_POSITIVE_TTL"],
+        )
+    except (DNSTimeoutError, NoNameserverError):
+        return None, 0
+    except DNSError:
+        return None, current_app.config["EMAIL_CACHE_NEGATIVE_TTL"]
+
+
+def _probe(address: EmailAddress, mx_records: list[str], deadline: float) -> None:
+    """Ask several mail servers in parallel whether they accept the address
+
+    Returns as soon as one server accepts the address, and raises
+    AddressNotDeliverableError as soon as one refuses it. If no server gives
+    a clear answer, raises SMTPTemporaryError if any server reported a
+    temporary error, or else the first error. Raises NoValidMXError if there
+    are no mail servers to ask.
+    """
+    if not mx_records:
+        raise NoValidMXError
+    timeout = _remaining(deadline)
+    from_address = current_app.config["VALIDATE_EMAIL_FROM"]
+    futures = [
+        current_app.verification_executor.submit(
+            smtp_check,
+            email_address=address,
+            mx_records=[host],
+            timeout=timeout,
+            helo_host=current_app.config["VALIDATE_EMAIL_HELO"],
+            from_address=EmailAddress(from_address) if from_address else None,
+        )
+        for host in mx_records[: current_app.config["EMAIL_VERIFY_PARALLEL_PROBES"]]
+    ]
+    errors: list[EmailValidationError] = []
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            try:
+                future.result()
+            except AddressNotDeliverableError:
+                raise
+            except EmailValidationError as error:
+                errors.append(error)
+            else:
+                return
+    finally:
+        for future in futures:
+            future.cancel()
+    for error in errors:
+        if isinstance(error, SMTPTemporaryError):
+            raise error
+    raise errors[0]
+
+
+def _check_address(address: str, deadline: float) -> tuple[bool | None, int]:
+    """Verify an email address without using the verdict cache"""
+    positive_ttl = current_app.config["EMAIL_CACHE_POSITIVE_TTL"]
+    negative_ttl = current_app.config["EMAIL_CACHE_NEGATIVE_TTL"]
+    try:
+        email_address = EmailAddress(address)
+        regex_check(email_address)
+        domainlist_check(email_address)
+        mx_records = _cached(
+            "domain",
+            email_address.domain.lower(),
+            lambda: _lookup_mx(email_address, deadline),
+        )
+        if mx_records is None:
+            return False, 0
+        _probe(email_address, mx_records, deadline)
+    except SMTPTemporaryError as error:
+        current_app.logger.info("Validation for %s is ambiguous: %s", address, error)
+        return None, negative_ttl
+    except EmailValidationError as error:
+        current_app.logger.info("Validation for %s failed: %s", address, error)
+        return False, negative_ttl
+    return True, positive_ttl
+
+
+def verify_email(address: str) -> bool | None:
+    """Check whether an email address exists
+
+    Returns True or False, or None if the result is ambiguous. This has the
+    same semantics as validate_email() from py3-validate-email, but caches
+    the results, and gives up with None when the verification takes longer
+    than EMAIL_VERIFY_DEADLINE seconds.
+    """
+    deadline = time.monotonic() + current_app.config["EMAIL_VERIFY_DEADLINE"]
+    try:
+        return _cached(
+            "address",
+            _hash_address(address),
+            lambda: _check_address(address, deadline),
+        )
+    except TimeoutError:
+        current_app.logger.warning("Verification of %s timed out", address)
+        return None
+
+
+# =============================================================================
+# Command line interface
+# =============================================================================
+
+cli = AppGroup("email-cache", help="Cache of email address verification results.")
+
+
+@cli.command("stats")
+def stats_command():
+    """Show the hit and miss counters of the caches."""
+    stats = {
+        key.decode(): int(value)
+        for key, value in current_app.cache_db.hgetall(STATS_KEY).items()
+    }
+    for kind in ("domain", "address"):
+        counts = [
+            stats.get(f"{kind}:{outcome}", 0)
+            for outcome in ("local_hit", "redis_hit", "miss")
+        ]
+        total = sum(counts) or 1
+        click.echo(
+            f"{kind:8} local hits: {counts[0]}, Redis hits: {counts[1]}, "
+            f"misses: {counts[2]} ({(counts[0] + counts[1]) / total:.0%} hit rate)"
+        )
+
+
+@cli.command("purge")
+@click.option("--domain", multiple=True, help="Purge the MX records of a domain.")
+@click.option("--address", multiple=True, help="Purge the verdict for an address.")
+@click.option("--all", "purge_all", is_flag=True, help="Purge all cached results.")
+def purge_command(domain, address, purge_all):
+    """Remove cached results from the shared cache.
+
+    Workers may keep using a purged entry for up to EMAIL_CACHE_LOCAL_TTL
+    seconds.
+    """
+    db = current_app.cache_db
+    keys = [f"verify:domain:{name.lower()}" for name in domain]
+    keys += [f"verify:address:{_hash_address(name)}" for name in address]
+    if purge_all:
+        keys += [
+            key
+            for key in db.scan_iter(match="verify:*", count=1000)
+            if key != STATS_KEY.encode()
+        ]
+    count = db.delete(*keys) if keys else 0
+    click.echo(f"Purged {count} entries")
@@ -12,25 +12,18 @@ from flask import (
     current_app,
     redirect,
     render_template,
-    render_template_string,
     request,
     url_for,
 )
-from marshmallow import Schema
-from marshmallow.fields import UUID, Boolean, Email, String
-from marshmallow.validate import Equal, Length, Regexp
-from validate_email import validate_email
+from marshmallow.fields import UUID
 from webargs.flaskparser import use_kwargs
 
-from fsfe_forms import json_store
+from fsfe_forms import cd_sync, json_store, metrics
+from fsfe_forms.applications import AppConfig, Step
 from fsfe_forms.cd import subscribe
 from fsfe_forms.email import send_email
 from fsfe_forms.queue import queue_pop, queue_push
-
-
-class AppConfigError(Exception):
-    def __init__(self, message):
-        self.message = f"Error in application configuration: {message}"
+from fsfe_forms.verification import verify_email
 
 
 # =============================================================================
@@ -38,7 +31,7 @@ class AppConfigError(Exception):
 # =============================================================================
 
 
-def _find_app_config(appid):
+def _find_app_config(appid) -> AppConfig:
     """# Find application config or issue 404 error"""
     try:
         return current_app.app_configs[appid]
@@ -64,45 +57,40 @@ domain_blacklist: set[str] = {
 }
 
 
-def _validate(config: dict, params: dict, confirm: bool) -> None:
+def _validate(app_config: AppConfig, params: dict) -> None:
     """Validate parameters"""
-    current_app.logger.debug("config: %s", config)
+    appid = app_config.appid
+    confirm = app_config.confirm is not None
+    current_app.logger.debug("appid: %s", appid)
     current_app.logger.debug("params: %s", params)
     current_app.logger.debug("confirm: %s", confirm)
-    # Build Marshmallow Schema from configuration
-    fields = {
-        "appid": String(required=True),
-        "lang": String(validate=Regexp(r"^[a-z]{2}$"), load_default=None),
-    }
     if confirm:
-        # Do syntax check
-        fields["confirm"] = Email(required=True)
-
         # Don't do expensive email validation in testing
         if current_app.testing or current_app.debug:
             return
 
         try:
             # Check if email is in custom blacklist
-            if params["confirm"].split("@")[-1] in domain_blacklist:
+            with metrics.timed("blocklist"):
+                blocked = params["confirm"].split("@")[-1] in domain_blacklist
+            if blocked:
                 current_app.logger.info(
                     "Email address is on domain blacklist: %s", params["confirm"]
                 )
+                metrics.outcome(appid, "blocked")
                 abort(
                     422,
                     "Using this email address is not possible. Please try another one.",
                 )
 
             # Do expensive validation
-            result = validate_email(
-                email_address=params["confirm"],
-                smtp_helo_host=current_app.config["VALIDATE_EMAIL_HELO"],
-                smtp_from_address=current_app.config["VALIDATE_EMAIL_FROM"],
-            )
+            with metrics.timed("mx_probe"):
+                result = verify_email(params["confirm"])
             if result is False:
                 current_app.logger.info(
                     "Caught invalid email address: %s", params["confirm"]
                 )
+                metrics.outcome(appid, "undeliverable")
                 abort(
                     422,
                     "Using this email address is not possible. Please try another one.",
@@ -113,53 +101,27 @@ def _validate(config: dict, params: dict, confirm: bool) -> None:
                 )
         except KeyError:
             current_app.logger.warning("Could not validate email address.")
-            current_app.logger.info("config: %s", config)
+            current_app.logger.info("appid: %s", appid)
             current_app.logger.info("params: %s", params)
             current_app.logger.info("confirm: %s", confirm)
 
-    for name, options in config.items():
-        field_class = String
-        validate = []
-        required = False
-        for opt in options:
-            match opt:
-                case "boolean":
-                    field_class = Boolean
-                case "email":
-                    field_class = Email
-                case "forbidden":
-                    validate.append(Length(equal=0))
-                case "mandatory":
-                    field_class = Boolean
-                    required = True
-                    validate.append(Equal(True, error="Mandatory."))
-                case "required":
-                    required = True
-                case "single-line":
-                    validate.append(Regexp(r"^[^\r\n]*$"))
-                case _:
-                    raise AppConfigError(f"Invalid option {opt} for parameter {name}")
-        kwargs = {"required": required, "validate": validate}
-        if not required:
-            kwargs["load_default"] = None
-        fields[name] = field_class(**kwargs)
-    schema = Schema.from_dict(fields)()
-
     # Do the actual validation; don't use the deserialized values because we
     # want for example "yes" to remain "yes" and not change to True
-    errors = schema.validate(params)
+    with metrics.timed("validate_syntax"):
+        errors = app_config.schema.validate(params)
     if errors:
+        metrics.outcome(appid, "invalid")
         messages = [k + ": " + " ".join(v) for k, v in errors.items()]
         abort(422, "\n".join(messages))
 
 
-def _process(config, params, id=None, store=None) -> str:
+def _process(config: Step, params, id=None, store=None) -> str:
     """Send email, store data, and redirect"""
 
-    if "email" in config:
+    if config.email:
         # Send out email
         message = send_email(
-            template=config["email"],
+            template=config.email,
             confirmation_url=url_for("confirm", _external=True, id=id),
             **params,
         )
@@ -179,7 +141,7 @@ def _process(config, params, id=None, store=None) -> str:
         json_store.log(store, "", [""], "", "", "", params)
 
     # Redirect the user's browser
-    return redirect(render_template_string(config["redirect"], **params))
+    return redirect(config.redirect_url(params))
 
 
 def index():
@@ -196,23 +158,24 @@ def email():
     app_config = _find_app_config(params.get("appid"))
 
     # Validate required parameters
-    _validate(app_config["parameters"], params, "confirm" in app_config)
+    _validate(app_config, params)
 
-    if "confirm" in app_config:  # With double opt-in
+    if app_config.confirm:  # With double opt-in
         # Optionally, check for a confirmed previous registration, and if
         # found, refuse the duplicate
-        if "duplicate" in app_config and json_store.find(
-            app_config["store"], params["confirm"]
+        if app_config.duplicate and json_store.find(
+            app_config.store, params["confirm"]
         ):
-            return _process(config=app_config["duplicate"], params=params)
+            metrics.outcome(app_config.appid, "duplicate")
+            return _process(config=app_config.duplicate, params=params)
         # else
+        metrics.outcome(app_config.appid, "pending")
         return _process(
-            config=app_config["register"], params=params, id=queue_push(params)
+            config=app_config.register, params=params, id=queue_push(params)
         )
     # Without double opt-in
-    return _process(
-        config=app_config["register"], params=params, store=app_config.get("store")
-    )
+    metrics.outcome(app_config.appid, "registered")
+    return _process(config=app_config.register, params=params, store=app_config.store)
 
 
 # =============================================================================
@@ -235,13 +198,15 @@ def redeem(id):
 
     app_config = _find_app_config(params["appid"])
 
-    if "cd" in app_config:
-        response = subscribe(app_config["cd"], params)
+    if app_config.cd and current_app.config["FSFE_CD_DELIVERY"] == "deferred":
+        cd_sync.enqueue(params["appid"], params)
+    elif app_config.cd:
+        response = subscribe(app_config.cd, params)
         # If the FSFE Community Database has yielded an error message, display
         # it unchanged.
         if response:
+            metrics.outcome(app_config.appid, "cd_error")
             return response
 
-    return _process(
-        config=app_config["confirm"], params=params, store=app_config["store"]
-    )
+    metrics.outcome(app_config.appid, "confirmed")
+    return _process(config=app_config.confirm, params=params, store=app_config.store)
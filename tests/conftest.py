@@ -3,8 +3,12 @@
 # =============================================================================
 # This file is part of the FSFE Form Server.
 
+import json
+import os
+from functools import partial
+
 import pytest
-from fakeredis import FakeRedis
+from fakeredis import FakeRedis, FakeServer
 from flask import url_for
 from requests import Response
 
@@ -18,7 +22,9 @@ from fsfe_forms import config, create_app
 
 @pytest.fixture
 def smtp_mock(mocker):
-    return mocker.patch("smtplib.SMTP")
+    smtp = mocker.patch("smtplib.SMTP")
+    smtp.return_value.noop.return_value = (250, b"OK")
+    return smtp
 
 
 # -----------------------------------------------------------------------------
@@ -28,7 +34,8 @@ def smtp_mock(mocker):
 
 @pytest.fixture
 def redis_mock(mocker):
-    return mocker.patch("redis.Redis", FakeRedis)
+    # A separate server for each test, so tests don't see each other's data
+    return mocker.patch("redis.Redis", partial(FakeRedis, server=FakeServer()))
 
 
 # -----------------------------------------------------------------------------
@@ -39,9 +46,8 @@ def redis_mock(mocker):
 @pytest.fixture
 def file_mock(mocker):
     mocker.patch("os.makedirs")
-    return mocker.patch(
-        "fsfe_forms.json_store.open", mocker.mock_open(read_data="[\n]")
-    )
+    mocker.patch("os.fsync")
+    return mocker.patch("fsfe_forms.json_store.open", mocker.mock_open(read_data=""))
 
 
 # -----------------------------------------------------------------------------
@@ -54,7 +60,7 @@ def fsfe_cd_mock(mocker):
     response = Response()
     response.status_code = 200
     response._content = b'{"id": "FSFE_CD_ID"}'
-    return mocker.patch(target="fsfe_forms.cd.post", return_value=response)
+    return mocker.patch(target="requests.Session.post", return_value=response)
 
 
 # -----------------------------------------------------------------------------
@@ -63,8 +69,18 @@ def fsfe_cd_mock(mocker):
 
 
 @pytest.fixture
-def app(redis_mock):
+def app(redis_mock, tmp_path_factory, monkeypatch):
     config.TESTING = True
+    # Keep the stores in a temporary directory instead of /store on the host
+    directory = tmp_path_factory.mktemp("forms")
+    with open(os.path.join(os.path.dirname(config.__file__), "applications.json")) as f:
+        app_configs = json.load(f)
+    for app_config in app_configs.values():
+        if "store" in app_config:
+            app_config["store"] = str(directory) + app_config["store"]
+    filename = directory / "applications.json"
+    filename.write_text(json.dumps(app_configs))
+    monkeypatch.setattr(config, "APP_CONFIG_FILE", str(filename))
     return create_app()
 
 
@@ -86,7 +102,7 @@ def signed_up(client, smtp_mock):
         },
     )
     # Return the confirmation ID
-    email = smtp_mock().__enter__().send_message.call_args[0][0]
+    email = smtp_mock().send_message.call_args[0][0]
     for line in email.as_string().splitlines():
         if url_for("confirm") in line:
             return line.split("=3D")[-1]
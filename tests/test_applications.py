@@ -0,0 +1,100 @@
+# =============================================================================
+# Tests of the application configuration
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import json
+
+import pytest
+
+from fsfe_forms.applications import (
+    AppConfigError,
+    build_schema,
+    compile_app_config,
+    init_applications,
+    reload_if_changed,
+)
+
+
+CONTACT = {
+    "parameters": {"from": ["email"]},
+    "register": {"email": "contact-register", "redirect": "https://example.com/"},
+}
+
+
+def test_compile(app):
+    app_config = compile_app_config(
+        "APPID",
+        CONTACT | {"register": {"redirect": "https://example.com/{{lang}}/"}},
+        app.jinja_env,
+    )
+    assert app_config.confirm is None
+    assert app_config.register.email is None
+    assert app_config.register.redirect_url({"lang": "en"}) == "https://example.com/en/"
+
+
+def test_literal_redirect(app):
+    app_config = compile_app_config("APPID", CONTACT, app.jinja_env)
+    assert app_config.register.redirect == "https://example.com/"
+    assert app_config.register.redirect_url({"lang": "en"}) == "https://example.com/"
+
+
+def test_redirect_templates_shared(app):
+    raw = CONTACT | {"register": {"redirect": "https://example.com/{{lang}}/"}}
+    first = compile_app_config("APPID", raw, app.jinja_env)
+    second = compile_app_config("APPID2", raw, app.jinja_env)
+    assert first.register.redirect is second.register.redirect
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        CONTACT | {"BAD-KEY": None},
+        CONTACT | {"register": {"email": "BAD-TEMPLATE", "redirect": "/"}},
+        CONTACT | {"register": {"redirect": "https://example.com/{{lang"}},
+        CONTACT | {"confirm": {"redirect": "/"}},
+        CONTACT | {"ratelimit": "BAD-LIMIT"},
+        CONTACT | {"stats": True},
+        CONTACT | {"store": "/store.jsonl", "stats": "yes"},
+        [],
+        CONTACT | {"register": "/"},
+        CONTACT | {"register": {"redirect": ["/"]}},
+        CONTACT | {"parameters": {"from": "email"}},
+        CONTACT | {"store": 1},
+    ],
+)
+def test_compile_invalid(app, raw):
+    with pytest.raises(AppConfigError):
+        compile_app_config("APPID", raw, app.jinja_env)
+
+
+def test_invalid_option():
+    with pytest.raises(AppConfigError):
+        build_schema({"name": ["BAD-OPTION"]}, False)
+
+
+def test_reload(app, tmp_path):
+    filename = tmp_path / "applications.json"
+    filename.write_text(json.dumps({"contact": CONTACT}))
+    app.config["APP_CONFIG_FILE"] = str(filename)
+    init_applications(app)
+    assert list(app.app_configs) == ["contact"]
+
+    # Not checked again before the interval has passed
+    filename.write_text(json.dumps({"contact": CONTACT, "contact2": CONTACT}))
+    assert not reload_if_changed()
+    app.app_configs_checked -= app.config["APP_CONFIG_RELOAD_INTERVAL"]
+    assert reload_if_changed()
+    assert list(app.app_configs) == ["contact", "contact2"]
+
+    # An invalid configuration is ignored
+    filename.write_text(json.dumps({"contact": CONTACT | {"BAD-KEY": None}}))
+    app.app_configs_checked -= app.config["APP_CONFIG_RELOAD_INTERVAL"]
+    assert not reload_if_changed()
+    assert list(app.app_configs) == ["contact", "contact2"]
+
+    # As is one which is not an object
+    filename.write_text(json.dumps([]))
+    app.app_configs_checked -= app.config["APP_CONFIG_RELOAD_INTERVAL"]
+    assert not reload_if_changed()
+    assert list(app.app_configs) == ["contact", "contact2"]
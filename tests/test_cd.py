@@ -0,0 +1,65 @@
+# =============================================================================
+# Tests of the interaction with the FSFE Community Database
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import socket
+import threading
+
+from fsfe_forms.cd import _post, subscribe
+
+
+PARAMS = {
+    "appid": "pmpc-sign",
+    "confirm": "EMAIL@example.com",
+    "name": "THE NAME",
+    "lang": "en",
+    "permissionNews": "yes",
+}
+
+
+def test_subscribe(app, fsfe_cd_mock):
+    app.config["FSFE_CD_CONNECT_TIMEOUT"] = 1
+    app.config["FSFE_CD_READ_TIMEOUT"] = 5
+    assert subscribe(app.app_configs["pmpc-sign"].cd, PARAMS) is None
+    first, second = fsfe_cd_mock.call_args_list
+    assert first.kwargs["url"].endswith("subscribe-api")
+    assert first.kwargs["data"]["email1"] == "EMAIL@example.com"
+    assert first.kwargs["timeout"] == (1, 5)
+    assert second.kwargs["url"].endswith("command/confirm")
+    assert second.kwargs["params"]["person"] == "FSFE_CD_ID"
+    assert second.kwargs["params"]["wants_pmpc_info"] == "yes"
+    assert "signature" in second.kwargs["params"]
+
+
+def test_subscribe_reuses_session(app, fsfe_cd_mock):
+    session = app.cd_session
+    subscribe(app.app_configs["pmpc-sign"].cd, PARAMS)
+    subscribe(app.app_configs["pmpc-sign"].cd, PARAMS)
+    assert app.cd_session is session
+    assert fsfe_cd_mock.call_count == 4
+
+
+def test_retry_after_disconnect(app):
+    server = socket.create_server(("127.0.0.1", 0))
+    server.settimeout(5)
+    app.config["FSFE_CD_URL"] = f"http://127.0.0.1:{server.getsockname()[1]}/"
+
+    def serve():
+        # Like a kept alive connection closed by the server when reused
+        connection, _ = server.accept()
+        connection.recv(65536)
+        connection.close()
+        connection, _ = server.accept()
+        connection.recv(65536)
+        connection.sendall(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\n{}"
+        )
+        connection.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    with server:
+        response = _post("subscribe-api", data={"email1": "EMAIL@example.com"})
+        thread.join()
+    assert response.status_code == 200
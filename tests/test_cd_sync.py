@@ -0,0 +1,156 @@
+# =============================================================================
+# Tests of the deferred synchronization with the Community Database
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+from dataclasses import replace
+from datetime import date
+
+import pytest
+from requests import ConnectionError, Response
+
+from fsfe_forms import cd_sync, json_store
+
+
+@pytest.fixture
+def deferred(app):
+    app.config["FSFE_CD_DELIVERY"] = "deferred"
+    app.config["FSFE_CD_QUEUE_RETRY_DELAY"] = 0
+    app.config["FSFE_CD_QUEUE_MAX_ATTEMPTS"] = 3
+    app.config["FSFE_CD_BREAKER_THRESHOLD"] = 2
+    return app.queue_db
+
+
+def _enqueue(email="EMAIL@example.com"):
+    cd_sync.enqueue(
+        "pmpc-sign",
+        {"appid": "pmpc-sign", "confirm": email, "name": "THE NAME", "lang": "en"},
+    )
+
+
+def test_redeem_deferred(client, smtp_mock, file_mock, fsfe_cd_mock, deferred):
+    client.get(
+        path="/email",
+        query_string={
+            "appid": "pmpc-sign",
+            "name": "THE NAME",
+            "confirm": "EMAIL@example.com",
+            "lang": "en",
+            "permissionPriv": "yes",
+        },
+    )
+    email = smtp_mock.return_value.send_message.call_args[0][0]
+    the_id = next(
+        line.split("=3D")[-1]
+        for line in email.as_string().splitlines()
+        if "/confirm?id=3D" in line
+    )
+    response = client.get(path="/redeem", query_string={"id": the_id})
+    assert response.status_code == 302
+    assert not fsfe_cd_mock.called
+    assert deferred.llen(cd_sync.QUEUE_KEY) == 1
+    assert cd_sync.sync_batch("test") == 1
+    assert fsfe_cd_mock.call_count == 2
+    assert deferred.llen(cd_sync.QUEUE_KEY) == 0
+    assert deferred.llen(cd_sync._processing_key("test")) == 0
+
+
+def test_retry_and_dead_letter(app, fsfe_cd_mock, deferred):
+    fsfe_cd_mock.side_effect = ConnectionError("Connection refused")
+    _enqueue()
+    cd_sync.sync_batch("test")
+    assert deferred.zcard(cd_sync.RETRY_KEY) == 1
+    # The second failure in a row opens the circuit breaker
+    cd_sync.sync_batch("test")
+    assert cd_sync.breaker_open()
+    assert cd_sync.sync_batch("test") == 0
+    app.test_cli_runner().invoke(args=["cd-sync", "reset-breaker"])
+    cd_sync.sync_batch("test")
+    assert deferred.llen(cd_sync.DEAD_KEY) == 1
+    result = app.test_cli_runner().invoke(args=["cd-sync", "replay-dead"])
+    assert "Replayed 1 jobs" in result.output
+    fsfe_cd_mock.side_effect = None
+    assert cd_sync.sync_batch("test") == 1
+    assert deferred.llen(cd_sync.QUEUE_KEY) == 0
+    assert not deferred.exists(cd_sync.FAILURES_KEY)
+
+
+def test_refused_job_is_not_retried(fsfe_cd_mock, deferred):
+    response = Response()
+    response.status_code = 400
+    response._content = b"Invalid email address"
+    fsfe_cd_mock.return_value = response
+    _enqueue()
+    cd_sync.sync_batch("test")
+    assert deferred.zcard(cd_sync.RETRY_KEY) == 0
+    assert deferred.llen(cd_sync.DEAD_KEY) == 1
+    assert not cd_sync.breaker_open()
+
+
+def test_unexpected_error(app, fsfe_cd_mock, deferred):
+    fsfe_cd_mock.side_effect = KeyError("UNEXPECTED")
+    _enqueue()
+    deferred.lpush(cd_sync.QUEUE_KEY, "NOT-JSON")
+    assert cd_sync.sync_batch("test") == 2
+    assert deferred.llen(cd_sync.DEAD_KEY) == 2
+    assert deferred.llen(cd_sync._processing_key("test")) == 0
+    result = app.test_cli_runner().invoke(args=["cd-sync", "replay-dead"])
+    assert "Replayed 1 jobs" in result.output
+    assert deferred.lrange(cd_sync.DEAD_KEY, 0, -1) == [b"NOT-JSON"]
+
+
+def test_release_retries(deferred):
+    deferred.zadd(cd_sync.RETRY_KEY, {"DUE": 0, "LATER": 2**40})
+    cd_sync._release_retries()
+    assert deferred.lrange(cd_sync.QUEUE_KEY, 0, -1) == [b"DUE"]
+    assert deferred.zrange(cd_sync.RETRY_KEY, 0, -1) == [b"LATER"]
+
+
+def test_recover(fsfe_cd_mock, deferred):
+    _enqueue()
+    # Simulate a worker which died while processing the job
+    deferred.lmove(cd_sync.QUEUE_KEY, cd_sync._processing_key("test"), "RIGHT", "LEFT")
+    assert cd_sync.recover("test") == 1
+    assert deferred.llen(cd_sync.QUEUE_KEY) == 1
+
+
+def test_backfill(app, fsfe_cd_mock, tmp_path):
+    storage = tmp_path / "signatures.jsonl"
+    app.app_configs["pmpc-sign"] = replace(
+        app.app_configs["pmpc-sign"], store=str(storage)
+    )
+    for email in ("ONE@example.com", "TWO@example.com"):
+        json_store.log(
+            str(storage),
+            "FROM",
+            ["TO"],
+            "SUBJECT",
+            "CONTENT",
+            None,
+            {"appid": "pmpc-sign", "confirm": email, "name": "THE NAME"},
+        )
+    fsfe_cd_mock.side_effect = [ConnectionError("Connection refused")] + [
+        fsfe_cd_mock.return_value
+    ] * 10
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["cd-sync", "backfill", "--workers", "1", "pmpc-sign"])
+    assert result.exit_code != 0
+    assert "Synced 1 records, 1 failed" in result.output
+    # Unexpected errors count as failed as well
+    fsfe_cd_mock.side_effect = KeyError("UNEXPECTED")
+    result = runner.invoke(args=["cd-sync", "backfill", "pmpc-sign"])
+    assert "Synced 0 records, 1 failed" in result.output
+    fsfe_cd_mock.side_effect = None
+    # A resumed run only sends the record which failed
+    result = runner.invoke(args=["cd-sync", "backfill", "pmpc-sign"])
+    assert result.exit_code == 0
+    assert "Synced 1 records, 0 failed" in result.output
+    assert fsfe_cd_mock.call_count == 6
+    data = fsfe_cd_mock.call_args_list[-1].kwargs["params"]
+    assert data["signed_pmpc_on"] == str(date.today())
+
+
+def test_delivery_config(app):
+    app.config["FSFE_CD_DELIVERY"] = "DEFERRED"
+    with pytest.raises(ValueError, match="FSFE_CD_DELIVERY"):
+        cd_sync.init_cd_sync(app)
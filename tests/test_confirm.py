@@ -38,7 +38,7 @@ def test_redeem(client, smtp_mock, redis_mock, file_mock, fsfe_cd_mock, signed_u
     assert "EMAIL@example.com" in logfile
     assert name in logfile
     # Check email sent.
-    email = smtp_mock().__enter__().send_message.call_args[0][0]
+    email = smtp_mock().send_message.call_args[0][0]
     # sender
     assert email["From"] == f"{name} <EMAIL@example.com>"
     # recipients
@@ -52,7 +52,7 @@ def test_redeem(client, smtp_mock, redis_mock, file_mock, fsfe_cd_mock, signed_u
     assert "MY ACTIVITIES" in email.as_string()
 
 
-def test_redeem_doubled(client, signed_up):
+def test_redeem_doubled(client, file_mock, signed_up):
     """Redeem the same valid ID more than once"""
     client.get(path="/redeem", query_string={"id": signed_up})
     response = client.get(path="/redeem", query_string={"id": signed_up})
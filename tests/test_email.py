@@ -3,6 +3,17 @@
 # =============================================================================
 # This file is part of the FSFE Form Server.
 
+import email
+import email.policy
+from pathlib import Path
+
+import pytest
+from flask import render_template
+from jinja2 import meta
+
+from fsfe_forms.email import EmailSkeleton
+
+
 # =============================================================================
 # GET method
 # =============================================================================
@@ -30,7 +41,7 @@ def test_email_get(client, smtp_mock, redis_mock, file_mock):
     assert "EMAIL-SUBJECT" in logfile
     assert "EMAIL-CONTENT" in logfile
     # Check email sent.
-    email = smtp_mock().__enter__().send_message.call_args[0][0]
+    email = smtp_mock().send_message.call_args[0][0]
     # sender
     assert email["From"] == "EMAIL@example.com"
     # recipient
@@ -75,7 +86,7 @@ def test_email_get_with_confirmation(client, smtp_mock, redis_mock, file_mock):
     # Check no logfile written (yet).
     assert not file_mock().write.called
     # Check email sent.
-    email = smtp_mock().__enter__().send_message.call_args[0][0]
+    email = smtp_mock().send_message.call_args[0][0]
     # sender
     assert "no-reply@fsfe.org" in email["From"]
     # recipient
@@ -100,7 +111,7 @@ def test_email_get_duplicate(client, smtp_mock, redis_mock, file_mock, signed_up
     # Check no logfile written (yet).
     assert not file_mock().write.called
     # Check email sent.
-    email = smtp_mock().__enter__().send_message.call_args[0][0]
+    email = smtp_mock().send_message.call_args[0][0]
     # sender
     assert "no-reply@fsfe.org" in email["From"]
     # recipient
@@ -136,7 +147,7 @@ def test_email_post(client, smtp_mock, redis_mock, file_mock):
     assert "EMAIL-SUBJECT" in logfile
     assert "EMAIL-CONTENT" in logfile
     # Check email sent.
-    email = smtp_mock().__enter__().send_message.call_args[0][0]
+    email = smtp_mock().send_message.call_args[0][0]
     # sender
     assert email["From"] == "EMAIL@example.com"
     # recipient
@@ -158,3 +169,47 @@ def test_email_post_no_params(client):
 def test_email_post_bad_appid(client):
     response = client.post(path="/email", data={"appid": "BAD-APPID"})
     assert response.status_code == 404
+
+
+# =============================================================================
+# Prepared email templates
+# =============================================================================
+
+TEMPLATES = sorted(
+    path.stem
+    for path in (Path(__file__).parent.parent / "fsfe_forms/templates").glob("*.eml")
+)
+
+
+# Header values must not contain line breaks, body values may
+BODY_VALUE = "Zeile eins  \nZeile zwei mit Ümlaut und einem = "
+HEADER_VALUE = (
+    "Ein sehr langer Wert mit Ümlaut, der umgebrochen werden muss, weil er "
+    "länger als 76 Zeichen ist"
+)
+
+
+@pytest.mark.parametrize("template", TEMPLATES)
+def test_email_skeleton(app, template):
+    """Prepared templates give the same message as parsing the rendered one"""
+    source = app.jinja_env.loader.get_source(app.jinja_env, f"{template}.eml")[0]
+    head, _, body = source.partition("\n\n")
+    context = {}
+    app.update_template_context(context)
+    for part, value in ((body, BODY_VALUE), (head, HEADER_VALUE)):
+        for variable in meta.find_undeclared_variables(app.jinja_env.parse(part)):
+            if variable not in ("format_email", "confirm"):
+                context[variable] = value
+    context["confirm"] = "EMAIL@example.com"
+    expected = email.message_from_string(
+        render_template(f"{template}.eml", **context), policy=email.policy.render
+    )
+    expected.set_charset("utf-8")
+    message = EmailSkeleton(app.jinja_env.overlay(autoescape=False), source).render(
+        context
+    )
+    message["MIME-Version"] = "1.0"
+    message["Content-Type"] = 'text/plain; charset="utf-8"'
+    message["Content-Transfer-Encoding"] = "quoted-printable"
+    assert message.as_string() == expected.as_string()
+    assert message.get_content() == expected.get_content()
@@ -0,0 +1,91 @@
+# =============================================================================
+# Tests of the export of stores
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import json
+from dataclasses import replace
+
+import pytest
+
+from fsfe_forms import json_store
+
+
+@pytest.fixture(params=["signatures.jsonl", "signatures.json"])
+def store(app, tmp_path, request):
+    storage = str(tmp_path / request.param)
+    app.app_configs["pmpc-sign"] = replace(app.app_configs["pmpc-sign"], store=storage)
+    for name, country, public in [
+        ("ONE", "DE", "yes"),
+        ("=TWO", "FR", "yes"),
+        ("THREE", "DE", "no"),
+    ]:
+        json_store.log(
+            storage,
+            "FROM",
+            ["TO"],
+            "SUBJECT",
+            "CONTENT",
+            None,
+            {
+                "appid": "pmpc-sign",
+                "confirm": f"{name}@example.com",
+                "name": name,
+                "country": country,
+                "permissionPub": public,
+            },
+        )
+    return storage
+
+
+def test_export_csv(app, store):
+    result = app.test_cli_runner().invoke(
+        args=[
+            "export",
+            "pmpc-sign",
+            "--flag",
+            "permissionPub",
+            "--columns",
+            "name,country",
+        ]
+    )
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[0] == "timestamp,name,country"
+    # Values which spreadsheets would take as formulas are escaped
+    assert [line.split(",", 1)[1] for line in lines[1:]] == ["ONE,DE", "'=TWO,FR"]
+
+
+def test_export_ndjson(app, store):
+    result = app.test_cli_runner().invoke(
+        args=["export", "pmpc-sign", "--format", "ndjson", "--field", "country=DE"]
+    )
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert [row["name"] for row in rows] == ["ONE", "THREE"]
+    assert rows[0]["confirm"] == "ONE@example.com"
+    result = app.test_cli_runner().invoke(
+        args=["export", "pmpc-sign", "--since", "2999-01-01"]
+    )
+    assert result.output.splitlines() == [
+        "timestamp,confirm," + ",".join(app.app_configs["pmpc-sign"].parameters)
+    ]
+
+
+def test_export_endpoint(app, client, store):
+    assert client.get("/export/pmpc-sign").status_code == 404
+    app.config["EXPORT_TOKEN"] = "SECRET"
+    assert client.get("/export/pmpc-sign").status_code == 401
+    response = client.get(
+        "/export/pmpc-sign",
+        headers={"Authorization": "Bearer WRONG"},
+    )
+    assert response.status_code == 401
+    response = client.get(
+        "/export/pmpc-sign",
+        query_string={"format": "ndjson", "column": ["name"], "flag": "permissionPub"},
+        headers={"Authorization": "Bearer SECRET"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [set(row) for row in rows] == [{"timestamp", "name"}] * 2
@@ -0,0 +1,433 @@
+# =============================================================================
+# Tests of the JSON store
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import json
+import os
+import threading
+
+import pytest
+from filelock import Timeout
+from prometheus_client import REGISTRY
+
+from fsfe_forms import json_store, segments
+
+
+def _log(storage, email="EMAIL@example.com"):
+    json_store.log(
+        storage, "FROM", ["TO"], "SUBJECT", "CONTENT", None, {"confirm": email}
+    )
+
+
+# -----------------------------------------------------------------------------
+# JSON Lines format
+# -----------------------------------------------------------------------------
+
+
+def test_log_jsonl_appends(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    _log(storage, "TWO@example.com")
+    lines = (tmp_path / "store.jsonl").read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])["include_vars"]["confirm"] == "TWO@example.com"
+    assert [r["include_vars"]["confirm"] for r in json_store.read_log(storage)] == [
+        "ONE@example.com",
+        "TWO@example.com",
+    ]
+
+
+def test_snapshot_jsonl(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    records = json_store.snapshot_log(storage)
+    first = next(records)
+    # Records written during the iteration are not included
+    _log(storage, "TWO@example.com")
+    assert first["include_vars"]["confirm"] == "ONE@example.com"
+    assert list(records) == []
+
+
+def test_find_jsonl(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    assert not json_store.find(storage, "EMAIL@example.com")
+    _log(storage)
+    assert json_store.find(storage, "EMAIL@example.com")
+    assert not json_store.find(storage, "OTHER@example.com")
+
+
+# -----------------------------------------------------------------------------
+# Legacy format and migration
+# -----------------------------------------------------------------------------
+
+
+def test_log_legacy(app, tmp_path):
+    storage = str(tmp_path / "store.json")
+    _log(storage)
+    _log(storage)
+    assert len(json.loads((tmp_path / "store.json").read_text())) == 2
+
+
+def test_read_legacy_in_chunks(tmp_path):
+    records = [{"include_vars": {"confirm": f"{i}@example.com"}} for i in range(50)]
+    (tmp_path / "store.json").write_text(json.dumps(records, indent=2))
+    with open(tmp_path / "store.json") as f:
+        assert list(json_store._read_array(f, chunk_size=7)) == records
+
+
+def test_migrate(app, tmp_path):
+    storage = str(tmp_path / "store.json")
+    _log(storage, "ONE@example.com")
+    _log(storage, "TWO@example.com")
+    result = app.test_cli_runner().invoke(args=["store", "migrate", storage])
+    assert result.exit_code == 0
+    assert "Converted 2 records" in result.output
+    records = list(json_store.read_log(str(tmp_path / "store.jsonl")))
+    assert records == json.loads((tmp_path / "store.json").read_text())
+
+
+def test_migrate_refuses_existing_destination(app, tmp_path):
+    storage = str(tmp_path / "store.json")
+    _log(storage)
+    (tmp_path / "store.jsonl").write_text("")
+    result = app.test_cli_runner().invoke(args=["store", "migrate", storage])
+    assert result.exit_code != 0
+    assert "already exists" in result.output
+
+
+# -----------------------------------------------------------------------------
+# Email address index
+# -----------------------------------------------------------------------------
+
+
+def test_find_uses_index(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    assert not json_store.find(storage, "EMAIL@example.com")
+    _log(storage)
+    (tmp_path / "store.jsonl").unlink()
+    # Lookups don't read the store, and email addresses are normalized
+    assert json_store.find(storage, " email@EXAMPLE.com")
+
+
+def test_find_builds_missing_index(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage)
+    app.store_db.flushdb()
+    assert json_store.find(storage, "EMAIL@example.com")
+    assert not json_store.find(storage, "OTHER@example.com")
+
+
+def test_verify_index(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    _log(storage, "TWO@example.com")
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["store", "verify-index", storage])
+    assert result.exit_code == 0
+    app.store_db.srem(
+        json_store._index_key(storage), json_store._hash_email("ONE@example.com")
+    )
+    result = runner.invoke(args=["store", "verify-index", storage])
+    assert result.exit_code != 0
+    assert "1 missing, 0 extra" in result.output
+    result = runner.invoke(args=["store", "verify-index", "--repair", storage])
+    assert result.exit_code == 0
+    assert json_store.verify_index(storage) == (set(), set())
+
+
+# -----------------------------------------------------------------------------
+# Crash safety
+# -----------------------------------------------------------------------------
+
+TORN = b'{"timestamp": 1, "include_vars": {"confi'
+
+
+def test_recover_torn_tail(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    _log(storage, "TWO@example.com")
+    with open(storage, "ab") as f:
+        f.write(TORN)
+    with json_store.lock_store(storage, exclusive=True):
+        assert json_store.recover(storage) == len(TORN)
+        assert json_store.recover(storage) == 0
+    assert _emails(json_store.read_log(storage)) == [
+        "ONE@example.com",
+        "TWO@example.com",
+    ]
+    [torn] = tmp_path.glob("store.jsonl.*.torn")
+    assert torn.read_bytes() == TORN
+
+
+def test_recover_reads_only_the_end(tmp_path):
+    path = tmp_path / "store.jsonl"
+    lines = [json.dumps({"n": n}).encode() + b"\n" for n in range(100)]
+    # Garbage at the start is not looked at, a long torn record at the end is
+    path.write_bytes(b"GARBAGE\n" + b"".join(lines) + b'{"x": "' + b"x" * 50)
+    with open(path, "rb") as f:
+        end = json_store._intact_end(f, path.stat().st_size, chunk_size=16)
+    assert end == len(b"GARBAGE\n" + b"".join(lines))
+
+
+def test_log_repairs_torn_tail(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    with open(storage, "ab") as f:
+        f.write(TORN)
+    _log(storage, "TWO@example.com")
+    assert _emails(json_store.read_log(storage)) == [
+        "ONE@example.com",
+        "TWO@example.com",
+    ]
+
+
+def test_failed_writes_leave_store_intact(app, tmp_path, mocker):
+    for name in ["store.jsonl", "store.json"]:
+        storage = str(tmp_path / name)
+        _log(storage, "ONE@example.com")
+        content = (tmp_path / name).read_bytes()
+        mocker.patch("os.fsync", side_effect=OSError("No space left on device"))
+        with pytest.raises(OSError, match="No space"):
+            _log(storage, "TWO@example.com")
+        mocker.stopall()
+        assert (tmp_path / name).read_bytes() == content
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_recover_command(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage)
+    runner = app.test_cli_runner()
+    assert "OK" in runner.invoke(args=["store", "recover", storage]).output
+    with open(storage, "ab") as f:
+        f.write(TORN)
+    result = runner.invoke(args=["store", "recover", storage])
+    assert f"removed {len(TORN)} bytes" in result.output
+    legacy = tmp_path / "store.json"
+    legacy.write_text('[{"timestamp": 1}, {"times')
+    result = runner.invoke(args=["store", "recover", str(legacy)])
+    assert result.exit_code != 0
+
+
+# -----------------------------------------------------------------------------
+# Segments
+# -----------------------------------------------------------------------------
+
+
+def _emails(records):
+    return [record["include_vars"]["confirm"] for record in records]
+
+
+def test_rotation_by_size(app, tmp_path, mocker):
+    compress = mocker.patch("fsfe_forms.json_store._compress_in_background")
+    app.config["STORE_SEGMENT_MAX_BYTES"] = 1
+    storage = str(tmp_path / "store.jsonl")
+    for email in ["ONE@example.com", "TWO@example.com", "THREE@example.com"]:
+        _log(storage, email)
+    assert compress.call_count == 2
+    assert json_store.compress_segments(storage) == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "store.00001.jsonl.gz",
+        "store.00002.jsonl.gz",
+        "store.jsonl",
+        "store.jsonl.manifest",
+    ]
+    manifest = segments.load_manifest(storage)
+    assert [entry["records"] for entry in manifest["segments"]] == [1, 1]
+    # Reads go through all segments, oldest first
+    expected = ["ONE@example.com", "TWO@example.com", "THREE@example.com"]
+    assert _emails(json_store.read_log(storage)) == expected
+    assert _emails(json_store.snapshot_log(storage)) == expected
+    app.store_db.delete(json_store._index_key(storage))
+    assert json_store.find(storage, "ONE@example.com")
+
+
+def test_adopt_segments_missing_from_manifest(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    # A crash after closing the segment, before adding it to the manifest
+    os.replace(storage, tmp_path / "store.00001.jsonl")
+    _log(storage, "TWO@example.com")
+    with json_store.lock_store(storage, exclusive=True):
+        json_store.recover(storage)
+        # Rotating again does not replace the adopted segment
+        segments.rotate(storage)
+    assert [entry["name"] for entry in segments.load_manifest(storage)["segments"]] == [
+        "store.00001.jsonl",
+        "store.00002.jsonl",
+    ]
+    _log(storage, "THREE@example.com")
+    assert _emails(json_store.read_log(storage)) == [
+        "ONE@example.com",
+        "TWO@example.com",
+        "THREE@example.com",
+    ]
+
+
+def test_rotate_numbers_after_highest(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    with json_store.lock_store(storage, exclusive=True):
+        segments.rotate(storage)
+    # A segment with a higher number than the count of segments
+    os.replace(tmp_path / "store.00001.jsonl", tmp_path / "store.00003.jsonl")
+    manifest = {"segments": [{"name": "store.00003.jsonl", "closed": 0}]}
+    with open(segments.manifest_path(storage), "w") as f:
+        json.dump(manifest, f)
+    _log(storage, "TWO@example.com")
+    with json_store.lock_store(storage, exclusive=True):
+        assert segments.rotate(storage) == str(tmp_path / "store.00004.jsonl")
+    assert _emails(json_store.read_log(storage)) == [
+        "ONE@example.com",
+        "TWO@example.com",
+    ]
+
+
+def test_rotate_command(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage, "ONE@example.com")
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["store", "rotate", storage])
+    assert "compressed 0 segments" in result.output
+    assert segments.due(storage, 0, 1e-6)
+    result = runner.invoke(args=["store", "rotate", "--force", storage])
+    assert result.exit_code == 0
+    assert "compressed 1 segments" in result.output
+    assert not (tmp_path / "store.jsonl").exists()
+    # Snapshots also work before the next write creates the active segment
+    assert _emails(json_store.snapshot_log(storage)) == ["ONE@example.com"]
+    _log(storage, "TWO@example.com")
+    assert _emails(json_store.read_log(storage)) == [
+        "ONE@example.com",
+        "TWO@example.com",
+    ]
+
+
+# -----------------------------------------------------------------------------
+# Group commit
+# -----------------------------------------------------------------------------
+
+
+def test_group_commit_writes_pending_records(app, tmp_path, mocker):
+    app.config["STORE_GROUP_COMMIT_BATCH"] = 10
+    app.config["STORE_GROUP_COMMIT_WINDOW"] = 0
+    storage = str(tmp_path / "store.jsonl")
+    spool = json_store._shared_path(storage, ".pending")
+    os.makedirs(spool)
+    # Records of writers waiting for the lock
+    for number, email in enumerate(["ONE@example.com", "TWO@example.com"]):
+        with open(os.path.join(spool, f"{number:020d}-X.json"), "w") as f:
+            json.dump({"include_vars": {"confirm": email}}, f)
+    fsync = mocker.spy(os, "fsync")
+    _log(storage, "THREE@example.com")
+    assert fsync.call_count == 1
+    assert _emails(json_store.read_log(storage)) == [
+        "ONE@example.com",
+        "TWO@example.com",
+        "THREE@example.com",
+    ]
+    assert os.listdir(spool) == []
+    assert json_store.find(storage, "ONE@example.com")
+
+
+def test_group_commit_failed_batch(app, tmp_path, mocker):
+    app.config["STORE_GROUP_COMMIT_BATCH"] = 10
+    app.config["STORE_GROUP_COMMIT_WINDOW"] = 0
+    storage = str(tmp_path / "store.jsonl")
+    spool = json_store._shared_path(storage, ".pending")
+    os.makedirs(spool)
+    with open(os.path.join(spool, f"{0:020d}-X.json"), "w") as f:
+        json.dump({"include_vars": {"confirm": "ONE@example.com"}}, f)
+    mocker.patch.object(json_store.stats, "count", side_effect=ConnectionError)
+    with pytest.raises(ConnectionError):
+        _log(storage, "TWO@example.com")
+    # The waiting writer learns that its record failed as well
+    assert os.listdir(spool) == [f"{0:020d}-X.json.failed"]
+
+
+def test_group_commit_after_leader_died(app, tmp_path):
+    app.config["STORE_GROUP_COMMIT_BATCH"] = 10
+    app.config["STORE_GROUP_COMMIT_WINDOW"] = 0
+    storage = str(tmp_path / "store.jsonl")
+    spool = json_store._shared_path(storage, ".pending")
+    os.makedirs(spool)
+    # Written by a leader which died before removing it from the spool
+    record = {"include_vars": {"confirm": "ONE@example.com"}, "id": "X"}
+    with open(storage, "w") as f:
+        f.write(json.dumps(record) + "\n")
+    with open(os.path.join(spool, f"{0:020d}-X.json"), "w") as f:
+        json.dump(record, f)
+    _log(storage, "TWO@example.com")
+    records = list(json_store.read_log(storage))
+    assert _emails(records) == ["ONE@example.com", "TWO@example.com"]
+    assert records[0]["id"] == "X"
+    assert records[1]["id"] != "X"
+    assert os.listdir(spool) == []
+    assert json_store.find(storage, "ONE@example.com")
+
+
+def test_group_commit_concurrent(app, tmp_path, mocker):
+    app.config["STORE_GROUP_COMMIT_BATCH"] = 8
+    app.config["STORE_GROUP_COMMIT_WINDOW"] = 0.05
+    storage = str(tmp_path / "store.jsonl")
+    fsync = mocker.spy(os, "fsync")
+
+    def write(number):
+        with app.app_context():
+            _log(storage, f"{number}@example.com")
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(_emails(json_store.read_log(storage))) == sorted(
+        f"{number}@example.com" for number in range(8)
+    )
+    assert fsync.call_count < 8
+
+
+# -----------------------------------------------------------------------------
+# Locking
+# -----------------------------------------------------------------------------
+
+
+def test_lock_stats(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    _log(storage)
+    _log(storage)
+    for phase in ["wait", "hold"]:
+        labels = {"store": storage, "phase": phase}
+        count = REGISTRY.get_sample_value("fsfe_forms_store_lock_seconds_count", labels)
+        assert count == 2
+    labels = {"store": storage, "phase": "hold"}
+    assert REGISTRY.get_sample_value("fsfe_forms_store_lock_seconds_sum", labels) > 0
+
+
+def test_lock_stats_on_failure(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+
+    def fail():
+        with json_store.lock_store(storage, exclusive=True):
+            # Not acquired, so not recorded
+            with pytest.raises(Timeout):
+                _try_lock(storage)
+            raise RuntimeError("FAILED")
+
+    with pytest.raises(RuntimeError, match="FAILED"):
+        fail()
+    labels = {"store": storage, "phase": "wait"}
+    count = REGISTRY.get_sample_value("fsfe_forms_store_lock_seconds_count", labels)
+    assert count == 1
+
+
+def _try_lock(storage):
+    with json_store.lock_store(storage, exclusive=True, blocking=False):
+        pass
+
+
+def test_shared_locks(app, tmp_path):
+    storage = str(tmp_path / "store.jsonl")
+    with json_store.lock_store(storage), json_store.lock_store(storage):
+        assert json_store.find(storage, "EMAIL@example.com") is False
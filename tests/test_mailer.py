@@ -0,0 +1,85 @@
+# =============================================================================
+# Tests of the outbox for emails
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import smtplib
+
+import pytest
+
+from fsfe_forms import mailer
+
+
+@pytest.fixture
+def outbox(app):
+    app.config["MAIL_DELIVERY"] = "outbox"
+    app.config["MAIL_OUTBOX_RETRY_DELAY"] = 0
+    app.config["MAIL_OUTBOX_MAX_ATTEMPTS"] = 2
+    return app.queue_db
+
+
+def _register(client):
+    return client.get(
+        path="/email",
+        query_string={
+            "appid": "contact",
+            "from": "EMAIL@example.com",
+            "subject": "EMAIL-SUBJECT",
+            "content": "EMAIL-CONTENT",
+        },
+    )
+
+
+def test_outbox_delivery(client, smtp_mock, file_mock, outbox):
+    response = _register(client)
+    assert response.status_code == 302
+    assert not smtp_mock.return_value.send_message.called
+    assert outbox.llen(mailer.OUTBOX_KEY) == 1
+    assert mailer.deliver_batch("test") == 1
+    email = smtp_mock.return_value.send_message.call_args[0][0]
+    assert email["Subject"] == "EMAIL-SUBJECT"
+    assert "EMAIL-CONTENT" in email.as_string()
+    assert outbox.llen(mailer.OUTBOX_KEY) == 0
+    assert outbox.llen(mailer._processing_key("test")) == 0
+
+
+def test_outbox_retry_and_dead_letter(app, client, smtp_mock, file_mock, outbox):
+    smtp_mock.return_value.send_message.side_effect = smtplib.SMTPDataError(
+        451, "Try again later"
+    )
+    _register(client)
+    mailer.deliver_batch("test")
+    assert outbox.zcard(mailer.RETRY_KEY) == 1
+    mailer.deliver_batch("test")
+    assert outbox.zcard(mailer.RETRY_KEY) == 0
+    assert outbox.llen(mailer.DEAD_KEY) == 1
+    result = app.test_cli_runner().invoke(args=["mailer", "requeue-dead"])
+    assert "Requeued 1 messages" in result.output
+    smtp_mock.return_value.send_message.side_effect = None
+    assert mailer.deliver_batch("test") == 1
+    assert outbox.llen(mailer.OUTBOX_KEY) == 0
+
+
+def test_outbox_recover(client, smtp_mock, file_mock, outbox):
+    _register(client)
+    # Simulate a worker which died while sending the message
+    outbox.lmove(mailer.OUTBOX_KEY, mailer._processing_key("test"), "RIGHT", "LEFT")
+    assert mailer.recover("test") == 1
+    assert outbox.llen(mailer.OUTBOX_KEY) == 1
+
+
+def test_outbox_release_retries(outbox):
+    outbox.zadd(mailer.RETRY_KEY, {"DUE": 0, "LATER": 2**40})
+    mailer._release_retries()
+    assert outbox.lrange(mailer.OUTBOX_KEY, 0, -1) == [b"DUE"]
+    assert outbox.zrange(mailer.RETRY_KEY, 0, -1) == [b"LATER"]
+
+
+def test_outbox_unexpected_error(app, outbox):
+    outbox.lpush(mailer.OUTBOX_KEY, "NOT-JSON")
+    assert mailer.deliver_batch("test") == 1
+    assert outbox.lrange(mailer.DEAD_KEY, 0, -1) == [b"NOT-JSON"]
+    assert outbox.llen(mailer._processing_key("test")) == 0
+    result = app.test_cli_runner().invoke(args=["mailer", "requeue-dead"])
+    assert "Requeued 0 messages" in result.output
+    assert outbox.llen(mailer.DEAD_KEY) == 1
@@ -0,0 +1,66 @@
+# =============================================================================
+# Tests of the Prometheus metrics
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+from prometheus_client import REGISTRY
+
+
+def _count(endpoint, appid, outcome):
+    return (
+        REGISTRY.get_sample_value(
+            "fsfe_forms_requests_total",
+            {"endpoint": endpoint, "appid": appid, "outcome": outcome},
+        )
+        or 0
+    )
+
+
+def _observations(stage):
+    return (
+        REGISTRY.get_sample_value("fsfe_forms_stage_seconds_count", {"stage": stage})
+        or 0
+    )
+
+
+def test_outcomes(client, smtp_mock, file_mock, signed_up):
+    pending = _count("email", "ln-apply", "pending")
+    confirmed = _count("redeem", "ln-apply", "confirmed")
+    unknown = _count("email", "", "error")
+    invalid = _count("email", "contact", "invalid")
+    client.get("/email", query_string={"appid": "contact"})
+    assert _count("email", "contact", "invalid") == invalid + 1
+    client.get(
+        "/email",
+        query_string={
+            "appid": "ln-apply",
+            "name": "THE NAME",
+            "confirm": "EMAIL@example.com",
+            "activities": "MY ACTIVITIES",
+            "obligatory": "yes",
+        },
+    )
+    assert _count("email", "ln-apply", "pending") == pending + 1
+    client.get("/redeem", query_string={"id": signed_up})
+    assert _count("redeem", "ln-apply", "confirmed") == confirmed + 1
+    # Unknown applications are not labelled with their appid
+    client.get("/email", query_string={"appid": "NO-SUCH-APP"})
+    assert _count("email", "", "error") == unknown + 1
+    assert _count("email", "NO-SUCH-APP", "error") == 0
+
+
+def test_stages(client, smtp_mock, file_mock, signed_up):
+    stages = ["queue_pop", "smtp_connect", "smtp_send", "email_render"]
+    before = [_observations(stage) for stage in stages]
+    client.get("/redeem", query_string={"id": signed_up})
+    after = [_observations(stage) for stage in stages]
+    assert all(a > b for a, b in zip(after, before, strict=True))
+
+
+def test_endpoint(client, smtp_mock, file_mock, signed_up):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    assert 'fsfe_forms_stage_seconds_bucket{le="0.001",stage="queue_push"}' in (
+        response.text
+    )
@@ -0,0 +1,48 @@
+# =============================================================================
+# Tests of the profiling of sampled and slow requests
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import pytest
+
+from fsfe_forms.profiling import init_profiling, list_profiles, load_profile
+
+
+@pytest.fixture
+def profiled(app, tmp_path):
+    app.config["PROFILE_SAMPLE_RATE"] = 1
+    app.config["PROFILE_DIR"] = str(tmp_path)
+    app.config["PROFILE_KEEP"] = 2
+    init_profiling(app)
+    return str(tmp_path)
+
+
+def test_profile_redeem(app, client, smtp_mock, file_mock, signed_up, profiled):
+    client.get("/redeem", query_string={"id": signed_up})
+    [name] = list_profiles(profiled)
+    info = load_profile(profiled, name)
+    assert info["path"] == "/redeem"
+    assert info["status"] == 302
+    assert info["appid"] == "ln-apply"
+    assert "queue_pop" in [stage for stage, _ in info["stages"]]
+    # The parameters of the request are not saved
+    assert signed_up not in str(info)
+
+    result = app.test_cli_runner().invoke(args=["profiles", "dump", name])
+    assert result.exit_code == 0
+    assert "queue_pop" in result.output
+    assert "function calls" in result.output
+
+
+def test_ring_buffer(client, profiled):
+    for _ in range(3):
+        client.get("/")
+    assert len(list_profiles(profiled)) == 2
+
+
+def test_slow_threshold(app, client, tmp_path):
+    app.config["PROFILE_SLOW_THRESHOLD"] = 60
+    app.config["PROFILE_DIR"] = str(tmp_path)
+    init_profiling(app)
+    client.get("/")
+    assert list_profiles(str(tmp_path)) == []
@@ -0,0 +1,72 @@
+# =============================================================================
+# Tests of the double opt-in queue
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.exceptions import NotFound
+
+from fsfe_forms.queue import queue_pop, queue_push
+
+
+def _data(email="EMAIL@example.com", name="THE NAME"):
+    return {"appid": "pmpc-sign", "confirm": email, "name": name}
+
+
+def test_push_reuses_pending_id(app):
+    first = queue_push(_data(name="FIRST"))
+    second = queue_push(_data(email="email@example.com", name="SECOND"))
+    assert first == second
+    assert queue_pop(first)["name"] == "SECOND"
+
+
+def test_push_after_pop_creates_new_id(app):
+    first = queue_push(_data())
+    queue_pop(first)
+    second = queue_push(_data())
+    assert first != second
+    with pytest.raises(NotFound):
+        queue_pop(first)
+
+
+def test_reindex(app):
+    # A registration queued before the index existed
+    the_id = uuid.uuid4()
+    app.queue_db.set(the_id.hex, json.dumps(_data()), 3600)
+    result = app.test_cli_runner().invoke(args=["queue", "reindex"])
+    assert result.exit_code == 0
+    assert "Created 1 index entries" in result.output
+    assert queue_push(_data()) == the_id
+    assert 0 < app.queue_db.ttl(the_id.hex) <= 3600
+
+
+# -----------------------------------------------------------------------------
+# Concurrency
+# -----------------------------------------------------------------------------
+
+
+def _in_app(app, function, *args):
+    with app.app_context():
+        try:
+            return function(*args)
+        except NotFound:
+            return None
+
+
+def test_concurrent_pop(app):
+    the_id = queue_push(_data())
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(lambda _: _in_app(app, queue_pop, the_id), range(8))
+        )
+    assert len([result for result in results if result is not None]) == 1
+
+
+def test_concurrent_push(app):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        ids = set(executor.map(lambda _: _in_app(app, queue_push, _data()), range(8)))
+    assert len(ids) == 1
@@ -0,0 +1,43 @@
+# =============================================================================
+# Tests of the rate limits
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+from dataclasses import replace
+
+from fsfe_forms.ratelimit import init_ratelimit
+
+
+def _contact(client, appid="contact"):
+    return client.get(
+        path="/email",
+        query_string={
+            "appid": appid,
+            "from": "EMAIL@example.com",
+            "subject": "EMAIL-SUBJECT",
+            "content": "EMAIL-CONTENT",
+        },
+    )
+
+
+def test_limit_per_app(app, client, smtp_mock, file_mock):
+    contact = app.app_configs["contact"]
+    app.app_configs["contact"] = replace(contact, ratelimit="2 per minute")
+    app.app_configs["contact2"] = replace(contact, ratelimit="1 per minute")
+    assert _contact(client).status_code == 302
+    assert _contact(client).status_code == 302
+    assert _contact(client).status_code == 429
+    # Other applications have their own counters
+    assert _contact(client, "contact2").status_code == 302
+    assert _contact(client, "contact2").status_code == 429
+
+
+def test_storage_uri(app):
+    app.config["RATELIMIT_STORAGE_URI"] = None
+    app.config["REDIS_HOST"] = "localhost"
+    app.config["REDIS_PASSWORD"] = "SECRET/PASSWORD"
+    app.testing = False
+    init_ratelimit(app)
+    assert app.config["RATELIMIT_STORAGE_URI"] == (
+        "redis://:SECRET%2FPASSWORD@localhost:6379/3"
+    )
@@ -0,0 +1,75 @@
+# =============================================================================
+# Tests of the pool of SMTP connections
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import email.message
+import smtplib
+
+import pytest
+
+from fsfe_forms.email import send_email
+
+
+def _send(name="THE NAME"):
+    return send_email(
+        template="contact-register",
+        **{"from": "EMAIL@example.com", "subject": name, "content": "CONTENT"},
+    )
+
+
+def test_connection_reused(app, smtp_mock):
+    _send()
+    _send()
+    assert smtp_mock.call_count == 1
+    assert smtp_mock.return_value.send_message.call_count == 2
+    smtp_mock.return_value.noop.assert_called_once()
+
+
+def test_unhealthy_connection_replaced(app, smtp_mock):
+    _send()
+    smtp_mock.return_value.noop.side_effect = smtplib.SMTPServerDisconnected
+    _send()
+    assert smtp_mock.call_count == 2
+
+
+def test_broken_connection_retried(app, smtp_mock):
+    smtp_mock.return_value.send_message.side_effect = [
+        smtplib.SMTPServerDisconnected,
+        None,
+    ]
+    _send()
+    assert smtp_mock.call_count == 2
+    assert smtp_mock.return_value.send_message.call_count == 2
+
+
+def test_connection_used_up(app, smtp_mock):
+    app.config["MAIL_POOL_MAX_MESSAGES"] = 2
+    for _ in range(3):
+        _send()
+    assert smtp_mock.call_count == 2
+    smtp_mock.return_value.quit.assert_called_once()
+
+
+def test_idle_connection_closed(app, smtp_mock):
+    app.config["MAIL_POOL_MAX_IDLE"] = -1
+    _send()
+    _send()
+    assert smtp_mock.call_count == 2
+    smtp_mock.return_value.noop.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "errors",
+    [
+        [smtplib.SMTPDataError(554, b"REJECTED")],
+        [smtplib.SMTPServerDisconnected(), smtplib.SMTPSenderRefused(550, b"", "")],
+    ],
+)
+def test_pool_closes_failed_connections(app, smtp_mock, errors):
+    smtp = smtp_mock.return_value
+    smtp.send_message.side_effect = errors
+    with pytest.raises(type(errors[-1])):
+        app.smtp_pool.send(email.message.EmailMessage())
+    assert smtp.close.call_count == len(errors)
+    assert app.smtp_pool.idle == []
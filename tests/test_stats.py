@@ -0,0 +1,87 @@
+# =============================================================================
+# Tests of the statistics of the stored registrations
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+from dataclasses import replace
+
+from fsfe_forms import json_store
+
+
+def _store(storage, **include_vars):
+    json_store.log(
+        storage,
+        "FROM",
+        ["TO"],
+        "SUBJECT",
+        "CONTENT",
+        None,
+        {"appid": "pmpc-sign", "confirm": "EMAIL@example.com", **include_vars},
+    )
+
+
+def test_stats(app, client, file_mock):
+    storage = app.app_configs["pmpc-sign"].store
+    _store(storage, country="de", lang="en", permissionPub="yes")
+    _store(storage, country="DE", lang="de")
+    _store(storage, country="Somewhere", permissionPub="no")
+    response = client.get("/stats/pmpc-sign")
+    assert response.status_code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert response.json == {
+        "appid": "pmpc-sign",
+        "total": 3,
+        "public": 1,
+        "countries": {"DE": 2, "other": 1},
+        "languages": {"de": 1, "en": 1},
+    }
+    # The answer is cached
+    _store(storage)
+    assert client.get("/stats/pmpc-sign").json["total"] == 3
+    app.stats_cache.clear()
+    assert client.get("/stats/pmpc-sign").json["total"] == 4
+
+
+def test_no_stats(app, client, tmp_path):
+    assert client.get("/stats/contact").status_code == 404
+    assert client.get("/stats/NO-SUCH-APP").status_code == 404
+    # Registrations of applications without stats are not counted
+    storage = str(tmp_path / "signatures.jsonl")
+    app.app_configs["pmpc-sign"] = replace(app.app_configs["pmpc-sign"], stats=False)
+    _store(storage)
+    assert not app.store_db.exists("stats:pmpc-sign")
+    result = app.test_cli_runner().invoke(args=["stats", "reconcile", "pmpc-sign"])
+    assert "No statistics for pmpc-sign" in result.output
+
+
+def test_reconcile(app, client, tmp_path):
+    storage = str(tmp_path / "signatures.jsonl")
+    app.app_configs["pmpc-sign"] = replace(app.app_configs["pmpc-sign"], store=storage)
+    _store(storage, country="FR", permissionPub="true")
+    _store(storage, country="FR")
+    app.store_db.delete("stats:pmpc-sign")
+    result = app.test_cli_runner().invoke(args=["stats", "reconcile", "pmpc-sign"])
+    assert "pmpc-sign: 2 registrations" in result.output
+    stats = client.get("/stats/pmpc-sign").json
+    assert stats["countries"] == {"FR": 2}
+    assert stats["public"] == 1
+
+
+def test_reconcile_during_writes(app, client, tmp_path, mocker):
+    storage = str(tmp_path / "signatures.jsonl")
+    app.app_configs["pmpc-sign"] = replace(app.app_configs["pmpc-sign"], store=storage)
+    _store(storage, country="FR")
+    _store(storage, country="FR")
+    app.store_db.delete("stats:pmpc-sign")
+    snapshot_log = json_store.snapshot_log
+
+    def write_while_reading(*args):
+        for number, record in enumerate(snapshot_log(*args)):
+            if number == 0:
+                _store(storage, country="NL")
+            yield record
+
+    mocker.patch.object(json_store, "snapshot_log", write_while_reading)
+    result = app.test_cli_runner().invoke(args=["stats", "reconcile", "pmpc-sign"])
+    assert "pmpc-sign: 3 registrations" in result.output
+    assert client.get("/stats/pmpc-sign").json["countries"] == {"FR": 2, "NL": 1}
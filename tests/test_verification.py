@@ -0,0 +1,130 @@
+# =============================================================================
+# Tests of the email address verification cache
+# =============================================================================
+# This file is part of the FSFE Form Server.
+
+import time
+
+import pytest
+from validate_email.exceptions import (
+    AddressNotDeliverableError,
+    DNSTimeoutError,
+    NoMXError,
+    SMTPCommunicationError,
+    SMTPTemporaryError,
+)
+
+from fsfe_forms.verification import _hash_address, init_verification, verify_email
+
+
+@pytest.fixture
+def dns_mock(mocker):
+    return mocker.patch(
+        "fsfe_forms.verification.dns_check", return_value=["mx.example.com"]
+    )
+
+
+@pytest.fixture
+def probe_mock(mocker):
+    return mocker.patch("fsfe_forms.verification.smtp_check", return_value=True)
+
+
+def test_verdict_cached(app, dns_mock, probe_mock):
+    assert verify_email("EMAIL@example.com") is True
+    assert verify_email("email@example.com") is True
+    # Shared cache only
+    app.verification_cache.clear()
+    assert verify_email("EMAIL@example.com") is True
+    assert probe_mock.call_count == 1
+    stats = app.cache_db.hgetall("verify:stats")
+    assert stats[b"address:miss"] == b"1"
+    assert stats[b"address:local_hit"] == b"1"
+    assert stats[b"address:redis_hit"] == b"1"
+
+
+def test_mx_records_cached_per_domain(app, dns_mock, probe_mock):
+    verify_email("ONE@example.com")
+    verify_email("TWO@EXAMPLE.com")
+    assert dns_mock.call_count == 1
+    assert probe_mock.call_count == 2
+
+
+def test_negative_results(app, dns_mock, probe_mock):
+    dns_mock.side_effect = NoMXError
+    assert verify_email("ONE@example.com") is False
+    assert app.cache_db.ttl("verify:domain:example.com") == 3600
+    probe_mock.side_effect = AddressNotDeliverableError({})
+    dns_mock.side_effect = None
+    assert verify_email("TWO@example.org") is False
+    assert verify_email("TWO@example.org") is False
+    assert probe_mock.call_count == 1
+
+
+def test_timeout_not_cached(app, dns_mock, probe_mock):
+    dns_mock.side_effect = DNSTimeoutError
+    assert verify_email("EMAIL@example.com") is False
+    dns_mock.side_effect = None
+    assert verify_email("EMAIL@example.com") is True
+
+
+def test_purge(app, dns_mock, probe_mock):
+    verify_email("EMAIL@example.com")
+    result = app.test_cli_runner().invoke(
+        args=["email-cache", "purge", "--domain", "example.com"]
+    )
+    assert "Purged 1 entries" in result.output
+    result = app.test_cli_runner().invoke(args=["email-cache", "purge", "--all"])
+    assert "Purged 1 entries" in result.output
+    assert app.cache_db.exists("verify:stats")
+
+
+# -----------------------------------------------------------------------------
+# Deadline and parallel probes
+# -----------------------------------------------------------------------------
+
+
+def test_deadline(app, dns_mock, probe_mock):
+    app.config["EMAIL_VERIFY_DEADLINE"] = 0.1
+    probe_mock.side_effect = lambda **_kwargs: time.sleep(1)
+    start = time.monotonic()
+    assert verify_email("EMAIL@example.com") is None
+    assert time.monotonic() - start < 0.5
+    # Timeouts are not cached
+    assert not app.cache_db.exists(
+        f"verify:address:{_hash_address('EMAIL@example.com')}"
+    )
+
+
+def test_parallel_probes(app, dns_mock, probe_mock):
+    dns_mock.return_value = ["slow.example.com", "fast.example.com"]
+
+    def probe(mx_records, **kwargs):
+        if mx_records == ["slow.example.com"]:
+            time.sleep(1)
+        return True
+
+    probe_mock.side_effect = probe
+    start = time.monotonic()
+    assert verify_email("EMAIL@example.com") is True
+    assert time.monotonic() - start < 0.5
+
+
+def test_parallel_probes_temporary_error(app, dns_mock, probe_mock):
+    dns_mock.return_value = ["one.example.com", "two.example.com"]
+    probe_mock.side_effect = [
+        SMTPTemporaryError({}),
+        SMTPCommunicationError({}),
+    ]
+    assert verify_email("EMAIL@example.com") is None
+
+
+def test_no_mail_servers(app, dns_mock, probe_mock):
+    dns_mock.return_value = []
+    assert verify_email("EMAIL@example.com") is False
+    assert not probe_mock.called
+
+
+def test_parallel_probes_config(app):
+    app.config["EMAIL_VERIFY_PARALLEL_PROBES"] = 0
+    with pytest.raises(ValueError, match="EMAIL_VERIFY_PARALLEL_PROBES"):
+        init_verification(app)